@@ -6,16 +6,29 @@
 # or the full set of data from the database.
 #
 
-import MySQLdb
 import argparse
-import ConfigParser
 import datetime
+import os
 
+from functools import partial
 from collections import OrderedDict
 from os.path import join
-from itertools import chain
-from wwarncalculations import calculateWWARNStatistics
-from wwarnutils import parseAgeGroups, parseCopyNumberGroups, preBinCopyNumberData
+from wwarnbootstrap import calculateBootstrapIntervals, BOOTSTRAP_METHODS, DEFAULT_REPLICATES, SITE_LEVEL
+from wwarncalculations import calculateWWARNStatistics, PREVIEW_MIN_SECONDS
+from wwarncheckpoint import Checkpoint, iterateStages
+from wwarnaggregate import ExternalCountTable, calculateSpilledWWARNStatistics
+from wwarncompress import openOutput, COMPRESSION_EXTENSIONS
+from wwarnconfig import loadConfigBundle
+from wwarncube import buildResultCube, HierarchicalRollUp, ROLL_UP_LEVELS
+from wwarncubefile import writeResultCube, getDefaultResultPath
+from wwarnintervals import calculateIntervalLookup, INTERVAL_METHODS
+from wwarnexceptions import StratificationException, ConfigBundleException
+from wwarnfacttable import buildFactQueryStatement, getFactCombinationMarkerData, UNCALLED_GENOTYPES
+from wwarnhistogram import FineHistogram, loadHistogram, rebinHistogram, HISTOGRAM_EXTENSION
+from wwarnpipeline import RowPipeline
+from wwarnquery import buildFilterClause, PreparedStatementCache
+from wwarnstatus import calculateMutantStatusStatistics, writeMutantStatusHeader, writeMutantStatusRows, writeMutantStatusFile
+from wwarnutils import preBinCopyNumberData, canonicalGenotype
 
 from wwarnutils import pprint
 
@@ -42,129 +55,190 @@ def buildArgParser():
     parser.add_argument("-o", "--output_directory", required=True, help="Desired output directory to write"
                         + " all calculations to.")
     parser.add_argument("-p", "--output_prefix", required=True, help="Desired output file prefix.")
+    parser.add_argument("--preview_interval", required=False, type=int, help="Publish a preview of the "
+                        + "sample sizes and prevalences calculated so far every N rows of data. Previews are "
+                        + "written to <output_prefix>.preview.calcs in the output directory")
+    parser.add_argument("--preview_seconds", required=False, type=float, default=PREVIEW_MIN_SECONDS,
+                        help="Minimum number of seconds between two previews. Previews due sooner are skipped "
+                        + "as each one walks all of the statistics tabulated so far")
+    parser.add_argument("--config_bundle", required=False, help="The compiled configuration bundle to use. "
+                        + "Defaults to the configuration file path with a .bundle extension")
+    parser.add_argument("--checkpoint_interval", required=False, type=int, default=500000, help="Write a "
+                        + "checkpoint of the calculation every N rows of data and after every combination marker "
+                        + "procedure. Checkpoints are written to <output_prefix>.checkpoint in the output directory. "
+                        + "Set to 0 to only checkpoint after each procedure")
+    parser.add_argument("--resume", required=False, action='store_true', default=False, help="Resume the "
+                        + "calculation from the last checkpoint written for this output prefix. The database must "
+                        + "not have been loaded into since the checkpoint was written")
+    parser.add_argument("--max_genotypes", required=False, type=int, help="Bound the memory used while "
+                        + "tabulating by spilling partial counts to disk whenever more than N genotype counters "
+                        + "are held in memory. Cannot be combined with --resume or --preview_interval")
+    parser.add_argument("--spill_directory", required=False, help="Directory spill files are written to when "
+                        + "--max_genotypes is set. Defaults to the output directory")
+    parser.add_argument("--confidence_interval", required=False, choices=INTERVAL_METHODS, help="Add the "
+                        + "confidence interval of each prevalence to our output using the given method")
+    parser.add_argument("--confidence_level", required=False, type=float, default=0.95, help="Confidence level "
+                        + "of the intervals added by --confidence_interval. Defaults to 0.95")
+    parser.add_argument("--pipeline_queue_size", required=False, type=int, default=8, help="Fetch and "
+                        + "transform rows in background threads up to N batches ahead of the rows being "
+                        + "tabulated. Set to 0 to fetch and tabulate rows in sequence")
+    parser.add_argument("--use_fact_table", required=False, action='store_true', default=False, help="Query "
+                        + "the denormalized genotype fact table instead of joining the normalized WWARN tables")
+    parser.add_argument("--compress", required=False, choices=sorted(COMPRESSION_EXTENSIONS), help="Compress "
+                        + "the .all.calcs and .age.calcs output files in the given format. The extension of the "
+                        + "format (i.e. .gz) is added to each file name")
+    parser.add_argument("--mutant_status", required=False, action='store_true', default=False, help="Also write "
+                        + "the prevalence of each mutant status (Wild/Mutant/Mixed) of every SNP locus to a "
+                        + ".status.calcs file. Requires the mutant_status option in the [GENERAL] section of the "
+                        + "configuration file")
+    parser.add_argument("--roll_up", required=False, action='store_true', default=False, help="Also pool the "
+                        + "site-level statistics into study, country and global statistics, written to .study.calcs, "
+                        + ".country.calcs and .global.calcs files. All levels are derived from a single run")
+    parser.add_argument("--keep_histograms", required=False, action='store_true', default=False, help="Also keep "
+                        + "a histogram of the unbinned age, copy number and month of inclusion of every row in a "
+                        + ".histogram file so that new groupings can be calculated with --from_histogram. Cannot "
+                        + "be combined with --resume or --max_genotypes")
+    parser.add_argument("--from_histogram", required=False, help="Calculate our statistics from a histogram kept "
+                        + "by --keep_histograms under the groups of the current configuration instead of "
+                        + "querying the database")
+    parser.add_argument("--bootstrap", required=False, choices=BOOTSTRAP_METHODS, help="Add the bootstrap "
+                        + "percentile interval of each prevalence to our tables, resampling either the sites pooled "
+                        + "into each prevalence or the patients of each site. Intervals are calculated at the "
+                        + "--confidence_level and cannot be combined with --max_genotypes")
+    parser.add_argument("--bootstrap_replicates", required=False, type=int, default=DEFAULT_REPLICATES,
+                        help="Number of bootstrap replicates drawn for each prevalence. Defaults to %s"
+                        % DEFAULT_REPLICATES)
+    parser.add_argument("--bootstrap_seed", required=False, type=int, default=0, help="Seed of the random "
+                        + "number generator our bootstrap replicates are drawn with. Defaults to 0")
+    parser.add_argument("--bootstrap_processes", required=False, type=int, default=1, help="Number of worker "
+                        + "processes bootstrap replicates are drawn by. Defaults to 1")
  
     args = parser.parse_args()
-    return args
-
-def parseMarkerList(markerList):
-    """
-    Parses the passed in marker list to produce a dictionary that is used to group
-    statistics returned from the calculation module into the categories that are 
-    required in our output.
-
-    Marker list file will be in format as described below:
-
-    # LOCUS NAME\tLOCUS POSITION\tGENOTYPE\tCATEGORY\tLABEL\tPROCEDURE
-    pfdhps\t436\tC\tpfdhps 436c\tPure
-    
-    The CATEGORY AND LABEL fields are optional and will only be used if present
-    when producing output files. Dictionary structure housing the values parsed
-    from the input file below:
-    
-    dict = (LOCUS NAME, LOCUS POSITION, GENOTYPE) = { 
-                category: CATEGORY
-                label: LABEL
 
-    If the PROCEDURE field is defined we will want to store all of the information
-    for this line in our marker list into our marker combination list:
-        [ 'locus name1', 'locus position1', 'genotype1 .... ]
-    """
-    markerLookup = {}
-    combinationsList = {}
+    if args.max_genotypes and (args.resume or args.preview_interval):
+        parser.error("--max_genotypes cannot be combined with --resume or --preview_interval")
 
-    markerListFH = open(markerList)
-    for line in markerListFH:
-        if line.startswith('#'):
-            continue
+    if args.bootstrap and args.max_genotypes:
+        parser.error("--bootstrap cannot be combined with --max_genotypes")
 
-        (nameRaw, posRaw, type, genotypeRaw, category, label, procedure) = line.rstrip('\n').split('\t')
+    if args.keep_histograms and (args.resume or args.max_genotypes):
+        parser.error("--keep_histograms cannot be combined with --resume or --max_genotypes")
 
-        name = commaDelimToTuple(nameRaw)
-        pos = commaDelimToTuple(posRaw)
-        genotype = commaDelimToTuple(genotypeRaw)            
+    if args.from_histogram and (args.resume or args.max_genotypes or args.preview_interval or args.keep_histograms):
+        parser.error("--from_histogram cannot be combined with --resume, --max_genotypes, --preview_interval "
+                     + "or --keep_histograms")
 
-        markerTuple = tuple(zip(name, pos))
+    return args
 
-        markerLookup.setdefault(markerTuple, {} )
-        markerLookup.get(markerTuple).setdefault('valid', [])
-        markerLookup.get(markerTuple).setdefault(genotype, {})
+def createMysqlIterator(config, studyIds, sites, cnBins, comboList, year_step, useFactTable=False,
+                        state=None, checkpoint=None, resume=None, queueSize=0, histogram=None):
+    """
+    Takes a configuration file containing login credentials to the WWARN DB and 
+    a set of query parameters to contruct a query to pull down data that will be 
+    used in generating our calculations. Yields a list of data for each line of results.
 
-        # All valid genotypes for a given marker (locus name + position) 
-        # are placed into a list that will be used when printing output
-        markerLookup.get(markerTuple).get('valid').append(genotype)        
+    If useFactTable is set data is pulled from the denormalized genotype fact 
+    table (see wwarnfacttable.py) rather than the normalized WWARN tables.
 
-        # On a per-genotyped basis we want to store the category that this genotype
-        # will be grouped under as well as the label (i.e. Pure, Mixed).        
-        markerLookup[markerTuple][genotype]['category'] = category
-        markerLookup[markerTuple][genotype]['label'] = label
+    Data is pulled down in stages, the single marker query followed by one stage 
+    per combination marker. If a Checkpoint is passed in, the state being tabulated
+    is checkpointed while rows are yielded and a checkpoint passed in as resume is 
+    picked up from (see wwarncheckpoint.py).
 
-        # In order to adequately deal with combination markers we 
-        # need to create a separate data structure to contain 
-        # the stored procedure call we will use as well as the
-        # arguments that should be passed to the procedure.
-        if procedure and procedure not in combinationsList:
-            combinationsList[procedure] = zip(name, pos)
+    If a queue size is given rows are fetched and transformed in background 
+    threads, queueSize batches ahead of the rows being tabulated (see 
+    wwarnpipeline.py). 
 
-    markerListFH.close()
-    return (markerLookup, combinationsList)
+    Every query is executed as a server-side prepared statement that is 
+    reused by any later query of the same form (see wwarnquery.py).
 
-def commaDelimToTuple(str):
-    """
-    Splits a comma-delimited list and converts it to a tuple
+    If a FineHistogram is passed in every row is counted into it before it
+    is binned (see wwarnhistogram.py).
     """
-    return tuple(str.split(','))
+    if useFactTable:
+        (queryList, params) = buildFactQueryStatement(studyIds, sites)
+        orderStmt = " ORDER BY f.id_genotype"
+    else:
+        (queryList, params) = buildQueryStatement(studyIds, sites)
+        orderStmt = " ORDER BY g.id_genotype"
 
-def createMysqlIterator(config, studyIds, sites, cnBins, comboList, year_step):
-    """
-    Takes a configuration file containing login credentials to the WWARN DB and 
-    a set of query parameters to contruct a query to pull down data that will be 
-    used in generating our calculations. Yields a list of data for each line of results.
-    """
-    queryList = buildQueryStatement(studyIds, sites)
-    query = " ".join(queryList)
+    # Rows are ordered on their genotype so that a resumed run reads them back 
+    # in the same order. A resumed run skips the number of rows recorded in its
+    # checkpoint, so it relies on this order staying stable between the two runs
+    # (see wwarncheckpoint.py).
+    query = " ".join(queryList) + orderStmt
 
     dbConn = openDBConnection(config)
-    dbCursor = dbConn.cursor()
-    params = studyIds + sites
-
-    dbCursor.execute(query, params)
-    rows = dbCursor.fetchall()
-    dbCursor.close()
-    rows = []
-    comboRows = getCombinationMarkerData(dbConn, queryList[2], params, comboList)
+    statements = PreparedStatementCache(dbConn)
+
+    # Combination markers are still named after the stored procedure that used 
+    # to pull them down so that their stages match those of older checkpoints
+    stages = [('single_markers', partial(fetchQueryRows, statements, query, params, bool(queueSize)))]
+    for (procedure, loci) in comboList.iteritems():
+        if useFactTable:
+            stages.append((procedure, partial(getFactCombinationMarkerData, statements, loci, studyIds, sites)))
+        else:
+            stages.append((procedure, partial(getCombinationMarkerData, statements, loci, studyIds, sites)))
     
     ## If we are also splitting by year-bins we need to generate our year ranges
     year_bins = None
     if year_step:
         # Will need the lower bound and upper bound of the dates in order to 
         # generate our date bins
-        year_bounds = get_date_bounds(dbConn, queryList, params)
+        year_bounds = get_date_bounds(statements, queryList, params, useFactTable)
         year_bins = create_year_bins(year_step, year_bounds)
 
-    rows = rows[0:] + comboRows
-    for row in list(rows):
-        label = row[1]
-        doi = row[7]
-        site = row[4]
-        marker = row[8]
-        genotype = row[9]
-
-        # Update our site if we are binning by years
-        site = parse_site(site, label, doi, year_bins)
-        row = row[0:4] + (site,) + row[5:7] + row[8:]
-
-        # Convert to abbreviated format to match listing in valid marker file
-        marker = marker.replace('Copy Number', 'CN')
-        marker = marker.replace('Genotype Fragment', 'FRAG')
-        
-    
-        # Check to see if our marker type is copy number (and in the future 
-        # genotype fragment)
-        if marker.find('CN') != -1 and genotype not in ['Genotyping Failure', 'Not Genotyped']:
-            genotype = preBinCopyNumberData(genotype, cnBins)
-            row = row[0:8] + (marker, genotype)
+    transform = partial(transformRow, cnBins=cnBins, year_bins=year_bins, histogram=histogram)
 
-        yield row
+    if not queueSize:
+        for row in iterateStages(stages, state, checkpoint, resume):
+            yield transform(row)
+        return
+
+    # Stages completed before a resumed run are never fetched
+    if resume:
+        stages = [s for s in stages if s[0] not in resume.get('completed')]
+
+    pipeline = RowPipeline(stages, transform, queueSize)
+    try:
+        for row in iterateStages(pipeline.start(), state, checkpoint, resume):
+            yield row
+    finally:
+        pipeline.close()
+
+def transformRow(row, cnBins, year_bins, histogram=None):
+    """
+    Converts a row pulled down from the database into the row format our 
+    calculations expect, binning its site by year, abbreviating its marker
+    type and normalizing and binning its genotype(s). If a FineHistogram is
+    passed in the row is counted into it before being binned.
+    """
+    label = row[1]
+    doi = row[7]
+    site = row[4]
+    marker = row[8]
+    genotype = row[9]
+
+    # Convert to abbreviated format to match listing in valid marker file
+    marker = marker.replace('Copy Number', 'CN')
+    marker = marker.replace('Genotype Fragment', 'FRAG')
+
+    # Normalize our genotype(s) so that equivalent calls (i.e. A/B and B/A) 
+    # are counted together
+    genotype = " + ".join([canonicalGenotype(g) for g in genotype.split(' + ')])
+
+    if histogram is not None:
+        histogram.addRow(row[0:7] + (marker, genotype), doi)
+
+    # Update our site if we are binning by years
+    site = parse_site(site, label, doi, year_bins)
+
+    # Check to see if our marker type is copy number (and in the future 
+    # genotype fragment)
+    if marker.find('CN') != -1 and genotype not in ['Genotyping Failure', 'Not Genotyped']:
+        genotype = preBinCopyNumberData(genotype, cnBins)
+
+    return row[0:4] + (site,) + row[5:7] + (marker, genotype)
     
 def parse_site(site, label, doi, year_bins):
     """
@@ -181,7 +255,8 @@ def parse_site(site, label, doi, year_bins):
 
 def buildQueryStatement(studyIds, sites):
     """
-    Builds the query statement sent off to the database.
+    Builds the query statement sent off to the database. Returns a tuple of the 
+    [SELECT, FROM, WHERE] components of the query and its parameters.
 
     This is a placeholder function that will involve much more once this script
     is convereted to CGI
@@ -193,32 +268,51 @@ def buildQueryStatement(studyIds, sites):
                "JOIN sample sp ON sp.fk_subject_id = p.id_subject " \
                "JOIN genotype g ON g.fk_sample_id = sp.id_sample " \
                "JOIN marker m ON m.id_marker = g.fk_marker_id "
-    
-    whereStmt = "WHERE "
-    if studyIds:
-        whereStmt += buildWhereStmt('s.wwarn_study_id', studyIds)
 
-    if sites:        
-        whereStmt += buildWhereStmt('l.site', sites)
-    
-    whereStmt = whereStmt.rstrip(" AND ")
-    whereStmt = whereStmt.rstrip("WHERE ")
-    return [selectStmt, fromStmt, whereStmt]
+    (whereStmt, params) = buildFilterClause([('s.wwarn_study_id', studyIds), ('l.site', sites)])
+    return ([selectStmt, fromStmt, whereStmt], params)
 
-def buildWhereStmt(key, values):
+def buildComboStatement(loci, studyIds, sites):
     """
-    Constructs the where statement portion of our query based off the key and 
-    values passed in. For each value a key = %s placeholder is generated 
-    to be replaced during the query execute.
+    Builds the query pulling down combination marker data for the given list of
+    (LOCUS NAME, LOCUS POSITION) tuples. A sample, genotype and marker are 
+    joined in once per locus in the same way as the haplotype stored procedures,
+    but the loci and our filters are passed in as parameters rather than 
+    written into the query. Returns a tuple of the query and its parameters.
     """
-    where = " ("
+    indexes = range(1, len(loci) + 1)
 
-    for val in values:
-        where += key + "=%s OR "
-    
-    where = where.rstrip("OR ")
-    where += ") AND "
-    return where
+    selectStmt = "SELECT s.wwarn_study_id, s.label, s.investigator, l.country, l.site, p.patient_id, p.age, " \
+                 "p.date_of_inclusion, "
+    selectStmt += "CONCAT(%s) AS \"marker\", " % ", \" + \", ".join(["m%s.locus_name, \"_\", m%s.locus_position, "
+                                                                     "\"_\", m%s.type" % (i, i, i) for i in indexes])
+    selectStmt += "CONCAT(%s) AS \"genotype\" " % ", \" + \", ".join(["g%s.value" % i for i in indexes])
+
+    fromStmt = "FROM study s JOIN location l ON s.id_study = l.fk_study_id " \
+               "JOIN subject p ON p.fk_location_id = l.id_location "
+    for i in indexes:
+        fromStmt += "JOIN sample sp%s ON sp%s.fk_subject_id = p.id_subject " % (i, i)
+        fromStmt += "JOIN genotype g%s ON g%s.fk_sample_id = sp%s.id_sample " % (i, i, i)
+        fromStmt += "JOIN marker m%s ON m%s.id_marker = g%s.fk_marker_id " % (i, i, i)
+
+    conditions = []
+    params = []
+    for (i, (name, position)) in zip(indexes, loci):
+        conditions.append("m%s.locus_name = %%s AND m%s.locus_position = %%s" % (i, i))
+        conditions.append("g%s.value NOT IN (%s)" % (i, ", ".join(["%s"] * len(UNCALLED_GENOTYPES))))
+        params.extend([name, position] + UNCALLED_GENOTYPES)
+
+    whereStmt = "WHERE " + " AND ".join(conditions)
+    (filterStmt, filterParams) = buildFilterClause([('s.wwarn_study_id', studyIds), ('l.site', sites)], 'AND')
+    if filterStmt:
+        whereStmt += " " + filterStmt
+        params.extend(filterParams)
+
+    # Ordered so that the rows come back in the same order on every run, which a
+    # resumed run relies on (see wwarncheckpoint.py)
+    orderStmt = " ORDER BY %s" % ", ".join(["g%s.id_genotype" % i for i in indexes])
+
+    return (selectStmt + fromStmt + whereStmt + orderStmt, params)
 
 def create_year_bins(step, bounds):
     """
@@ -253,14 +347,17 @@ def date_range(start, stop, step):
     
     return output        
 
-def get_date_bounds(conn, query_components, params):
+def get_date_bounds(statements, query_components, params, useFactTable=False):
     """
     Gets the lower and upper bound of dates for the given study.
     """
-    cursor = conn.cursor()
-
-    query = "SELECT s.label, l.site, MIN(p.date_of_inclusion), MAX(p.date_of_inclusion) " + query_components[1] + query_components[2]
-    cursor.execute(query, params)
+    if useFactTable:
+        query = "SELECT f.label, f.site, MIN(f.date_of_inclusion), MAX(f.date_of_inclusion) " + query_components[1] + \
+                query_components[2] + " GROUP BY f.label, f.site"
+    else:
+        query = "SELECT s.label, l.site, MIN(p.date_of_inclusion), MAX(p.date_of_inclusion) " + query_components[1] + \
+                query_components[2] + " GROUP BY s.label, l.site"
+    cursor = statements.execute(query, params)
     rows = cursor.fetchall()
     cursor.close()           
     
@@ -274,6 +371,9 @@ def openDBConnection(config):
 
     Returns an open MySQLdb connection object 
     """
+    # Deferred so that the driver is only loaded once a connection is needed
+    import MySQLdb
+
     hostname = config.get('DB', 'hostname')
     dbName = config.get('DB', 'database_name')
     username = config.get('DB', 'username')
@@ -282,107 +382,168 @@ def openDBConnection(config):
     dbConn = MySQLdb.connect(host=hostname, user=username, passwd=password, db=dbName)
     return dbConn
 
-def getCombinationMarkerData(conn, where_stmt, params, combinations):
+def fetchQueryRows(statements, query, params, streaming=False):
     """
-    Takes a list of combinations and the stored procedure name
-    in our WWARN db that will generate results and executes each
-    adding any parameters (WHERE clause params) to each procedure call.
-
-    Results are appended to the list already containing data from 
-    our query to pull down all single marker data
-    """ 
-    results = ()
+    Executes the passed in query as a prepared statement (see wwarnquery.py) 
+    yielding each row of its results
 
-    # Because our parameters will be appened onto an already built SQL
-    # statement we are going to want to replace our WHERE with an AND.        
-    where_stmt = where_stmt.replace('WHERE', 'AND')
-    where_stmt = where_stmt % tuple(['"%s"' % x for x in params])
+    If streaming is set rows are read off the server as they are consumed
+    rather than all being pulled down when the query is executed
+    """
+    if streaming:
+        import MySQLdb.cursors
+        cursor = statements.execute(query, params, MySQLdb.cursors.SSCursor)
+    else:
+        cursor = statements.execute(query, params)
 
-    for procedure in combinations:
-        # Need to open a new cursor for each query, shortcoming of mysqldb
-        cursor = conn.cursor()
+    for row in cursor:
+        yield row
 
-        argsList = list(chain(*combinations[procedure]))
-        argsList.append(where_stmt)
+    cursor.close()
 
-        procedureStmt = "call %s(%s)" % (procedure, ",".join(["%s"] * len(argsList)))
+def getCombinationMarkerData(statements, loci, studyIds, sites):
+    """
+    Pulls down the data for a combination marker made up of the passed in list 
+    of (LOCUS NAME, LOCUS POSITION) tuples in the same row format returned by 
+    the haplotype stored procedures. Yields each row of results.
+    """ 
+    (query, params) = buildComboStatement(loci, studyIds, sites)
 
-        cursor.execute(procedureStmt, (argsList))
-        rows = cursor.fetchall()
-        results = results[0:] + rows
-        cursor.close()
+    cursor = statements.execute(query, params)
+    for row in cursor.fetchall():
+        yield row
 
-    return results       
+    cursor.close()
 
-def write_statistics_to_file(stats, outFile, groups, year_step, debug):
+def write_statistics_to_file(cube, outFile, groups, debug, intervalMethod=None, confidence=0.95,
+                             bootstrapIntervals=None):
     """
     Writes out a subset of our calculation data using the 
     groups list passed in
     """
-    calcsFH = open(outFile, 'w')
+    calcsFH = openOutput(outFile)
+    write_statistics_header(calcsFH, debug, intervalMethod, bootstrapIntervals is not None)
+    write_statistics_rows(calcsFH, cube, groups, debug, intervalMethod, confidence, bootstrapIntervals)
+    calcsFH.close()
 
-    # Write our header to file
+def write_statistics_header(calcsFH, debug, intervalMethod=None, bootstrap=False):
+    """
+    Writes the header of a statistics file to the passed in file handle
+    """
     header = ['STUDY_ID', 'STUDY_LABEL', 'COUNTRY', 'SITE', 'YEAR GROUP',
               'INVESTIGATOR', 'GROUP', 'MARKER', 'GENOTYPE', 'SAMPLE SIZE', 
               'PREVALENCE']
 
     if debug:
         header.extend(['PREVALENCE RAW', 'GENOTYPED'])
+
+    if intervalMethod:
+        header.extend(['PREVALENCE CI LOWER', 'PREVALENCE CI UPPER'])
+
+    if bootstrap:
+        header.extend(['PREVALENCE BOOTSTRAP LOWER', 'PREVALENCE BOOTSTRAP UPPER'])
                        
     calcsFH.write("\t".join(header))
     calcsFH.write("\n")
-   
-    # Now iterate over our statistics dictionary and print out the data we 
-    # need    
-    for (metadata, locusIter) in stats.iteritems():
-        for (marker, genotypesIter) in locusIter.iteritems():
-            # Need to pop this key/value off our dictionary so we 
-            # can loop over only actual genotypes
-            sampleSizeDict = genotypesIter.get('sample_size')
-            
-            for genotype in genotypesIter:
-                # Can't pop 'sample_size' off our genotypesIter dictionary
-                # as we call this function twice
-                if genotype == "sample_size": continue
 
-                for group in groups:
-                    sampleSize = str(sampleSizeDict.get(group))
-                    prevalenceRaw = genotypesIter[genotype][group]['prevalence']
-                    prevalence = "{0:.0%}".format(prevalenceRaw)
-                    genotyped = str(genotypesIter[genotype][group]['genotyped'])
+def write_statistics_rows(calcsFH, cube, groups, debug, intervalMethod=None, confidence=0.95,
+                          bootstrapIntervals=None):
+    """
+    Writes the rows of the slice of our result cube (see wwarncube.py) 
+    holding the groups passed in to the passed in file handle
+
+    If an interval method is provided the confidence interval of each prevalence 
+    is added to the end of each row. All intervals are calculated in one batch
+    before any rows are written (see wwarnintervals.py). Bootstrap intervals 
+    (see wwarnbootstrap.py) are passed in already calculated, keyed by the 
+    coordinates of each cell.
+    """
+    cube = cube.slice(group=groups)
 
-                    rowList = []
-                
-                    # If we are dealing with year step here we are going to
-                    # want to split our site on '_'
-                    metadata_list = list(metadata)
-                    if year_step:
-                        site_yr_str = metadata_list[3]
-                        (site, year_group) = site_yr_str.split('_', 2)
-                        metadata_list[3] = site
-                        metadata_list[4:4] = [year_group]
-
-                    rowList.extend(metadata_list)
-                    rowList.append(group)
-                    rowList.append(marker)
-                    rowList.append(genotype)
-                    rowList.append(sampleSize)
-                    rowList.append(prevalence)
-
-                    if debug:
-                        rowList.extend([str(prevalenceRaw), genotyped])
-
-                    calcsFH.write("\t".join(rowList))
-                    calcsFH.write("\n")
+    if intervalMethod:
+        pairs = zip(cube.measures['genotyped'], cube.measures['sample_size'])
+        intervalLookup = calculateIntervalLookup(pairs, intervalMethod, confidence)
 
-    calcsFH.close()
+    for (coordinates, genotyped, sampleSize, prevalenceRaw) in cube.iterateCells():
+        ((studyId, studyLabel, investigator), (country, site), yearGroup, marker, genotype, group) = coordinates
+
+        # The year group is only written out when we are binning by year
+        rowList = [studyId, studyLabel, country, site]
+        if yearGroup is not None:
+            rowList.append(yearGroup)
+
+        rowList.extend([investigator, group, marker, genotype, str(sampleSize), "{0:.0%}".format(prevalenceRaw)])
+
+        if debug:
+            rowList.extend([str(prevalenceRaw), str(genotyped)])
+
+        if intervalMethod:
+            interval = intervalLookup.get((genotyped, sampleSize))
+            rowList.extend(["" if b is None else "{0:.0%}".format(b) for b in interval])
+
+        if bootstrapIntervals is not None:
+            interval = bootstrapIntervals.get(coordinates, (None, None))
+            rowList.extend(["" if b is None else "{0:.0%}".format(b) for b in interval])
+
+        calcsFH.write("\t".join(rowList))
+        calcsFH.write("\n")
+
+def write_roll_up_statistics(rollUp, levelFiles, groups, parser, bootstrapIntervals=None):
+    """
+    Writes out the statistics of each level of a hierarchical roll-up (see 
+    wwarncube.py) to its own file. Study and site fields that were pooled 
+    over are left empty. Any bootstrap intervals are passed in for each level.
+    """
+    for (level, cube) in rollUp.getCubes().iteritems():
+        levelIntervals = bootstrapIntervals.get(level) if bootstrapIntervals else None
+        write_statistics_to_file(cube, levelFiles[level], groups, parser.debug, parser.confidence_interval, 
+                                 parser.confidence_level, levelIntervals)
+
+def write_preview_snapshot(snapshot, outFile, rowsProcessed, final):
+    """
+    Writes a preview snapshot produced while our statistics are still being
+    tabulated. The snapshot is first written to a temporary file and then 
+    moved into place so that anyone polling the preview file never sees a 
+    partially written snapshot.
+
+    The first two lines of the file carry the number of rows processed so far 
+    and whether or not these are the final, exact, statistics:
+
+        #ROWS_PROCESSED=250000
+        #FINAL=0
+    """
+    tmpFile = outFile + '.tmp'
+    previewFH = open(tmpFile, 'w')
 
-def generateGroupedStatistics(data, markerMap, groups):
+    previewFH.write("#ROWS_PROCESSED=%s\n" % rowsProcessed)
+    previewFH.write("#FINAL=%s\n" % int(final))
+
+    header = ['STUDY_ID', 'STUDY_LABEL', 'COUNTRY', 'SITE', 'INVESTIGATOR', 'GROUP', 
+              'MARKER', 'GENOTYPE', 'SAMPLE SIZE', 'GENOTYPED', 'PREVALENCE']
+    previewFH.write("\t".join(header))
+    previewFH.write("\n")
+
+    for (metadata, marker, genotype, group, sampleSize, genotyped, prevalence) in snapshot:
+        rowList = list(metadata)
+        rowList.append(group)
+        rowList.append(" + ".join([" ".join(m).strip() for m in marker]))
+        rowList.append(" + ".join(genotype))
+        rowList.append(str(sampleSize))
+        rowList.append(str(genotyped))
+        rowList.append("" if prevalence is None else "{0:.0%}".format(prevalence))
+
+        previewFH.write("\t".join(rowList))
+        previewFH.write("\n")
+
+    previewFH.close()
+    os.rename(tmpFile, outFile)
+
+def generateGroupedStatistics(data, markerCatalog, groups):
     """
     Group our statistics by cateory and label provided in the marker
     mapping file.
     """
-    groupedStats = {}
+    groupedStats = OrderedDict()
     
     # Need to add the 'ALL' key to our groups (which right now consi
     groups.append('All')
@@ -392,18 +553,18 @@ def generateGroupedStatistics(data, markerMap, groups):
             # Snatch the sample size out for this marker
             sampleSizeDict = genotypesIter.get('sample_size')
 
-            if not markerKey in markerMap:
+            if not markerKey in markerCatalog:
                 print "DEBUG: Marker %r not in map" % markerKey
                 continue
 
             # Now grab the list of all valid genotypes to iterate over
             # and check to see if the genotype exists in our statistics
-            validGenotypes = markerMap.get(markerKey).get('valid')
+            validGenotypes = markerCatalog.getValidGenotypes(markerKey)
 
             for genotype in validGenotypes:
                 genotypeStats = data[metadataKey][markerKey].get(genotype, None)
-                markerCategory = markerMap[markerKey][genotype].get('category')
-                genotypeLabel = markerMap[markerKey][genotype].get('label')
+                markerCategory = markerCatalog.getGenotypeCategory(markerKey, genotype)
+                genotypeLabel = markerCatalog.getGenotypeLabel(markerKey, genotype)
 
                 for group in groups:
                     # Initialize our dictionary if it hasn't already been.
@@ -435,31 +596,198 @@ def generateGroupedStatistics(data, markerMap, groups):
 
     return groupedStats                        
 
-def main(parser):
-    wwarnCalcDict = {}
+def write_spilled_statistics(parser, config, bundle, allFile, ageFile, statusFile=None, levelFiles=None):
+    """
+    Calculates and writes out our statistics with memory-bounded aggregation 
+    (see wwarnaggregate.py). Statistics are grouped and written out one 
+    metadata key at a time as they are merged back from disk, along with their
+    mutant status roll-up if a status file is given. Only the pooled counts of
+    each roll-up level are held on to until every key has been merged.
+    """
+    stratification = bundle['stratification']
+    ageLabels = list(stratification.getLabels())
+    markerCatalog = bundle['marker_catalog']
+    spillTable = ExternalCountTable(parser.max_genotypes, parser.spill_directory or parser.output_directory)
+
+    dataIter = createMysqlIterator(config, parser.study_ids, parser.sites, bundle['copy_number_groups'], 
+                                   markerCatalog.procedures, parser.year_step, parser.use_fact_table,
+                                   queueSize=parser.pipeline_queue_size)
+
+    allFH = openOutput(allFile)
+    ageFH = openOutput(ageFile)
+    write_statistics_header(allFH, parser.debug, parser.confidence_interval)
+    write_statistics_header(ageFH, parser.debug, parser.confidence_interval)
+
+    if statusFile:
+        statusFH = openOutput(statusFile)
+        writeMutantStatusHeader(statusFH)
+
+    rollUp = None
+    if levelFiles:
+        rollUp = HierarchicalRollUp()
+
+    # generateGroupedStatistics appends the 'All' group to the list of groups 
+    # it is given so the age file carries this group as well
+    for metaState in calculateSpilledWWARNStatistics(dataIter, stratification, spillTable):
+        groupedStats = generateGroupedStatistics(metaState, markerCatalog, list(ageLabels))
+        cube = buildResultCube(groupedStats, ageLabels + ['All'], parser.year_step)
+
+        write_statistics_rows(allFH, cube, ['All'], parser.debug, parser.confidence_interval, 
+                              parser.confidence_level)
+        write_statistics_rows(ageFH, cube, ageLabels + ['All'], parser.debug, parser.confidence_interval, 
+                              parser.confidence_level)
+
+        if statusFile:
+            statusStats = calculateMutantStatusStatistics(metaState, bundle['mutant_status'], ageLabels + ['All'])
+            writeMutantStatusRows(statusFH, statusStats, ageLabels + ['All'], parser.year_step)
+
+        if rollUp:
+            rollUp.addCube(cube)
+
+    allFH.close()
+    ageFH.close()
+    if statusFile:
+        statusFH.close()
+
+    if rollUp:
+        write_roll_up_statistics(rollUp, levelFiles, ageLabels + ['All'], parser)
 
-    config = ConfigParser.RawConfigParser()
-    config.read(parser.config_file)
-    ageGroups = parseAgeGroups(config.get('GENERAL', 'age_groups'))
-    copyNumberGroups = parseCopyNumberGroups(config.get('GENERAL', 'copy_number_groups'))
-    (markerGroups, markerCombos) = parseMarkerList(parser.marker_list)
+def main(parser):
+    # An ordered dictionary is used so that a resumed calculation writes its
+    # statistics out in the same order as an uninterrupted one
+    wwarnCalcDict = OrderedDict()
+
+    bundle = loadConfigBundle(parser.config_file, parser.marker_list, parser.config_bundle)
+    config = bundle['config']
+    stratification = bundle['stratification']
+    copyNumberGroups = bundle['copy_number_groups']
+    markerCatalog = bundle['marker_catalog']
+
+    # Rows pulled from the database only carry the age of each patient so our 
+    # statistics cannot be broken down by any template column
+    if stratification.getExtraColumns():
+        raise StratificationException('Columns %s are only available when calculating from a WWARN template'
+                                      % ", ".join(stratification.getExtraColumns()))
+
+    if parser.mutant_status and bundle['mutant_status'] is None:
+        raise ConfigBundleException('Configuration file %s is missing option mutant_status in section [GENERAL]'
+                                    % parser.config_file)
+
+    ageLabels = list(stratification.getLabels())
+    allFile = join(parser.output_directory, parser.output_prefix + '.all.calcs')
+    ageFile = join(parser.output_directory, parser.output_prefix + '.age.calcs')
 
-    dataIter = createMysqlIterator(config, parser.study_ids, parser.sites, copyNumberGroups, markerCombos, parser.year_step)
-    calculateWWARNStatistics(wwarnCalcDict, dataIter, ageGroups)
+    statusFile = None
+    if parser.mutant_status:
+        statusFile = join(parser.output_directory, parser.output_prefix + '.status.calcs')
+
+    levelFiles = None
+    if parser.roll_up:
+        levelFiles = OrderedDict([(l, join(parser.output_directory, '%s.%s.calcs' % (parser.output_prefix, l)))
+                                  for l in ROLL_UP_LEVELS])
+
+    # Compressed output files are written in the format of their extension 
+    if parser.compress:
+        allFile += COMPRESSION_EXTENSIONS[parser.compress]
+        ageFile += COMPRESSION_EXTENSIONS[parser.compress]
+        if statusFile:
+            statusFile += COMPRESSION_EXTENSIONS[parser.compress]
+        if levelFiles:
+            for level in levelFiles:
+                levelFiles[level] += COMPRESSION_EXTENSIONS[parser.compress]
+
+    if parser.max_genotypes:
+        write_spilled_statistics(parser, config, bundle, allFile, ageFile, statusFile, levelFiles)
+        return
+
+    # Our checkpoint is tied to every parameter that affects the statistics tabulated
+    # so that it can only be used to resume the same calculation
+    checkpointFile = join(parser.output_directory, parser.output_prefix + '.checkpoint')
+    signature = (parser.study_ids, parser.sites, parser.year_step, parser.use_fact_table, 
+                 markerCatalog.procedures.items(), stratification, copyNumberGroups)
+    checkpoint = Checkpoint(checkpointFile, signature, parser.checkpoint_interval)
+
+    histogram = None
+    if parser.keep_histograms:
+        histogram = FineHistogram()
+
+    if parser.from_histogram:
+        # New groupings are re-binned from the histogram of an earlier run 
+        # without touching the database
+        wwarnCalcDict = rebinHistogram(loadHistogram(parser.from_histogram), stratification, copyNumberGroups,
+                                       parser.year_step, parser.study_ids, parser.sites)
+    else:
+        resume = None
+        if parser.resume:
+            resume = checkpoint.read()
+            if resume is None:
+                print "WARN: No checkpoint found at %s, starting from the beginning" % checkpointFile
+            else:
+                wwarnCalcDict = resume.get('state')
+
+        dataIter = createMysqlIterator(config, parser.study_ids, parser.sites, copyNumberGroups, markerCatalog.procedures, parser.year_step,
+                                       parser.use_fact_table, wwarnCalcDict, checkpoint, resume, parser.pipeline_queue_size,
+                                       histogram)
+
+        # If requested we publish partial results while our data is still being tabulated
+        previewCallback = None
+        if parser.preview_interval:
+            previewFile = join(parser.output_directory, parser.output_prefix + '.preview.calcs')
+            previewCallback = lambda snapshot, rows, final: write_preview_snapshot(snapshot, previewFile, rows, final)
+
+        calculateWWARNStatistics(wwarnCalcDict, dataIter, stratification, parser.preview_interval, previewCallback,
+                                 parser.preview_seconds)
+
+    # Our histogram is kept next to our statistics so later runs can re-bin
+    # them into new groups
+    if histogram is not None:
+        histogram.write(join(parser.output_directory, parser.output_prefix + HISTOGRAM_EXTENSION))
+        if parser.debug:
+            print "DEBUG: Kept %s rows in a histogram of %s entries" % (histogram.getRowCount(), len(histogram))
 
     # Before we can print our output we need to group all our statistics together under the 
     # categories and labels found in our marker map
-    ageLabels = [t[2] for t in ageGroups]
-    groupedStats = generateGroupedStatistics(wwarnCalcDict, markerGroups, ageLabels)
+    groupedStats = generateGroupedStatistics(wwarnCalcDict, markerCatalog, ageLabels)
+
+    # Every view of our statistics is written out from a single result cube 
+    # (note that generateGroupedStatistics has added 'All' to our age labels)
+    cube = buildResultCube(groupedStats, ageLabels, parser.year_step)
+
+    # Bootstrap intervals are resampled from the counts of our site-level 
+    # cells for every site and roll-up level written out
+    bootstrapIntervals = {}
+    if parser.bootstrap:
+        levels = ROLL_UP_LEVELS if levelFiles else None
+        bootstrapIntervals = calculateBootstrapIntervals(cube, parser.bootstrap, parser.bootstrap_replicates,
+                                                         parser.confidence_level, parser.bootstrap_seed,
+                                                         parser.bootstrap_processes, levels)
 
     # Our statistics need to be written to two files:
     #       1.) Statistics not grouped by age
     #       2.) Statistics grouped by age
-    allFile = join(parser.output_directory, parser.output_prefix + '.all.calcs')
-    ageFile = join(parser.output_directory, parser.output_prefix + '.age.calcs')
-
-    write_statistics_to_file(groupedStats, allFile, ['All'], parser.year_step, parser.debug)
-    write_statistics_to_file(groupedStats, ageFile, ageLabels, parser.year_step, parser.debug)
+    write_statistics_to_file(cube, allFile, ['All'], parser.debug, parser.confidence_interval, 
+                             parser.confidence_level, bootstrapIntervals.get(SITE_LEVEL))
+    write_statistics_to_file(cube, ageFile, ageLabels, parser.debug, parser.confidence_interval, 
+                             parser.confidence_level, bootstrapIntervals.get(SITE_LEVEL))
+
+    # The exact statistics are also written out in binary so they can be reused
+    # without parsing our rounded text output (see wwarncubefile.py)
+    writeResultCube(cube, getDefaultResultPath(parser.output_directory, parser.output_prefix))
+
+    # Study, country and global statistics are pooled from our site-level 
+    # statistics in one pass rather than by rerunning our calculations 
+    if levelFiles:
+        rollUp = HierarchicalRollUp()
+        rollUp.addCube(cube)
+        write_roll_up_statistics(rollUp, levelFiles, ageLabels, parser, bootstrapIntervals)
+
+    # Our mutant status roll-up is worked out from the genotype counts already
+    # tabulated rather than from another pass over our data
+    if statusFile:
+        writeMutantStatusFile(wwarnCalcDict, bundle['mutant_status'], ageLabels, statusFile, parser.year_step)
+
+    # Our output is complete so there is nothing left to resume
+    checkpoint.remove()
 
 if __name__ == "__main__":
     main(buildArgParser())
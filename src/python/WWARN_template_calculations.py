@@ -3,19 +3,34 @@
 # produced by the WWARN template as input data.
 
 import argparse
-import ConfigParser
 
-from wwarncalculations import calculateWWARNStatistics
-from wwarnexceptions import AgeGroupException, CopyNumberGroupException
+from functools import partial
+from wwarncalculations import calculateWWARNStatistics, calculatePrevalenceStatistic
+from wwarncompress import openOutput, detectCompression, getOutputCompression
+from wwarnconfig import loadConfigBundle
+from wwarnintervals import calculateIntervalLookup, formatInterval, INTERVAL_METHODS
+from wwarnparallel import tabulateFileInParallel
+from wwarntableindex import TableIndexWriter, getDefaultIndexPath
+from wwarnexceptions import TemplateFormatException, ConfigBundleException
+from wwarnhistogram import (FineHistogram, isHistogramFile, loadHistogram, rebinHistogram,
+                            getDefaultHistogramPath)
+from wwarnstatus import writeMutantStatusFile, getDefaultStatusPath
+from wwarntemplate import openTemplate, readTemplateHeader, iterateNumberedTemplateRows, MARKER_START_COL
+from wwarnvalidate import ValidationReport, getDefaultReportPath
+from wwarnworkbook import isTemplateWorkbook
 from collections import OrderedDict
-from wwarnutils import (validateGenotypes, create_year_bins, pprint,
-                        get_template_date_bounds, parse_site, commaDelimToTuple)
+from wwarnutils import (validateGenotypes, create_year_bins, pprint, canonicalGenotype,
+                        get_template_date_bounds, parse_site)
 from datetime import datetime
 
 # A white list of columns that we want to capture and pass into our calculations
 # code
 META_COL = ['STUDY_ID', 'STUDY_LABEL', 'INVESTIGATOR', 'COUNTRY', 'SITE', 'AGE', 'PATIENT_ID', 'DATE_OF_INCLUSION']
 
+# Index of the study label our year bins are looked up by in each row of 
+# template data
+LABEL_COL = 2
+
 def buildArgParser():
     """
     Creates an argparser object using the command-line arguments passed into this script
@@ -23,7 +38,9 @@ def buildArgParser():
     parser = argparse.ArgumentParser(description='Produces sample size and prevalence calculations '
                                         + 'given data provided from the WWARN database')
     parser.add_argument('-i', '--input_file', required=True, help='The tab-delimited text file produced from the '
-                            + 'TEMPLATE worksheet in the WWARN Template')
+                            + 'TEMPLATE worksheet in the WWARN Template, or the template workbook (.xlsx/.xltm) itself. '
+                            + 'Text files may be gzip, bzip2, xz or zstd compressed. A .histogram file kept by '
+                            + '--keep_histograms is re-binned into the groups of the configuration file instead')
     parser.add_argument('-c', '--config_file', required=True, help='A configuration file containing parameters '
                             + 'required for execution of the calculations script.')
     parser.add_argument('-m', '--marker_list', required=False, help='A list of all possible markers that should be '
@@ -31,183 +48,138 @@ def buildArgParser():
     parser.add_argument("-b", "--bin-by-year", required=False, help="Bin all studies by a year range. " 
                             + "This year range should be defined in a digit representing the number of years " 
                                                     + "to create bins with (i.e. 1 = 1 year = 365 days)", type=int, dest="year_step")
-    parser.add_argument('-o', '--output_file', required=True, help='Desired output file containing WWARN calculations.')
+    parser.add_argument('-o', '--output_file', required=True, help='Desired output file containing WWARN calculations. '
+                            + 'The file is compressed if it ends in .gz, .bz2, .xz or .zst')
+    parser.add_argument('--config_bundle', required=False, help='The compiled configuration bundle to use. Defaults '
+                            + 'to the configuration file path with a .bundle extension')
+    parser.add_argument('--confidence_interval', required=False, choices=INTERVAL_METHODS, help='Add the confidence '
+                            + 'interval of each prevalence to our tables using the given method')
+    parser.add_argument('--confidence_level', required=False, type=float, default=0.95, help='Confidence level of '
+                            + 'the intervals added by --confidence_interval. Defaults to 0.95')
+    parser.add_argument('--processes', required=False, type=int, default=1, help='Number of worker processes '
+                            + 'used to parse and tabulate the input file. Large files are split into chunks that '
+                            + 'are parsed in parallel. Defaults to 1')
+    parser.add_argument('--mutant_status', required=False, action='store_true', default=False, help='Also write '
+                            + 'the prevalence of each mutant status (Wild/Mutant/Mixed) of every SNP locus to '
+                            + '<output_file>.status (compressed along with the output file). Requires the '
+                            + 'mutant_status option in the [GENERAL] section of the configuration file')
+    parser.add_argument('--keep_histograms', required=False, action='store_true', default=False, help='Also keep '
+                            + 'a histogram of the unbinned age, copy number and month of inclusion of every row in '
+                            + '<output_file>.histogram so that new groupings can be calculated without reading the '
+                            + 'template again. The template is read by a single process')
     args = parser.parse_args()
 
-    return args
-
-def parseAgeGroups(groupsFile):
-    """
-    Parses the provided age groups file and returns a list of tuples containing the
-    desired age groups for the accompanying WWARN data to be binned into
-
-    Input file should be a tab-delimited file of the following format:
-       
-       <LOWER BOUNDS>\\t<UPPER BOUNDS>\\t<LABEL>
-       None\\t\\t1< 1
-       1\\t4\\t1-4
-
-    First column contains lower bound of group, second column contains upper bound of group
-    while the third column contains the name that should act as the key in the dictionary 
-    containing results returned by our calculations library.
-
-    Returned list is of the following format:
-        
-       [ (<LOWER>, <UPPER>, <LABEL>), (<LOWER>, <UPPER>, <LABEL) ... ]
-    """
-    ageList = []
+    if args.keep_histograms and isHistogramFile(args.input_file):
+        parser.error('--keep_histograms cannot be used when re-binning a histogram')
 
-    groupsFH = open(groupsFile)
-    for line in groupsFH:
-        if line.startswith('#'): continue
-        (lower, upper, name) = line.rstrip('\n').split('\t')
-        
-        # Cast our variables to float if they are not 'None'
-        # And None if they are 'None'
-        if lower == 'None':
-            lower = None
-            upper = float(upper)
-        elif upper == 'None':
-            upper = None
-            lower = float(lower)
-        elif upper == 'None' and lower == 'None':
-            raise AgeGroupException('Cannot have "lower" and "upper" values both set to None in an age group') 
-        else:
-            lower = float(lower)
-            upper = float(upper)
-
-        ageList.append( (lower, upper, name) )
-
-    return ageList
-
-def parseCopyNumberGroups(groupsFile):
-    """
-    Parses the optional list of groups that copy number data should be binned into.
-    This file should be formatted like so:
-
-        #GROUP_NAME\tLOWER\tUPPER
-        1\t0.50\t1.49
+    return args
 
-    Our first column contains the name of the group, which will be the representative value for anything data
-    binned into this group. The second and third columns establish the lower and upper bounds of this group,
-    any data falling in between these two bounds should be captured into this group.        
+def createFileIterator(inputFile, cnBins, markerCatalog, year_step, extraColumns=(), histogram=None,
+                       validator=None, report=None):
     """
-    copyNumGroups = []
-
-    copyNumFH = open(groupsFile)
-    for line in copyNumFH:
-        if line.startswith('#'): continue
-        (groupName, lower, upper) = line.rstrip('\n').split('\t')
-
-        if lower == 'None':
-            lower = None
-            upper = float(upper)
-        elif upper == 'None':
-            upper = None
-            lower = float(lower)
-        elif upper == 'None' and lower == 'None':
-            raise CopyNumberGroupException('Cannot have "lower" and "upper" values both set to None in a copy number group') 
-        else:
-            lower = float(lower)
-            upper = float(upper)
-
-        copyNumGroups.append( (groupName, lower, upper) )
-
-    return copyNumGroups        
+    Takes an input file and creates a generateor of said file returning
+    a line in dictionary form (with headers as k-v pairs)
 
-def parseMarkerList(markerListFile):
-    """
-    Parses the list of valid genotypes for a given marker and returns
-    a dictionary that can be used to look up all of these genotypes. 
-    This dictionary also contains a lookup table for our combination
-    markers to provide abbreviated names when generating table output
+    The values of any extra columns (i.e. columns a stratification reads, see 
+    wwarncalculations.py) are appended to the end of each row. If a 
+    FineHistogram is passed in every row is counted into it before it is 
+    binned (see wwarnhistogram.py). If a TemplateValidator is passed in the
+    template is validated as it is read, with any problems found added to the
+    passed in ValidationReport.
     """
-    markerMap = OrderedDict()
-
-    genotypeListFH = open(markerListFile)
-    for line in genotypeListFH:
-        if line.startswith('#'):
-            continue
-            
-        elts = line.strip().split('\t')            
-        names = commaDelimToTuple(elts[0])
-        positions = commaDelimToTuple(elts[1])
-        type = elts[2]
-        genotypes = commaDelimToTuple(elts[3])
-        
-        # We want to create a tuple combining our marker names + positions 
-        # to mainly represent occurances of our combination markers
-        markerPosTuple = tuple(zip(names, positions))
-        markerMap.setdefault(markerPosTuple, OrderedDict())
-        markerMap.get(markerPosTuple).setdefault('valid', [])
-
-        # If we have more than one marker name in our tuple we are dealing
-        # with a combination marker
-        if len(names) > 1:
-            category = elts[4]
-            label = elts[5]
-
-            if not label in markerMap.get(markerPosTuple).get('valid'):
-                markerMap.get(markerPosTuple).get('valid').append(label)    
-
-            markerMap.get(markerPosTuple).setdefault(genotypes, OrderedDict())
-            markerMap[markerPosTuple]['category'] = category
-            markerMap[markerPosTuple][genotypes]['label'] = label
-        else:
-            markerMap.get(markerPosTuple).get('valid').extend(elts[3].split(','))    
+    wwarnFH = openTemplate(inputFile)
+    (wwarnHeader, year_bins, firstLine) = readTemplatePlan(wwarnFH, year_step)
 
-    genotypeListFH.close()
-    return markerMap
+    for rowList in iterateTemplateData(wwarnFH, wwarnHeader, cnBins, markerCatalog.getCombinations(), year_bins,
+                                       extraColumns, histogram, validator, report, firstLine=firstLine):
+        yield rowList
 
-def createFileIterator(inputFile, cnBins, markerMap, year_step):
+def readTemplatePlan(wwarnFH, year_step):
     """
-    Takes an input file and creates a generateor of said file returning
-    a line in dictionary form (with headers as k-v pairs)
+    Reads the header of a template along with any year bins its rows should be
+    binned into, returning a tuple of the list of column names, the year bins
+    (None if we are not binning by year) and the line number of the first row
+    of data. The file handle is left at the start of the first row of data.
     """
-    wwarnFH = open(inputFile)
-
     # If we have metadata provided here we'll want to parse it out
-    header_line = wwarnFH.readline()
-    if header_line.startswith('#METADATA'):
-        metadata = parse_metadata_header(header_line)
+    (wwarnHeader, metadata) = readTemplateHeader(wwarnFH)
+    if metadata:
         year_step = metadata.get('year_step')
-        header_line = wwarnFH.readline()
-
-    wwarnHeader = [k for k in header_line.replace('#', '').rstrip('\n').split('\t') if len(k) != 0]   
     
     # If we are also binning by year we are going to want to create our bins 
     # prior to parsing all of the data
     year_bins = None
     if year_step:
+        dataStart = wwarnFH.tell()
         bounds = get_template_date_bounds(wwarnFH)
         year_bins = create_year_bins(year_step, bounds)
+        wwarnFH.seek(dataStart)
 
-    for row in wwarnFH:
-        if all(s == '\t' for s in row.rstrip('\r\n')) or row.startswith('#'):
-            continue
-    
-        rowMeta = [v for (k,v) in zip(wwarnHeader, row.rstrip('\n').split('\t')) if k in META_COL]
+    # The column header follows an optional #METADATA line
+    firstLine = 3 if metadata else 2
+
+    return (wwarnHeader, year_bins, firstLine)
+
+def iterateTemplateData(lines, wwarnHeader, cnBins, combinations, year_bins, extraColumns=(), histogram=None,
+                        validator=None, report=None, markerColumns=None, firstLine=1):
+    """
+    Parses the passed in lines of template data yielding a row of input to our
+    calculations for every marker (and combination marker) genotyped in each 
+    line, counting each row into the passed in FineHistogram (if any) before
+    it is binned
+
+    If a TemplateValidator is passed in each line is validated into the passed
+    in ValidationReport, numbering lines from firstLine. The header is 
+    validated as the line before firstLine unless its parsed marker columns 
+    are passed in (i.e. when a template is read in chunks and the header has 
+    already been validated, see calculateParallelTemplateStatistics).
+    """
+    missingColumns = [c for c in extraColumns if c not in wwarnHeader]
+    if missingColumns:
+        raise TemplateFormatException('Template is missing column(s) %s' % ", ".join(missingColumns))
+    extraIndexes = [wwarnHeader.index(c) for c in extraColumns]
+
+    if validator is not None and markerColumns is None:
+        markerColumns = validator.validateHeader(firstLine - 1, wwarnHeader, report)
+
+    for (lineNumber, dataElems) in iterateNumberedTemplateRows(lines, firstLine):
+        if validator is not None and len(dataElems) > MARKER_START_COL:
+            validator.validateRow(lineNumber, [f.strip() for f in dataElems], wwarnHeader, markerColumns, report)
+
+        extraValues = [dataElems[i] if i < len(dataElems) else '' for i in extraIndexes]
+        rowMeta = [v for (k,v) in zip(wwarnHeader, dataElems) if k in META_COL]
 
         # If we are binning by years we'll need to modify our site to include the year range.
-        rowMeta[-1] = datetime.strptime(rowMeta[-1], '%Y-%m-%d')
-        rowMeta[4] = parse_site(rowMeta[4], rowMeta[2], rowMeta[-1], year_bins)
-        del rowMeta[-1] # Remove the DOI when we are done with it
+        doi = datetime.strptime(rowMeta[-1], '%Y-%m-%d')
+        del rowMeta[-1] # Remove the DOI from our row, it is only used to bin our site
+        site = rowMeta[4]
+        rowMeta[4] = parse_site(site, rowMeta[LABEL_COL], doi, year_bins)
+
+        # Lines without any genotypes still count towards the date bounds our 
+        # year bins are worked out from
+        if histogram is not None:
+            histogram.addDate(rowMeta[LABEL_COL], site, doi)
 
-        dataElems = row.rstrip('\n').split('\t')
-        
         # Instead of looping over the number of elements in the dataElems list we 
         # want to loop over the header to make sure we don't try to pull in any extra
-        # blank spaces at the end of the line
-        markerData = zip(wwarnHeader[9:], dataElems[9:])
+        # blank spaces at the end of the line. Genotypes are converted to their 
+        # canonical form here so that every downstream lookup is a single probe.
+        # Any columns read by our stratification are not markers even when they 
+        # follow the marker columns.
+        markerData = [(m, canonicalGenotype(g)) for (m, g) in zip(wwarnHeader[MARKER_START_COL:], 
+                                                                  dataElems[MARKER_START_COL:])
+                      if m not in extraColumns]
 
         # Get our combination markers data
-        combinationMarkers = getCombinationMarkers(dict(markerData),
-                       [k for k in markerMap.keys() if len(k) >= 2])
+        combinationMarkers = getCombinationMarkers(dict(markerData), combinations)
         markerData = markerData + combinationMarkers
 
         for (marker, genotype) in markerData:
             if len(genotype) == 0: continue
 
+            if histogram is not None:
+                histogram.addRow(rowMeta[0:4] + [site] + rowMeta[5:] + [marker, genotype] + extraValues, doi)
+
             # We want to check to see if we are dealing with a marker of type copy number
             # (and in the future genotype fragment) and handle these accordingly
             if marker.find('CN') != -1 and validateGenotypes([genotype]):
@@ -215,9 +187,40 @@ def createFileIterator(inputFile, cnBins, markerMap, year_step):
                 # value into one of the categories provided via command line
                 genotype = preBinCopyNumberData(genotype, cnBins)
 
-            rowList = rowMeta + [ marker, genotype.strip() ]
+            rowList = rowMeta + [ marker, genotype ] + extraValues
             yield rowList
 
+def calculateParallelTemplateStatistics(inputFile, cnBins, markerCatalog, year_step, stratification, processes,
+                                        validator=None, report=None):
+    """
+    Calculates the sample size and prevalence statistics of a template by 
+    splitting its rows into chunks that are parsed and tabulated by separate 
+    worker processes (see wwarnparallel.py). Returns our state variable in the
+    same format, and order, as calculateWWARNStatistics.
+
+    If a TemplateValidator is passed in the header is validated here and the
+    rows of each chunk by the worker parsing them, with any problems found 
+    added to the passed in ValidationReport.
+    """
+    wwarnFH = open(inputFile)
+    (wwarnHeader, year_bins, firstLine) = readTemplatePlan(wwarnFH, year_step)
+    dataStart = wwarnFH.tell()
+    wwarnFH.close()
+
+    markerColumns = None
+    if validator is not None:
+        markerColumns = validator.validateHeader(firstLine - 1, wwarnHeader, report)
+
+    rowsFunc = partial(iterateTemplateData, wwarnHeader=wwarnHeader, cnBins=cnBins,
+                       combinations=markerCatalog.getCombinations(), year_bins=year_bins,
+                       extraColumns=stratification.getExtraColumns(), validator=validator,
+                       markerColumns=markerColumns)
+    state = tabulateFileInParallel(inputFile, dataStart, rowsFunc, stratification, processes,
+                                   report if validator is not None else None, firstLine)
+    calculatePrevalenceStatistic(state)
+
+    return state
+
 def getCombinationMarkers(markerData, comboLookup):
     """
     Examines a row of markers/genotypes from the data file and identifies
@@ -251,23 +254,6 @@ def getCombinationMarkers(markerData, comboLookup):
     
     return comboMarkerData                
                
-def parse_metadata_header(metadata_header):
-    """
-    Parses any metadata in the header of a WWARN template file. This metadata
-    is defined by a #METADATA line:
-
-        #METADATA:year_step=1
-
-    A dictionary will be created out of the k=v pairs found in the header line        
-    """
-    metadata_dict = OrderedDict()
-    metadata_elts = (metadata_header.rstrip('\n').split(':'))[1].split(',')
-
-    for (k, v) in [x.split('=') for x in metadata_elts]:
-        metadata_dict[k] = int(v)
-
-    return metadata_dict
-
 def preBinCopyNumberData(copyNum, bins):
     """
     Based off groups provided via command-line argument copy number data will be 
@@ -304,7 +290,7 @@ def preBinCopyNumberData(copyNum, bins):
 
     return binName
 
-def createOutputWWARNTables(data, genotypeList, output):
+def createOutputWWARNTables(data, markerCatalog, output, intervalMethod=None, confidence=0.95, indexFile=None):
     """
     Writes WWARN output tables for sample size and prevalence statistics
     in the following format:
@@ -319,32 +305,59 @@ def createOutputWWARNTables(data, genotypeList, output):
        .   
 
     Each marker should have its own unique table created
+
+    If an interval method is provided each prevalence column is followed by a 
+    column holding the confidence interval of the prevalence (i.e. 21% - 45%)
+
+    If an index file is provided the byte offsets of each marker table and of 
+    the rows of each site are written to it (see wwarntableindex.py). No index
+    is written for a compressed output file.
     """
-    wwarnOut = open(output, 'w')
+    if indexFile and getOutputCompression(output) is not None:
+        print "WARN: Not indexing %s as compressed output files cannot be seeked into" % output
+        indexFile = None
+
+    wwarnOut = openOutput(output)
+    tableIndex = TableIndexWriter(wwarnOut)
     
     # We need to grab (and sort) all the genotypes we will be dealing with
     # for this input file
-    for outDict in generateOutputDict(data, genotypeList):
+    for outDict in generateOutputDict(data, markerCatalog):
+        # All intervals in our tables are calculated in a single batch 
+        if intervalMethod:
+            intervalLookup = calculateIntervalLookup(getTableIntervalPairs(outDict), intervalMethod, confidence)
+
         for (locusTuple, siteIter) in outDict.iteritems():
             # Check if we are dealing with a combination marker first
+            # Each column in our header is a tuple of the name printed in the table
+            # and the key its statistic is stored under
             header = []
             if len(locusTuple) > 1:
-                header = getValidComboMarkers(locusTuple, genotypeList)
-                header.extend(['Not Genotyped', 'Genotyping Failure'])
-                locusTuple = getPrettyComboMarkerLabel(locusTuple, genotypeList)
+                header = [(l, (l,)) for l in markerCatalog.getComboLabels(locusTuple)]
+                header.extend([(g, (g,)) for g in ['Not Genotyped', 'Genotyping Failure']])
+                locusTuple = [(markerCatalog.getPrettyComboMarkerLabel(locusTuple),)]
             else:
-                if locusTuple in genotypeList:
-                    header = genotypeList[locusTuple].get('valid')
+                if locusTuple in markerCatalog:
+                    header = markerCatalog.getGenotypeColumns(locusTuple)
                 else:   
                     # This marker doesn't exist in our marker lookup
                     print "DEBUG: Skipping %s because it doesn't exist in our lookup" % (str(locusTuple))
                     continue;                        
                                     
 
+            tableIndex.startTable(" ".join(locusTuple[0]))
             wwarnOut.write( " ".join(locusTuple[0]) + "\n" )
-            wwarnOut.write( "Site\tAge group\tSample size\t%s\n" % "\t".join(["%s" % e for e in header]) )
+            columns = []
+            for (name, genotype) in header:
+                columns.append(name)
+                if intervalMethod and validateGenotypes(genotype):
+                    columns.append("%s %.0f%% CI" % (name, confidence * 100))
+
+            wwarnOut.write( "Site\tAge group\tSample size\t%s\n" % "\t".join(columns) )
+            tableIndex.endTableHeader()
 
             for (site, groupsIter) in siteIter.iteritems():
+                tableIndex.startSite(site)
                 wwarnOut.write("%s" % site)
                 
                 for (group, genotypesIter) in groupsIter.iteritems():
@@ -353,60 +366,50 @@ def createOutputWWARNTables(data, genotypeList, output):
 
                     wwarnOut.write("\t%s\t%s" % (group, groupsIter[group]['sample_size']))
 
-                    for genotype in header:
-                        if genotype == "Not Genotyped" or genotype == "Genotyping Failure":                        
-                            statistic = genotypesIter.get(tuple([genotype]), 0)
-                        else:
-                            statistic = genotypesIter.get(tuple(genotype), 0)
-                        
-                        # When dealing with our mixed genotypes we must make sure to check both 
-                        # the A/B combination and the B/A combination
-                        if statistic == 0 and genotype[0].find('/') != -1:
-                            statistic = genotypesIter.get(tuple(genotype[::-1]), 0)
-
-                        if validateGenotypes([genotype]):
-                            statistic = "{0:.0%}".format(statistic)
+                    for (name, genotype) in header:
+                        # Genotypes were canonicalized when our data was read in so 
+                        # A/B and B/A are already counted under the same key
+                        statistic = genotypesIter.get(genotype, 0)
+
+                        if validateGenotypes(genotype):
+                            if intervalMethod:
+                                sampleSize = groupsIter[group]['sample_size']
+                                genotyped = groupsIter[group].get('genotyped', {}).get(genotype, 0)
+                                interval = intervalLookup.get((genotyped, sampleSize))
+                                statistic = "{0:.0%}\t{1}".format(statistic, formatInterval(interval))
+                            else:
+                                statistic = "{0:.0%}".format(statistic)
 
                         wwarnOut.write("\t%s" % (statistic))
 
                     wwarnOut.write("\n")
+                tableIndex.endSite()
             wwarnOut.write("\n")
+            tableIndex.endTable()
 
-def getPrettyComboMarkerLabel(comboMarker, markerMap):
-    """
-    Retrieves the pretty name for our combo markers (i.e. pfdhps 540 + 
-    pfdhps 437 -->  pfdhps double)
-    """       
-    prettyName = None
-
-    inputMarkerSet = set(comboMarker)
-    for combo in [x for x in markerMap.keys() if len(x) > 1]:
-        comboSet = set(combo)
-
-        if inputMarkerSet.issubset(comboSet):
-            prettyName = markerMap.get(combo).get('category')
-            break
+    wwarnOut.close()
 
-    return [(prettyName,)]
+    if indexFile:
+        tableIndex.write(indexFile)
 
-def getValidComboMarkers(comboMarker, markerMap):
+def getTableIntervalPairs(outDict):
     """
-    Retrieves the valid combo marker genotypes. This is done by checking the 
-    marker map against the passed in marker using set operations
+    Returns the (GENOTYPED, SAMPLE SIZE) pair of every prevalence in the passed 
+    in output dictionary (see generateOutputDict)
     """
-    validGenotypes = []
+    pairs = set()
 
-    inputMarkerSet = set(comboMarker)
-    for combo in [x for x in markerMap.keys() if len(x) > 1]:
-        comboSet = set(combo)
+    for siteIter in outDict.itervalues():
+        for groupsIter in siteIter.itervalues():
+            for genotypesIter in groupsIter.itervalues():
+                sampleSize = genotypesIter.get('sample_size', 0)
 
-        if inputMarkerSet.issubset(comboSet):
-            validGenotypes = markerMap.get(combo).get('valid')
-            break
+                for genotyped in genotypesIter.get('genotyped', {}).itervalues():
+                    pairs.add((genotyped, sampleSize))
 
-    return validGenotypes           
+    return pairs
 
-def generateOutputDict(data, map):
+def generateOutputDict(data, markerCatalog):
     """
     Generates a more "friendly" output data structure to iterate over when printout 
     out the sample size and prevalence tables for the WWARN contributor report.
@@ -415,6 +418,10 @@ def generateOutputDict(data, map):
       {  <MARKER NAME>: {
           <SITE>: {
               <GROUP>: { [SAMPLE_SIZE, PREVALENCE VALUES.... ]
+
+    The exact genotyped count behind each prevalence is kept alongside under
+    the 'genotyped' key of each group so that confidence intervals can be
+    calculated from it.
     """
     outputDict = OrderedDict()
     prevSite = None
@@ -435,8 +442,10 @@ def generateOutputDict(data, map):
                 # If we are working with a combination marker we will want to 
                 # use our 'pretty' name for our genotypes
                 label = None
-                if len(markerKey) > 1:
-                    label = getComboMarkerLabel(map.get(markerKey), genotype)
+                if len(markerKey) > 1 and genotype != 'sample_size':
+                    label = markerCatalog.getGenotypeLabel(markerKey, genotype)
+                    if label:
+                        label = (label,)
 
                 for group in sortedGroups:
                     outputDict[markerKey][site].setdefault(group, OrderedDict())
@@ -449,6 +458,10 @@ def generateOutputDict(data, map):
                         # want to get the number of occurances of these instead of the prevalence
                         if validateGenotypes(list(genotype)):
                             prevalence = genotypesIter[genotype][group]['prevalence']
+
+                            genotypedCounts = outputDict[markerKey][site][group].setdefault('genotyped', OrderedDict())
+                            genotypedCounts.setdefault(label or genotype, 0)
+                            genotypedCounts[label or genotype] += genotypesIter[genotype][group]['genotyped']
                             
                             if label:
                                 outputDict.get(markerKey).get(site).get(group).setdefault(label, 0)
@@ -469,26 +482,6 @@ def generateOutputDict(data, map):
 
     yield outputDict
 
-def getComboMarkerLabel(map, genotype):
-    """
-    Retrieves the label for a given combination marker. Because the ordering
-    of markers within a combination can be different we must convert everything
-    to sets to check whether or not we have a match
-    """
-    label = None
-
-    for (comboMarker, metadata) in map.items(): 
-        if comboMarker == 'valid':
-            continue
-
-        comboSet = set(comboMarker)
-        genotypeSet = set(genotype)
-        
-        if comboSet.issubset(genotypeSet):
-            label = tuple(metadata.get('label'))
-            
-    return label                                      
-
 def parseHeaderList(headerList):
     """
     Parse the list of headers provided in the dictionary containing 
@@ -511,14 +504,72 @@ def parseHeaderList(headerList):
 def main(parser):
     wwarnDataDict = OrderedDict()
   
-    config = ConfigParser.RawConfigParser()
-    config.read(parser.config_file)
-    ageGroups = parseAgeGroups(config.get('GENERAL', 'age_groups'))
-    copyNumGroups = parseCopyNumberGroups(config.get('GENERAL', 'copy_number_groups'))
-    markerMap = parseMarkerList(parser.marker_list)
-
-    calculateWWARNStatistics(wwarnDataDict, createFileIterator(parser.input_file, copyNumGroups, markerMap, parser.year_step), ageGroups)
-    createOutputWWARNTables(wwarnDataDict, markerMap, parser.output_file)
+    bundle = loadConfigBundle(parser.config_file, parser.marker_list, parser.config_bundle)
+    stratification = bundle['stratification']
+    copyNumGroups = bundle['copy_number_groups']
+    markerCatalog = bundle['marker_catalog']
+
+    mutantStatus = bundle['mutant_status']
+    if parser.mutant_status and mutantStatus is None:
+        raise ConfigBundleException('Configuration file %s is missing option mutant_status in section [GENERAL]'
+                                    % parser.config_file)
+
+    # Workbooks and compressed templates are streamed out of an archive and 
+    # cannot be split into chunks by byte offset so they are always read by a 
+    # single process
+    processes = parser.processes
+    if processes > 1 and (isTemplateWorkbook(parser.input_file) or detectCompression(parser.input_file)):
+        print "WARN: Template workbooks and compressed templates are read by a single process, ignoring --processes"
+        processes = 1
+
+    # Our histogram is filled in as rows are read so it needs a single reader
+    if processes > 1 and parser.keep_histograms:
+        print "WARN: Histograms are kept by a single process, ignoring --processes"
+        processes = 1
+
+    # Templates are validated as they are read against the lookups compiled
+    # into our bundle, histograms have already been read from a template
+    validator = None
+    if not isHistogramFile(parser.input_file):
+        validator = bundle['template_validator']
+    report = ValidationReport()
+
+    histogram = None
+    if isHistogramFile(parser.input_file):
+        # New groupings are re-binned from the histogram of an earlier run 
+        # without reading its template again
+        wwarnDataDict = rebinHistogram(loadHistogram(parser.input_file), stratification, copyNumGroups,
+                                       parser.year_step)
+    elif processes > 1:
+        wwarnDataDict = calculateParallelTemplateStatistics(parser.input_file, copyNumGroups, markerCatalog,
+                                                            parser.year_step, stratification, processes,
+                                                            validator, report)
+    else:
+        if parser.keep_histograms:
+            histogram = FineHistogram(stratification.getExtraColumns(), LABEL_COL)
+
+        dataIter = createFileIterator(parser.input_file, copyNumGroups, markerCatalog, parser.year_step,
+                                      stratification.getExtraColumns(), histogram, validator, report)
+        calculateWWARNStatistics(wwarnDataDict, dataIter, stratification)
+
+    if validator is not None:
+        reportFile = getDefaultReportPath(parser.output_file)
+        report.write(reportFile)
+
+        if report.hasIssues():
+            counts = ", ".join(["%s %s" % (n, c) for (c, n) in report.getCounts().iteritems() if n])
+            print "WARN: Template failed validation (%s), see %s" % (counts, reportFile)
+
+    if histogram is not None:
+        histogram.write(getDefaultHistogramPath(parser.output_file))
+    createOutputWWARNTables(wwarnDataDict, markerCatalog, parser.output_file, parser.confidence_interval,
+                            parser.confidence_level, getDefaultIndexPath(parser.output_file))
+
+    # Our mutant status roll-up is worked out from the genotype counts we have
+    # just tabulated rather than from another pass over the template
+    if parser.mutant_status:
+        writeMutantStatusFile(wwarnDataDict, mutantStatus, list(stratification.getLabels()) + ['All'],
+                              getDefaultStatusPath(parser.output_file))
 
 if __name__ == "__main__":
     main(buildArgParser())        
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+##
+# Builds the small synthetic templates our tests calculate statistics from.
+# Importing this module puts src/python on the path, so it is imported by
+# every test module ahead of the modules under test.
+#
+# Run our tests from src/python with:
+#
+#     python -m unittest discover -s tests
+#
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from WWARN_db_calculations import generateGroupedStatistics
+from WWARN_template_calculations import createFileIterator
+from wwarncalculations import calculateWWARNStatistics, createStratification
+from wwarncube import buildResultCube
+from wwarnmarkers import parseMarkerList
+
+AGE_GROUPS = [(None, 1, '< 1'), (1, 4, '1 - 4'), (5, 12, '5 - 12'), (12, None, '> 12')]
+CN_BINS = [('1', 0.5, 1.49), ('2', 1.5, 2.49), ('> 2', 2.5, None)]
+
+SITES = [('S1', 'Inv A', 'LAB1', 'Mali', 'Bamako'),
+         ('S2', 'Inv B', 'LAB2', 'Kenya', 'Kisumu'),
+         ('S3', 'Inv C', 'LAB3', 'Mali', 'Kati')]
+
+TEMPLATE_MARKERS = OrderedDict([
+    ('pfcrt_76_SNP_AA', ['K', 'T', 'K/T', 'Not Genotyped', '']),
+    ('pfdhps_437_SNP_AA', ['A', 'G', 'A/G', 'Genotyping Failure']),
+    ('pfdhps_540_SNP_AA', ['K', 'E', 'K/E', '']),
+    ('pfmdr1_CN', ['0.85', '1.2', '2.35', '3.1', '']),
+])
+
+MARKER_LIST = """#NAMES\tPOSITIONS\tTYPE\tGENOTYPES\tCATEGORY\tLABEL
+pfcrt\t76\tSNP\tK,T,K/T,Not Genotyped,Genotyping Failure
+pfdhps\t437\tSNP\tA,G,A/G,Not Genotyped,Genotyping Failure
+pfdhps\t540\tSNP\tK,E,K/E,Not Genotyped,Genotyping Failure
+pfmdr1 CN\t\tCN\t1,2,> 2,Not Genotyped,Genotyping Failure
+pfdhps,pfdhps\t437,540\tSNP\tG,E\tdhps double\tPure
+pfdhps,pfdhps\t437,540\tSNP\tG,K/E\tdhps double\tMixed
+pfdhps,pfdhps\t437,540\tSNP\tA/G,E\tdhps double\tMixed
+"""
+
+def generatePatients(count, seed=0):
+    """
+    Returns a list of synthetic patients in the following format:
+
+        (<STUDY ID>, <INVESTIGATOR>, <STUDY LABEL>, <COUNTRY>, <SITE>, <PATIENT ID>,
+         <AGE>, <DATE OF INCLUSION>, { <MARKER COLUMN>: <GENOTYPE> })
+    """
+    rng = random.Random(seed)
+    patients = []
+
+    for i in xrange(count):
+        site = rng.choice(SITES)
+        age = rng.choice(['0.5', '1', '2', '3', '7', '20', ''])
+        doi = '20%02d-%02d-%02d' % (rng.randint(5, 9), rng.randint(1, 12), rng.randint(1, 28))
+        genotypes = OrderedDict([(m, rng.choice(g)) for (m, g) in TEMPLATE_MARKERS.iteritems()])
+        patients.append(site + ('P%d' % i, age, doi, genotypes))
+
+    return patients
+
+def writeTemplate(templateFile, patients, invalidLines=()):
+    """
+    Writes a WWARN template holding the passed in patients. The genotypes of
+    the pfcrt 76 column are replaced by an invalid codon on the passed in
+    (0-based) patient indexes.
+    """
+    templateFH = open(templateFile, 'w')
+    templateFH.write("#" + "\t".join(['STUDY_ID', 'INVESTIGATOR', 'STUDY_LABEL', 'COUNTRY', 'SITE', 'PATIENT_ID',
+                                      'AGE', 'DATE_OF_INCLUSION', 'SAMPLE_COLLECTION_DATE'] + TEMPLATE_MARKERS.keys()))
+    templateFH.write("\n")
+
+    for (i, patient) in enumerate(patients):
+        genotypes = patient[8].values()
+        if i in invalidLines:
+            genotypes[0] = 'K/X'
+
+        templateFH.write("\t".join(list(patient[0:8]) + [''] + genotypes))
+        templateFH.write("\n")
+
+    templateFH.close()
+
+class TemplateTestCase(unittest.TestCase):
+    """
+    Writes a synthetic template and marker list to a temporary directory
+    before each test
+    """
+    patientCount = 300
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.templateFile = os.path.join(self.tempDir, 'template.txt')
+        self.patients = generatePatients(self.patientCount)
+        writeTemplate(self.templateFile, self.patients)
+
+        markerListFile = os.path.join(self.tempDir, 'markers.list')
+        markerListFH = open(markerListFile, 'w')
+        markerListFH.write(MARKER_LIST)
+        markerListFH.close()
+        self.markerCatalog = parseMarkerList(markerListFile)
+
+        self.stratification = createStratification(AGE_GROUPS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def iterateTemplate(self, histogram=None, validator=None, report=None):
+        return createFileIterator(self.templateFile, CN_BINS, self.markerCatalog, None, (), histogram,
+                                  validator, report)
+
+    def calculateSerialStatistics(self, groups=None, histogram=None, validator=None, report=None):
+        state = OrderedDict()
+        calculateWWARNStatistics(state, self.iterateTemplate(histogram, validator, report),
+                                 groups or self.stratification)
+
+        return state
+
+    def buildSiteCube(self):
+        """
+        Returns the site-level result cube of our template
+        """
+        state = self.calculateSerialStatistics()
+        labels = list(self.stratification.getLabels())
+        groupedStats = generateGroupedStatistics(state, self.markerCatalog, list(labels))
+
+        return buildResultCube(groupedStats, labels + ['All'])
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+##
+# Checks that statistics spilled to disk and merged back together match
+# those tabulated in memory
+#
+
+import unittest
+
+from collections import OrderedDict
+from synthetic import TemplateTestCase
+from wwarnaggregate import ExternalCountTable, calculateSpilledWWARNStatistics
+from wwarncalculations import calculateWWARNStatistics
+
+def generateDistinctGenotypeRows(count):
+    """
+    Returns rows of calculation input holding the passed in number of distinct
+    genotypes spread across a handful of sites
+    """
+    return [('S1', 'LAB1', 'Inv A', 'Mali', 'Site %d' % (i % 5), 'P%d' % i, '3', 'pfcrt_76_SNP', 'G%d' % (i % count))
+            for i in xrange(count * 2)]
+
+class MeasuredCountTable(ExternalCountTable):
+    """
+    Records the number of genotypes held in the state and the number of keys
+    held in any dictionary of the table itself whenever a genotype is added
+    """
+    def __init__(self, maxGenotypes, spillDir=None):
+        ExternalCountTable.__init__(self, maxGenotypes, spillDir)
+        self.residentSizes = []
+
+    def genotypeAdded(self, state):
+        ExternalCountTable.genotypeAdded(self, state)
+
+        stateGenotypes = sum([len(g) for markers in state.itervalues() for g in markers.itervalues()])
+        tableKeys = sum([len(v) for v in vars(self).itervalues() if isinstance(v, dict)])
+        self.residentSizes.append(stateGenotypes + tableKeys)
+
+class SpilledStatisticsTestCase(TemplateTestCase):
+    def test_spilled_matches_in_memory(self):
+        memoryState = self.calculateSerialStatistics()
+
+        for maxGenotypes in [1, 7, 1000]:
+            spillTable = ExternalCountTable(maxGenotypes, self.tempDir)
+
+            spilledState = OrderedDict()
+            for metaState in calculateSpilledWWARNStatistics(self.iterateTemplate(), self.stratification, spillTable):
+                spilledState.update(metaState)
+
+            self.assertEqual(memoryState, spilledState)
+
+    def test_resident_size_is_bounded(self):
+        maxSizes = []
+
+        for count in [100, 1000]:
+            rows = generateDistinctGenotypeRows(count)
+            memoryState = OrderedDict()
+            calculateWWARNStatistics(memoryState, rows, self.stratification)
+
+            spillTable = MeasuredCountTable(20, self.tempDir)
+            spilledState = OrderedDict()
+            for metaState in calculateSpilledWWARNStatistics(rows, self.stratification, spillTable):
+                spilledState.update(metaState)
+
+            self.assertEqual(memoryState, spilledState)
+            maxSizes.append(max(spillTable.residentSizes))
+
+        # Each site holds a sample size along with at most 20 genotypes
+        self.assertEqual(maxSizes[0], maxSizes[1])
+        self.assertTrue(maxSizes[0] <= 20 + 5)
+
+if __name__ == '__main__':
+    unittest.main()
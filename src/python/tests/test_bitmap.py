@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+##
+# Checks that combination markers counted from a bitmap index match those
+# pulled down by our combination marker query. The queries are run against
+# an in-memory sqlite copy of the tables they read.
+#
+
+import sqlite3
+import unittest
+
+from collections import OrderedDict
+from synthetic import TemplateTestCase, AGE_GROUPS, CN_BINS, SITES, TEMPLATE_MARKERS
+from WWARN_db_calculations import buildQueryStatement, buildComboStatement, transformRow
+from wwarnbitmap import BitmapIndexBuilder
+from wwarncalculations import calculateWWARNStatistics
+from wwarnutils import validateGenotypes
+
+COMBINATION_LOCI = [('pfdhps', '437'), ('pfdhps', '540')]
+
+def createGenotypeDatabase(patients):
+    """
+    Loads the SNP genotypes of the passed in patients into an in-memory copy
+    of the tables our database queries read
+    """
+    conn = sqlite3.connect(':memory:')
+    conn.text_factory = str
+    conn.create_function('CONCAT', -1, lambda *values: "".join([str(v) for v in values]))
+
+    conn.executescript("""
+        CREATE TABLE study (id_study INTEGER PRIMARY KEY, wwarn_study_id TEXT, label TEXT, investigator TEXT);
+        CREATE TABLE location (id_location INTEGER PRIMARY KEY, fk_study_id INTEGER, country TEXT, site TEXT);
+        CREATE TABLE subject (id_subject INTEGER PRIMARY KEY, fk_location_id INTEGER, patient_id TEXT,
+                              age TEXT, date_of_inclusion TEXT);
+        CREATE TABLE sample (id_sample INTEGER PRIMARY KEY, fk_subject_id INTEGER);
+        CREATE TABLE marker (id_marker INTEGER PRIMARY KEY, locus_name TEXT, locus_position INTEGER, type TEXT);
+        CREATE TABLE genotype (id_genotype INTEGER PRIMARY KEY, fk_sample_id INTEGER, fk_marker_id INTEGER,
+                               value TEXT);
+    """)
+
+    markerIds = {}
+    for column in [c for c in TEMPLATE_MARKERS if '_SNP_' in c]:
+        (name, position) = column.split('_')[0:2]
+        markerIds[column] = conn.execute("INSERT INTO marker (locus_name, locus_position, type) VALUES (?, ?, ?)",
+                                         (name, int(position), 'SNP')).lastrowid
+
+    locationIds = {}
+    for (studyId, investigator, label, country, site) in SITES:
+        dbStudyId = conn.execute("INSERT INTO study (wwarn_study_id, label, investigator) VALUES (?, ?, ?)",
+                                 (studyId, label, investigator)).lastrowid
+        locationIds[studyId] = conn.execute("INSERT INTO location (fk_study_id, country, site) VALUES (?, ?, ?)",
+                                            (dbStudyId, country, site)).lastrowid
+
+    for patient in patients:
+        subjectId = conn.execute("INSERT INTO subject (fk_location_id, patient_id, age, date_of_inclusion) "
+                                 "VALUES (?, ?, ?, ?)", (locationIds[patient[0]], patient[5], patient[6] or None,
+                                                         patient[7])).lastrowid
+        sampleId = conn.execute("INSERT INTO sample (fk_subject_id) VALUES (?)", (subjectId,)).lastrowid
+
+        for (column, markerId) in markerIds.iteritems():
+            if patient[8][column]:
+                conn.execute("INSERT INTO genotype (fk_sample_id, fk_marker_id, value) VALUES (?, ?, ?)",
+                             (sampleId, markerId, patient[8][column]))
+
+    return conn
+
+def executeQuery(conn, query, params):
+    """
+    Runs one of our MySQL queries against an in-memory database, returning the
+    rows converted into calculation input
+    """
+    rows = conn.execute(query.replace('%s', '?'), params).fetchall()
+    return [transformRow(row, CN_BINS, None) for row in rows]
+
+def getCountsAndSampleSizes(markerState):
+    """
+    Returns the genotyped counts of each called genotype of a marker, leaving
+    out genotypes that were never counted, along with its sample sizes
+    """
+    counts = {}
+    for (genotype, groupIter) in markerState.iteritems():
+        if genotype == 'sample_size' or not validateGenotypes(genotype):
+            continue
+
+        genotyped = dict([(g, c['genotyped']) for (g, c) in groupIter.iteritems()])
+        if genotyped['All']:
+            counts[genotype] = genotyped
+
+    return (counts, dict(markerState['sample_size']))
+
+class BitmapIndexTestCase(TemplateTestCase):
+    def test_bitmap_combinations_match_query(self):
+        conn = createGenotypeDatabase(self.patients)
+
+        (queryList, params) = buildQueryStatement([], [])
+        builder = BitmapIndexBuilder(AGE_GROUPS)
+        builder.addRows(executeQuery(conn, " ".join(queryList), params))
+        index = builder.build()
+
+        # The combination query only returns patients called at every locus
+        queryState = OrderedDict()
+        calculateWWARNStatistics(queryState, executeQuery(conn, *buildComboStatement(COMBINATION_LOCI, [], [])),
+                                 AGE_GROUPS)
+        bitmapState = index.countCombination(COMBINATION_LOCI)
+
+        markerKey = tuple(COMBINATION_LOCI)
+        self.assertEqual(len(queryState), len(SITES))
+        self.assertEqual(sorted(queryState.keys()), sorted(bitmapState.keys()))
+        for (metadataKey, markers) in queryState.iteritems():
+            self.assertEqual(getCountsAndSampleSizes(markers[markerKey]),
+                             getCountsAndSampleSizes(bitmapState[metadataKey][markerKey]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+##
+# Checks that bootstrap intervals only depend on their seed and that cells
+# of a single site are resampled by patient
+#
+
+import unittest
+
+import wwarnbootstrap
+
+from synthetic import TemplateTestCase
+from wwarnbootstrap import calculateBootstrapIntervals, resampleChunk, resamplePatients, percentile, SITE_LEVEL
+from wwarncube import ROLL_UP_LEVELS
+
+class BootstrapTestCase(TemplateTestCase):
+    def setUp(self):
+        TemplateTestCase.setUp(self)
+        self.siteCube = self.buildSiteCube()
+
+    def calculateIntervals(self, method, processes, seed=0):
+        # Small chunks so that tasks are handed to more than one process
+        chunkSize = wwarnbootstrap.TASK_CHUNK_SIZE
+        wwarnbootstrap.TASK_CHUNK_SIZE = 8
+        try:
+            return calculateBootstrapIntervals(self.siteCube, method, 200, seed=seed, processes=processes,
+                                               levels=ROLL_UP_LEVELS)
+        finally:
+            wwarnbootstrap.TASK_CHUNK_SIZE = chunkSize
+
+    def test_processes_do_not_change_intervals(self):
+        serial = self.calculateIntervals('site', 1)
+
+        self.assertEqual(serial, self.calculateIntervals('site', 2))
+        self.assertNotEqual(serial, self.calculateIntervals('site', 1, seed=7))
+
+    def test_single_site_cells_are_resampled_by_patient(self):
+        bySite = self.calculateIntervals('site', 1)
+        byPatient = self.calculateIntervals('patient', 1)
+
+        # Every site of our template belongs to its own study so each
+        # site-level cell holds a single site, while Mali pools two sites
+        self.assertTrue(bySite[SITE_LEVEL])
+        self.assertEqual(bySite[SITE_LEVEL], byPatient[SITE_LEVEL])
+        self.assertNotEqual(bySite['country'], byPatient['country'])
+
+    def test_single_site_task_matches_resample_patients(self):
+        task = ('site', ['K', 'T'], [[3], [5]], [10], 42)
+        (level, cellKeys, cellIntervals) = resampleChunk(([task], 'site', 100, 0.9))[0]
+
+        alpha = (1 - 0.9) / 2.0
+        prevalences = resamplePatients([[3], [5]], [10], 100, 42)
+        self.assertEqual([(percentile(p, alpha), percentile(p, 1 - alpha)) for p in prevalences], cellIntervals)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+##
+# Checks that a calculation stopped partway through one of its stages and
+# resumed from its last checkpoint ends with the same statistics as a run
+# that was never interrupted
+#
+
+import os
+import unittest
+
+from collections import OrderedDict
+from functools import partial
+from synthetic import TemplateTestCase
+from wwarncalculations import calculateWWARNStatistics
+from wwarncheckpoint import Checkpoint, iterateStages
+
+CHECKPOINT_INTERVAL = 7
+
+class Interrupted(Exception):
+    """
+    Raised by a stage to stop a calculation partway through
+    """
+
+def iterateStageRows(rows, stopAt=None):
+    for (i, row) in enumerate(rows):
+        if i == stopAt:
+            raise Interrupted()
+        yield row
+
+class CheckpointTestCase(TemplateTestCase):
+    def setUp(self):
+        TemplateTestCase.setUp(self)
+        self.checkpointFile = os.path.join(self.tempDir, 'calcs.checkpoint')
+
+        # Single markers and combination markers are pulled down in separate
+        # stages, as they are from the database
+        rows = list(self.iterateTemplate())
+        self.stageRows = OrderedDict([('single_markers', [r for r in rows if ' + ' not in r[7]]),
+                                      ('double_haplotype_genotype_counts', [r for r in rows if ' + ' in r[7]])])
+
+    def calculate(self, stopStage=None, stopAt=None, resume=False):
+        checkpoint = Checkpoint(self.checkpointFile, ('template.txt',), CHECKPOINT_INTERVAL)
+        state = OrderedDict()
+
+        resumeFrom = checkpoint.read() if resume else None
+        if resumeFrom is not None:
+            state = resumeFrom.get('state')
+
+        stages = [(name, partial(iterateStageRows, rows, stopAt if name == stopStage else None))
+                  for (name, rows) in self.stageRows.iteritems()]
+        calculateWWARNStatistics(state, iterateStages(stages, state, checkpoint, resumeFrom), self.stratification)
+
+        return (state, resumeFrom)
+
+    def test_resume_matches_full_run(self):
+        self.assertTrue(len(self.stageRows['double_haplotype_genotype_counts']) > 2 * CHECKPOINT_INTERVAL)
+        (fullState, resumeFrom) = self.calculate()
+
+        # Each stop is followed by the (COMPLETED, STAGE, OFFSET) of the last
+        # checkpoint written before it, or None if none was written yet
+        single = 'single_markers'
+        double = 'double_haplotype_genotype_counts'
+        stops = [(single, 3, None),
+                 (single, 500, ([], single, 497)),
+                 (double, 0, ([single], None, 0)),
+                 (double, 20, ([single], double, 14))]
+
+        for (stage, stopAt, position) in stops:
+            os.remove(self.checkpointFile)
+            self.assertRaises(Interrupted, self.calculate, stage, stopAt)
+
+            (state, resumeFrom) = self.calculate(resume=True)
+            if position is None:
+                self.assertIsNone(resumeFrom)
+            else:
+                self.assertEqual(position, (resumeFrom.get('completed'), resumeFrom.get('stage'),
+                                            resumeFrom.get('offset')))
+            self.assertEqual(fullState, state)
+
+        # Resuming from the checkpoint written after the last stage tabulates nothing more
+        (state, resumeFrom) = self.calculate(resume=True)
+        self.assertEqual(self.stageRows.keys(), resumeFrom.get('completed'))
+        self.assertEqual(fullState, state)
+
+if __name__ == '__main__':
+    unittest.main()
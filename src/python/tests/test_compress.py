@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+##
+# Checks that compressed files read back the same lines they were written
+# with. Only gzip and bzip2 are checked as xz and zstd need optional modules.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import synthetic
+import wwarncompress
+
+from wwarncompress import openInput, openOutput, detectCompression, DecompressedFile, CompressedFile
+
+LINES = ["%d\tline %s\n" % (i, "x" * (i % 50)) for i in xrange(2000)]
+
+class CompressedFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+        # Small blocks so that lines are split across many blocks
+        self.blockSize = wwarncompress.BLOCK_SIZE
+        wwarncompress.BLOCK_SIZE = 1000
+
+    def tearDown(self):
+        wwarncompress.BLOCK_SIZE = self.blockSize
+        shutil.rmtree(self.tempDir)
+
+    def writeLines(self, name, lines):
+        path = os.path.join(self.tempDir, name)
+
+        outputFH = openOutput(path)
+        for line in lines:
+            outputFH.write(line)
+        outputFH.close()
+
+        return path
+
+    def test_round_trip(self):
+        for (name, compression) in [('lines.txt.gz', 'gzip'), ('lines.txt.bz2', 'bz2'), ('lines.txt', None)]:
+            path = self.writeLines(name, LINES)
+            self.assertEqual(compression, detectCompression(path))
+
+            inputFH = openInput(path)
+            self.assertEqual(LINES, list(inputFH))
+            inputFH.close()
+
+    def test_written_position_is_uncompressed(self):
+        outputFH = CompressedFile(os.path.join(self.tempDir, 'lines.txt.gz'), 'gzip')
+        for line in LINES[:10]:
+            outputFH.write(line)
+
+        self.assertEqual(len("".join(LINES[:10])), outputFH.tell())
+        outputFH.close()
+
+    def test_readline_read_and_seek(self):
+        path = self.writeLines('lines.txt.bz2', LINES)
+        inputFH = DecompressedFile(path, 'bz2')
+
+        self.assertEqual(LINES[0], inputFH.readline())
+        self.assertEqual(len(LINES[0]), inputFH.tell())
+
+        offset = len("".join(LINES[:1500]))
+        inputFH.seek(offset)
+        self.assertEqual(LINES[1500], inputFH.readline())
+
+        # Seeking backwards restarts decompression from the start of the file
+        inputFH.seek(len(LINES[0]))
+        self.assertEqual("".join(LINES[1:3]), inputFH.read(len("".join(LINES[1:3]))))
+        self.assertEqual(LINES[3:], list(inputFH))
+        self.assertEqual("", inputFH.readline())
+        inputFH.close()
+
+    def test_concatenated_streams(self):
+        first = self.writeLines('first.gz', LINES[:700])
+        second = self.writeLines('second.gz', LINES[700:])
+
+        joined = os.path.join(self.tempDir, 'joined.gz')
+        joinedFH = open(joined, 'wb')
+        for path in [first, second]:
+            joinedFH.write(open(path, 'rb').read())
+        joinedFH.close()
+
+        inputFH = openInput(joined)
+        self.assertEqual(LINES, list(inputFH))
+        inputFH.close()
+
+    def test_unterminated_last_line(self):
+        path = self.writeLines('lines.txt.gz', LINES[:3] + ["last"])
+
+        inputFH = openInput(path)
+        self.assertEqual(LINES[:3] + ["last"], list(inputFH))
+        inputFH.close()
+
+if __name__ == '__main__':
+    unittest.main()
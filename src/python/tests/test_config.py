@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+##
+# Checks that configuration bundles are read back as plain data and rebuilt
+# into the same objects they were compiled from
+#
+
+import ast
+import cPickle
+import os
+import unittest
+
+from synthetic import TemplateTestCase, AGE_GROUPS
+from wwarnconfig import loadConfigBundle, getDefaultBundlePath, DB_OPTIONS
+from wwarnexceptions import ConfigBundleException
+
+DB_SECTION = """[DB]
+hostname=localhost
+database_name=wwarn
+username=u
+password=p
+"""
+
+class PickledPayload(object):
+    """
+    Creates a file when unpickled
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return (open, (self.path, 'w'))
+
+class ConfigBundleTestCase(TemplateTestCase):
+    def setUp(self):
+        TemplateTestCase.setUp(self)
+
+        self.ageGroupsFile = self.writeFile('age_groups.txt', "".join(["%s\t%s\t%s\n" % g for g in AGE_GROUPS]))
+        self.cnGroupsFile = self.writeFile('cn_groups.txt', "1\t0.5\t1.49\n2\t1.5\t2.49\n> 2\t2.5\tNone\n")
+        self.parasitemiaFile = self.writeFile('parasitemia.txt', "None\t1000\tlow\n1000\tNone\thigh\n")
+        self.markerList = os.path.join(self.tempDir, 'markers.list')
+
+        self.configFile = self.writeFile('wwarn.ini', "[GENERAL]\nage_groups=%s\ncopy_number_groups=%s\n\n"
+                                         % (self.ageGroupsFile, self.cnGroupsFile)
+                                         + "[STRATIFICATION]\ndimensions=age,parasitemia\n\n"
+                                         + "[DIMENSION:parasitemia]\ntype=range\ncolumn=PARASITEMIA\ngroups=%s\n\n"
+                                         % self.parasitemiaFile + DB_SECTION)
+
+    def writeFile(self, name, contents):
+        path = os.path.join(self.tempDir, name)
+        fh = open(path, 'w')
+        fh.write(contents)
+        fh.close()
+
+        return path
+
+    def assertBundlesEqual(self, bundle, other):
+        self.assertEqual(bundle['stratification'].getLabels(), other['stratification'].getLabels())
+        self.assertEqual(bundle['stratification'].binners, other['stratification'].binners)
+        self.assertEqual(bundle['marker_catalog'].markers, other['marker_catalog'].markers)
+        self.assertEqual(bundle['copy_number_groups'], other['copy_number_groups'])
+
+    def test_cached_bundle_matches_compiled(self):
+        compiled = loadConfigBundle(self.configFile, self.markerList)
+        bundleFile = getDefaultBundlePath(self.configFile, self.markerList)
+        self.assertTrue(os.path.exists(bundleFile))
+
+        # Bundles are written as plain Python literals
+        bundleFH = open(bundleFile)
+        self.assertIsInstance(ast.literal_eval(bundleFH.read()), dict)
+        bundleFH.close()
+
+        cached = loadConfigBundle(self.configFile, self.markerList)
+
+        self.assertBundlesEqual(compiled, cached)
+
+    def test_pickled_bundle_is_not_loaded(self):
+        payloadFile = os.path.join(self.tempDir, 'unpickled')
+        bundleFile = getDefaultBundlePath(self.configFile, self.markerList)
+
+        bundleFH = open(bundleFile, 'wb')
+        cPickle.dump(PickledPayload(payloadFile), bundleFH, cPickle.HIGHEST_PROTOCOL)
+        bundleFH.close()
+
+        bundle = loadConfigBundle(self.configFile, self.markerList)
+
+        self.assertFalse(os.path.exists(payloadFile))
+        self.assertEqual([g[2] for g in AGE_GROUPS], [g[2] for g in bundle['age_groups']])
+        self.assertEqual(5, len(bundle['marker_catalog'].markers))
+
+    def test_required_options_depend_on_caller(self):
+        configFile = self.writeFile('db.ini', DB_SECTION)
+
+        bundle = loadConfigBundle(configFile, None, requiredOptions=DB_OPTIONS)
+        self.assertIsNone(bundle['stratification'])
+        self.assertIsNone(bundle['age_groups'])
+
+        self.assertRaises(ConfigBundleException, loadConfigBundle, configFile, None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+##
+# Checks slicing and rolling up the result cube of a synthetic template
+#
+
+import unittest
+
+from synthetic import TemplateTestCase
+from wwarncalculations import calculatePrevalence
+
+class ResultCubeTestCase(TemplateTestCase):
+    def test_slice_matches_cells(self):
+        cube = self.buildSiteCube()
+        marker = cube.getDimensionValues('marker')[0]
+
+        expected = [c for c in cube.iterateCells() if c[0][3] == marker and c[0][5] in ['All', '< 1']]
+        sliced = list(cube.slice(marker=marker, group=['All', '< 1']).iterateCells())
+
+        self.assertTrue(len(sliced) > 0)
+        self.assertEqual(expected, sliced)
+        self.assertEqual(sliced, list(cube.filter('marker', lambda m: m == marker)
+                                          .slice(group=['All', '< 1']).iterateCells()))
+        self.assertEqual(len(cube.slice(marker='no such marker')), 0)
+
+    def test_roll_up_sums_counts_once_per_site(self):
+        cube = self.buildSiteCube().slice(group='All')
+
+        genotyped = {}
+        sampleSizes = {}
+        for ((study, site, yearGroup, marker, genotype, group), count, sampleSize, prevalence) in cube.iterateCells():
+            genotyped[(marker, genotype)] = genotyped.get((marker, genotype), 0) + count
+            sampleSizes.setdefault(marker, {})[(study, site)] = sampleSize
+
+        for ((marker, genotype), count, sampleSize, prevalence) in cube.rollUp(['marker', 'genotype']).iterateCells():
+            self.assertEqual(count, genotyped[(marker, genotype)])
+            self.assertEqual(sampleSize, sum(sampleSizes[marker].values()))
+            self.assertEqual(prevalence, calculatePrevalence(count, sampleSize))
+
+        self.assertRaises(ValueError, self.buildSiteCube().rollUp, ['marker', 'genotype'])
+
+if __name__ == '__main__':
+    unittest.main()
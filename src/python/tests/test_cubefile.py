@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+
+##
+# Checks that a result cube survives being written to and memory mapped
+# back from a binary result file
+#
+
+import os
+import unittest
+
+from synthetic import TemplateTestCase
+from wwarncubefile import writeResultCube, loadResultCube
+
+class ResultFileTestCase(TemplateTestCase):
+    def test_cube_file_round_trip(self):
+        cube = self.buildSiteCube()
+        resultFile = os.path.join(self.tempDir, 'results.cube')
+        writeResultCube(cube, resultFile)
+
+        loadedCube = loadResultCube(resultFile)
+        self.assertEqual(list(cube.iterateCells()), list(loadedCube.iterateCells()))
+
+        marker = cube.getDimensionValues('marker')[0]
+        self.assertTrue(len(cube.slice(marker=marker)) > 0)
+        self.assertEqual(list(cube.slice(marker=marker).iterateCells()),
+                         list(loadedCube.slice(marker=marker).iterateCells()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+##
+# Checks that changes to the normalized tables behind the fact table are 
+# detected. The checks run against an in-memory sqlite copy of the tables.
+#
+
+import sqlite3
+import unittest
+import zlib
+
+from synthetic import generatePatients
+from wwarnfacttable import findChangedSourceTables, recordSourceSignatures, SOURCE_TABLES
+
+class BitXor(object):
+    """
+    The BIT_XOR aggregate of MySQL
+    """
+    def __init__(self):
+        self.value = None
+
+    def step(self, value):
+        if value is not None:
+            self.value = (self.value or 0) ^ value
+
+    def finalize(self):
+        return self.value
+
+class SqliteCursor(object):
+    """
+    Runs our MySQL queries, which use %s placeholders, against sqlite
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = None
+
+    def execute(self, query, params=()):
+        self.cursor = self.conn.execute(query.replace('%s', '?'), params)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+def createSourceDatabase(patients):
+    """
+    Loads the pfcrt genotypes of the passed in patients into an in-memory copy
+    of the normalized tables
+    """
+    conn = sqlite3.connect(':memory:')
+    conn.text_factory = str
+    conn.create_function('CRC32', 1, lambda value: zlib.crc32(value) & 0xffffffff)
+    conn.create_function('CONCAT_WS', -1, lambda sep, *values: sep.join([str(v) for v in values if v is not None]))
+    conn.create_function('IF', 3, lambda condition, value, other: value if condition else other)
+    conn.create_aggregate('BIT_XOR', 1, BitXor)
+
+    conn.execute("CREATE TABLE genotype_fact_source (table_name TEXT PRIMARY KEY, max_id INTEGER, "
+                 "row_count INTEGER, checksum INTEGER)")
+    for (table, idColumn, columns) in SOURCE_TABLES:
+        conn.execute("CREATE TABLE %s (%s INTEGER PRIMARY KEY, %s)" % (table, idColumn, ", ".join(columns)))
+
+    markerId = conn.execute("INSERT INTO marker (locus_name, locus_position, type) VALUES ('pfcrt', 76, 'SNP')").lastrowid
+    for patient in patients:
+        addPatient(conn, patient, markerId)
+
+    return conn
+
+def addPatient(conn, patient, markerId=1):
+    studyId = conn.execute("INSERT INTO study (wwarn_study_id, label, investigator) VALUES (?, ?, ?)",
+                           (patient[0], patient[2], patient[1])).lastrowid
+    locationId = conn.execute("INSERT INTO location (fk_study_id, country, site) VALUES (?, ?, ?)",
+                              (studyId, patient[3], patient[4])).lastrowid
+    subjectId = conn.execute("INSERT INTO subject (fk_location_id, patient_id, age, date_of_inclusion) "
+                             "VALUES (?, ?, ?, ?)", (locationId, patient[5], patient[6] or None, patient[7])).lastrowid
+    sampleId = conn.execute("INSERT INTO sample (fk_subject_id) VALUES (?)", (subjectId,)).lastrowid
+    conn.execute("INSERT INTO genotype (fk_sample_id, fk_marker_id, value) VALUES (?, ?, ?)",
+                 (sampleId, markerId, patient[8]['pfcrt_76_SNP_AA']))
+
+class SourceChangeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.patients = generatePatients(50)
+        self.conn = createSourceDatabase(self.patients[:40])
+        self.cursor = SqliteCursor(self.conn)
+
+        # Nothing has been recorded before the first refresh
+        (changed, signatures) = findChangedSourceTables(self.cursor)
+        self.assertEqual([t[0] for t in SOURCE_TABLES], changed)
+        recordSourceSignatures(self.cursor, signatures)
+
+    def findChanged(self):
+        return findChangedSourceTables(self.cursor)[0]
+
+    def test_unchanged_tables(self):
+        self.assertEqual([], self.findChanged())
+
+    def test_appended_rows_are_not_changes(self):
+        for patient in self.patients[40:]:
+            addPatient(self.conn, patient)
+
+        (changed, signatures) = findChangedSourceTables(self.cursor)
+        self.assertEqual([], changed)
+        self.assertEqual((50, 50), signatures['genotype'][0:2])
+
+    def test_updated_rows_are_changes(self):
+        self.conn.execute("UPDATE study SET label = 'Corrected' WHERE id_study = 3")
+        self.conn.execute("UPDATE genotype SET value = value || '/X' WHERE id_genotype = 7")
+
+        self.assertEqual(['study', 'genotype'], self.findChanged())
+
+    def test_deleted_rows_are_changes(self):
+        addPatient(self.conn, self.patients[40])
+        self.conn.execute("DELETE FROM sample WHERE id_sample = 12")
+
+        self.assertEqual(['sample'], self.findChanged())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+##
+# Checks that genotype calls are canonicalized and that the mixed genotype
+# and "> 2" copy number columns of our output tables are filled in from them
+#
+
+import os
+import unittest
+
+from collections import OrderedDict
+from synthetic import TemplateTestCase, SITES, writeTemplate
+from WWARN_template_calculations import createOutputWWARNTables
+from wwarnutils import canonicalGenotype
+
+# pfcrt 76 and pfmdr1 copy number calls of each patient of our template. Mixed
+# calls are spelled both ways round and copy numbers above 2.5 fall into the
+# "> 2" bin.
+CALLS = [('K', '3.1'), ('T/K', '2.6'), (' K/T', '1.2'), ('T', 'Not Genotyped'),
+         ('not genotyped', '0.85')]
+
+def readOutputTables(outputFile):
+    """
+    Returns the tables of an output file in the following format:
+
+        { <MARKER>: { (<SITE>, <AGE GROUP>): { <COLUMN>: <VALUE> } } }
+    """
+    tables = {}
+
+    outputFH = open(outputFile)
+    for table in outputFH.read().split("\n\n"):
+        lines = table.strip("\n").split("\n")
+        if not lines[0]:
+            continue
+
+        header = lines[1].split("\t")
+        rows = tables.setdefault(lines[0].strip(), {})
+        site = None
+
+        for line in lines[2:]:
+            fields = line.split("\t")
+            site = fields[0] or site
+            rows[(site, fields[1])] = dict(zip(header[2:], fields[2:]))
+    outputFH.close()
+
+    return tables
+
+class CanonicalGenotypeTestCase(unittest.TestCase):
+    def test_whitespace_is_stripped(self):
+        self.assertEqual('K', canonicalGenotype(' K \n'))
+
+    def test_mixed_alleles_are_sorted(self):
+        self.assertEqual('K/T', canonicalGenotype('T/K'))
+        self.assertEqual('K/T', canonicalGenotype(' T / K '))
+        self.assertEqual('A/C/G', canonicalGenotype('G/A/C'))
+
+    def test_invalid_genotypes_are_respelled(self):
+        self.assertEqual('Not Genotyped', canonicalGenotype('not genotyped'))
+        self.assertEqual('Genotyping Failure', canonicalGenotype(' GENOTYPING FAILURE'))
+
+    def test_copy_number_bins_are_kept(self):
+        self.assertEqual('> 2', canonicalGenotype('> 2'))
+
+class OutputColumnTestCase(TemplateTestCase):
+    def setUp(self):
+        TemplateTestCase.setUp(self)
+
+        patients = []
+        for (i, (pfcrt, pfmdr1)) in enumerate(CALLS):
+            genotypes = OrderedDict([('pfcrt_76_SNP_AA', pfcrt), ('pfdhps_437_SNP_AA', ''),
+                                     ('pfdhps_540_SNP_AA', ''), ('pfmdr1_CN', pfmdr1)])
+            patients.append(SITES[0] + ('P%d' % i, '20', '2007-01-01', genotypes))
+
+        writeTemplate(self.templateFile, patients)
+
+    def test_mixed_and_copy_number_columns(self):
+        outputFile = os.path.join(self.tempDir, 'output.txt')
+        createOutputWWARNTables(self.calculateSerialStatistics(), self.markerCatalog, outputFile)
+        tables = readOutputTables(outputFile)
+
+        # Both spellings of the mixed call are counted in the K/T column,
+        # which used to always read 0%
+        pfcrt = tables['pfcrt 76'][('Bamako', 'All')]
+        self.assertEqual({ 'Sample size': '4', 'K': '25%', 'T': '25%', 'K/T': '50%', 'Not Genotyped': '1',
+                           'Genotyping Failure': '0' }, pfcrt)
+
+        pfmdr1 = tables['pfmdr1 CN'][('Bamako', 'All')]
+        self.assertEqual({ 'Sample size': '4', '1': '50%', '2': '0%', '> 2': '50%', 'Not Genotyped': '1',
+                           'Genotyping Failure': '0' }, pfmdr1)
+        self.assertEqual(pfmdr1, tables['pfmdr1 CN'][('Bamako', '> 12')])
+
+if __name__ == '__main__':
+    unittest.main()
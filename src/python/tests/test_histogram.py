@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+
+##
+# Checks that a histogram kept while reading a template re-bins into new
+# groups exactly as the template would have been tabulated under them
+#
+
+import os
+import unittest
+
+from synthetic import TemplateTestCase, AGE_GROUPS, CN_BINS
+from WWARN_template_calculations import LABEL_COL
+from wwarncalculations import createStratification
+from wwarnhistogram import FineHistogram, loadHistogram, rebinHistogram
+
+FINE_AGE_GROUPS = [(None, 1, '< 1'), (1, 2, '1 - 2'), (3, 4, '3 - 4'), (5, 12, '5 - 12'), (12, None, '> 12')]
+
+class HistogramTestCase(TemplateTestCase):
+    def test_histogram_rebins_to_new_groups(self):
+        histogram = FineHistogram(labelColumn=LABEL_COL)
+        self.calculateSerialStatistics(createStratification(FINE_AGE_GROUPS), histogram)
+
+        histogramFile = os.path.join(self.tempDir, 'template.histogram')
+        histogram.write(histogramFile)
+
+        rebinnedState = rebinHistogram(loadHistogram(histogramFile), AGE_GROUPS, CN_BINS)
+        self.assertEqual(self.calculateSerialStatistics(), rebinnedState)
+
+if __name__ == '__main__':
+    unittest.main()
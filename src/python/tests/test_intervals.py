@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+##
+# Checks the confidence intervals of our prevalence statistics at the edges
+# of their range
+#
+
+import unittest
+
+import synthetic
+
+from wwarnintervals import calculateIntervalLookup, formatInterval, INTERVAL_METHODS
+
+class IntervalTestCase(unittest.TestCase):
+    def test_interval_edge_cases(self):
+        for method in INTERVAL_METHODS:
+            lookup = calculateIntervalLookup([(0, 10), (10, 10), (12, 10), (3, 0), (4, 10)], method)
+
+            self.assertEqual(lookup[(0, 10)][0], 0.0)
+            self.assertEqual(lookup[(10, 10)][1], 1.0)
+            self.assertTrue(0.0 < lookup[(0, 10)][1] < 1.0)
+            self.assertTrue(0.0 < lookup[(10, 10)][0] < 1.0)
+            self.assertTrue(lookup[(4, 10)][0] < 0.4 < lookup[(4, 10)][1])
+
+            # Genotyped more often than the sample size (i.e. two studies
+            # sharing a site) or without a sample size gives an empty interval
+            self.assertEqual(lookup[(12, 10)], (None, None))
+            self.assertEqual(lookup[(3, 0)], (None, None))
+            self.assertEqual(formatInterval(lookup[(12, 10)]), "")
+
+    def test_clopper_pearson_contains_wilson_center(self):
+        wilson = calculateIntervalLookup([(4, 10)], 'wilson')[(4, 10)]
+        exact = calculateIntervalLookup([(4, 10)], 'clopper-pearson')[(4, 10)]
+
+        # The exact interval is the wider of the two
+        self.assertTrue(exact[0] <= wilson[0] and wilson[1] <= exact[1])
+        self.assertEqual(formatInterval(exact), "12% - 74%")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+##
+# Checks the lookups of the marker catalog built from a marker list
+#
+
+import unittest
+
+from synthetic import TemplateTestCase
+
+PFCRT = (('pfcrt', '76'),)
+PFMDR1_CN = (('pfmdr1 CN', ''),)
+DHPS_DOUBLE = (('pfdhps', '437'), ('pfdhps', '540'))
+
+class MarkerCatalogTestCase(TemplateTestCase):
+    def test_markers_are_kept_in_listed_order(self):
+        self.assertEqual([PFCRT, (('pfdhps', '437'),), (('pfdhps', '540'),), PFMDR1_CN, DHPS_DOUBLE],
+                         list(self.markerCatalog))
+        self.assertIn(PFCRT, self.markerCatalog)
+        self.assertNotIn((('pfmdr1', '86'),), self.markerCatalog)
+
+    def test_valid_genotypes_are_canonical(self):
+        self.assertEqual([('K',), ('T',), ('K/T',), ('Not Genotyped',), ('Genotyping Failure',)],
+                         self.markerCatalog.getValidGenotypes(PFCRT))
+        self.assertEqual([('G', 'E'), ('G', 'E/K'), ('A/G', 'E')], self.markerCatalog.getValidGenotypes(DHPS_DOUBLE))
+        self.assertEqual([], self.markerCatalog.getValidGenotypes((('pfmdr1', '86'),)))
+
+    def test_genotype_columns_keep_listed_spelling(self):
+        columns = self.markerCatalog.getGenotypeColumns(DHPS_DOUBLE)
+
+        self.assertEqual([('G + E', ('G', 'E')), ('G + K/E', ('G', 'E/K')), ('A/G + E', ('A/G', 'E'))], columns)
+        self.assertEqual(('> 2', ('> 2',)), self.markerCatalog.getGenotypeColumns(PFMDR1_CN)[2])
+
+    def test_combinations_ignore_locus_order(self):
+        reversedKey = tuple(reversed(DHPS_DOUBLE))
+
+        self.assertEqual([DHPS_DOUBLE], self.markerCatalog.getCombinations())
+        self.assertEqual(DHPS_DOUBLE, self.markerCatalog.getCombination(reversedKey))
+        self.assertIsNone(self.markerCatalog.getCombination((('pfcrt', '76'), ('pfdhps', '437'))))
+        self.assertEqual(self.markerCatalog.getValidGenotypes(DHPS_DOUBLE),
+                         self.markerCatalog.getValidGenotypes(reversedKey))
+
+    def test_combination_labels_and_category(self):
+        self.assertEqual(['Pure', 'Mixed'], self.markerCatalog.getComboLabels(DHPS_DOUBLE))
+        self.assertEqual('dhps double', self.markerCatalog.getPrettyComboMarkerLabel(DHPS_DOUBLE))
+        self.assertEqual([], self.markerCatalog.getComboLabels(PFCRT))
+        self.assertIsNone(self.markerCatalog.getPrettyComboMarkerLabel(PFCRT))
+
+    def test_genotype_label_lookup(self):
+        self.assertEqual('Pure', self.markerCatalog.getGenotypeLabel(DHPS_DOUBLE, ('G', 'E')))
+        self.assertEqual('Mixed', self.markerCatalog.getGenotypeLabel(DHPS_DOUBLE, ('G', 'E/K')))
+        self.assertEqual('dhps double', self.markerCatalog.getGenotypeCategory(DHPS_DOUBLE, ('A/G', 'E')))
+
+        # Genotypes are looked up regardless of the order the loci are listed in
+        reversedKey = tuple(reversed(DHPS_DOUBLE))
+        self.assertEqual('Mixed', self.markerCatalog.getGenotypeLabel(reversedKey, ('E', 'A/G')))
+        self.assertIsNone(self.markerCatalog.getGenotypeLabel(DHPS_DOUBLE, ('A', 'K')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+
+##
+# Checks that a template tabulated in parallel chunks matches a template read
+# from start to finish
+#
+
+import unittest
+
+import wwarnparallel
+
+from synthetic import TemplateTestCase, CN_BINS
+from WWARN_template_calculations import calculateParallelTemplateStatistics
+
+class ParallelTemplateTestCase(TemplateTestCase):
+    def calculateParallelStatistics(self, validator=None, report=None):
+        # Split our small template into several chunks
+        minChunkBytes = wwarnparallel.MIN_CHUNK_BYTES
+        wwarnparallel.MIN_CHUNK_BYTES = 512
+        try:
+            self.assertEqual(len(wwarnparallel.findChunkBoundaries(self.templateFile, 0, 3)), 3)
+            return calculateParallelTemplateStatistics(self.templateFile, CN_BINS, self.markerCatalog, None,
+                                                       self.stratification, 3, validator, report)
+        finally:
+            wwarnparallel.MIN_CHUNK_BYTES = minChunkBytes
+
+    def test_parallel_matches_serial(self):
+        self.assertEqual(self.calculateSerialStatistics(), self.calculateParallelStatistics())
+
+if __name__ == '__main__':
+    unittest.main()
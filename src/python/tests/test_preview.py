@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+##
+# Checks that previews of our statistics are published while rows are being
+# tabulated and are throttled by the time since the last preview
+#
+
+import unittest
+
+from collections import OrderedDict
+from synthetic import TemplateTestCase
+from wwarncalculations import calculateWWARNStatistics, generatePreviewSnapshot
+
+class PreviewTestCase(TemplateTestCase):
+    def calculateWithPreviews(self, previewSeconds):
+        previews = []
+        callback = lambda snapshot, rows, final: previews.append((snapshot, rows, final))
+
+        state = OrderedDict()
+        calculateWWARNStatistics(state, self.iterateTemplate(), self.stratification, 100, callback, previewSeconds)
+
+        return (state, previews)
+
+    def test_previews_every_interval(self):
+        (state, previews) = self.calculateWithPreviews(0)
+        rows = len(list(self.iterateTemplate()))
+
+        self.assertEqual([(r, False) for r in xrange(100, rows + 1, 100)] + [(rows, True)],
+                         [(p[1], p[2]) for p in previews])
+        self.assertEqual(generatePreviewSnapshot(state), previews[-1][0])
+
+        # Earlier previews only hold the rows tabulated so far
+        self.assertEqual(100, sum([r[5] for r in previews[0][0] if r[3] == 'All']))
+
+    def test_previews_are_throttled(self):
+        (state, previews) = self.calculateWithPreviews(3600)
+
+        self.assertEqual([True], [p[2] for p in previews])
+        self.assertEqual(generatePreviewSnapshot(state), previews[0][0])
+
+if __name__ == '__main__':
+    unittest.main()
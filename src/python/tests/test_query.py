@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+##
+# Checks the IN (...) lists our query filters are built from and the
+# statements sent to the server to prepare and execute queries
+#
+
+import unittest
+
+import synthetic
+
+from wwarnquery import buildInClause, compilePlaceholders, PreparedStatementCache, MAX_IN_LIST_SIZE
+
+class RecordingCursor(object):
+    """
+    Records the statements executed on it instead of sending them to a server
+    """
+    def __init__(self, log):
+        self.log = log
+
+    def execute(self, query, params=None):
+        self.log.append((query, params))
+
+    def close(self):
+        pass
+
+class RecordingConnection(object):
+    def __init__(self):
+        self.log = []
+
+    def cursor(self, cursorClass=None):
+        return RecordingCursor(self.log)
+
+class InClauseTestCase(unittest.TestCase):
+    def test_single_value(self):
+        self.assertEqual(("l.site IN (%s)", ['Bamako']), buildInClause('l.site', ['Bamako']))
+
+    def test_padded_to_power_of_two(self):
+        (clause, params) = buildInClause('l.site', ['Bamako', 'Kati', 'Kisumu'])
+
+        self.assertEqual("l.site IN (%s, %s, %s, %s)", clause)
+        self.assertEqual(['Bamako', 'Kati', 'Kisumu', 'Kisumu'], params)
+
+    def test_full_chunk_is_not_padded(self):
+        values = range(MAX_IN_LIST_SIZE)
+        (clause, params) = buildInClause('s.id', values)
+
+        self.assertEqual(MAX_IN_LIST_SIZE, clause.count("%s"))
+        self.assertNotIn(" OR ", clause)
+        self.assertEqual(values, params)
+
+    def test_long_lists_are_chunked(self):
+        values = range(MAX_IN_LIST_SIZE + 1)
+        (clause, params) = buildInClause('s.id', values)
+
+        self.assertEqual("(s.id IN (%s) OR s.id IN (%s))" % (", ".join(["%s"] * MAX_IN_LIST_SIZE), "%s"), clause)
+        self.assertEqual(values, params)
+
+class PreparedStatementTestCase(unittest.TestCase):
+    def test_quoted_placeholders_are_kept(self):
+        query = "SELECT '%s', \"a\\\"%s\", `%s` FROM t WHERE a = %s AND b LIKE 'x''%s' AND c IN (%s, %s)"
+
+        self.assertEqual(("SELECT '%s', \"a\\\"%s\", `%s` FROM t WHERE a = ? AND b LIKE 'x''%s' AND c IN (?, ?)", 3),
+                         compilePlaceholders(query))
+
+    def test_statements_are_prepared_once(self):
+        conn = RecordingConnection()
+        statements = PreparedStatementCache(conn)
+        query = "SELECT * FROM t WHERE a = %s AND b = %s"
+
+        statements.execute(query, ['x', 1])
+        self.assertEqual([("PREPARE wwarn_stmt_1 FROM %s", ("SELECT * FROM t WHERE a = ? AND b = ?",)),
+                          ("SET @wwarn_p1 = %s, @wwarn_p2 = %s", ('x', 1)),
+                          ("EXECUTE wwarn_stmt_1 USING @wwarn_p1, @wwarn_p2", None)], conn.log)
+
+        # Unchanged parameters are not assigned again
+        del conn.log[:]
+        statements.execute(query, ['x', 1])
+        self.assertEqual([("EXECUTE wwarn_stmt_1 USING @wwarn_p1, @wwarn_p2", None)], conn.log)
+
+        del conn.log[:]
+        statements.execute(query, ['x', True])
+        self.assertEqual([("SET @wwarn_p2 = %s", (True,)),
+                          ("EXECUTE wwarn_stmt_1 USING @wwarn_p1, @wwarn_p2", None)], conn.log)
+
+    def test_parameter_count_is_checked(self):
+        statements = PreparedStatementCache(RecordingConnection())
+
+        self.assertRaises(ValueError, statements.execute, "SELECT * FROM t WHERE a = %s", [])
+
+if __name__ == '__main__':
+    unittest.main()
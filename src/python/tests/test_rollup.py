@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+##
+# Checks that site-level cells are pooled into each of our roll-up levels
+#
+
+import unittest
+
+import synthetic
+
+from wwarncalculations import calculatePrevalence
+from wwarncube import ResultCube, HierarchicalRollUp, ROLLED_UP_VALUE
+
+class HierarchicalRollUpTestCase(unittest.TestCase):
+    def test_roll_up_pools_sites(self):
+        cube = ResultCube()
+        for (study, site, genotyped, sampleSize) in [(('S1', 'LAB1', 'Inv A'), ('Mali', 'Bamako'), 2, 10),
+                                                     (('S3', 'LAB3', 'Inv C'), ('Mali', 'Kati'), 3, 5),
+                                                     (('S2', 'LAB2', 'Inv B'), ('Kenya', 'Kisumu'), 4, 4)]:
+            for (genotype, count) in [('K', genotyped), ('T', sampleSize - genotyped)]:
+                cube.addCell((study, site, None, 'pfcrt 76', genotype, 'All'), count, sampleSize,
+                             calculatePrevalence(count, sampleSize))
+
+        rollUp = HierarchicalRollUp()
+        rollUp.addCube(cube)
+        cubes = rollUp.getCubes()
+
+        noStudy = (ROLLED_UP_VALUE, ROLLED_UP_VALUE, ROLLED_UP_VALUE)
+        countryCells = dict([(c[0][1][0], c[1:]) for c in cubes['country'].iterateCells() if c[0][4] == 'K'])
+        self.assertEqual(countryCells['Mali'], (5, 15, calculatePrevalence(5, 15)))
+        self.assertEqual(countryCells['Kenya'], (4, 4, calculatePrevalence(4, 4)))
+
+        globalCells = dict([(c[0][4], c[1:3]) for c in cubes['global'].iterateCells()])
+        self.assertEqual(globalCells, {'K': (9, 19), 'T': (10, 19)})
+        self.assertTrue(all([c[0][0] == noStudy for c in cubes['global'].iterateCells()]))
+
+        studyCells = [c for c in cubes['study'].iterateCells() if c[0][0][0] == 'S1']
+        self.assertEqual(sorted([(c[0][4], c[1], c[2]) for c in studyCells]), [('K', 2, 10), ('T', 8, 10)])
+
+if __name__ == '__main__':
+    unittest.main()
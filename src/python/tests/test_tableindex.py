@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+##
+# Checks that single tables and site rows are looked up from an output file
+# through its sidecar index
+#
+
+import os
+import unittest
+
+from synthetic import TemplateTestCase
+from WWARN_template_calculations import createOutputWWARNTables
+from wwarnexceptions import TableIndexException
+from wwarntableindex import getDefaultIndexPath, readTableIndex, readTable
+
+class TableIndexTestCase(TemplateTestCase):
+    def writeOutput(self, name):
+        outputFile = os.path.join(self.tempDir, name)
+        createOutputWWARNTables(self.calculateSerialStatistics(), self.markerCatalog, outputFile,
+                                indexFile=getDefaultIndexPath(outputFile))
+
+        return outputFile
+
+    def test_lookup_matches_output(self):
+        outputFile = self.writeOutput('output.txt')
+        index = readTableIndex(getDefaultIndexPath(outputFile))
+
+        tables = open(outputFile).read().split("\n\n")
+        pfcrt = [t for t in tables if t.startswith("pfcrt 76\n")][0] + "\n\n"
+        self.assertEqual(pfcrt, readTable(outputFile, index, 'pfcrt 76'))
+
+        siteTable = readTable(outputFile, index, 'pfcrt 76', 'Kati').split("\n")
+        self.assertEqual(pfcrt.split("\n")[0:2], siteTable[0:2])
+        self.assertTrue(siteTable[2].startswith("Kati\t"))
+        self.assertEqual(["\t"], sorted(set([l[0] for l in siteTable[3:] if l])))
+
+        self.assertIsNone(readTable(outputFile, index, 'pfcrt 76', 'Nowhere'))
+        self.assertIsNone(readTable(outputFile, index, 'pfmdr1 86'))
+
+    def test_duplicate_entries_raise(self):
+        outputFile = self.writeOutput('output.txt')
+        indexFile = getDefaultIndexPath(outputFile)
+
+        lines = open(indexFile).readlines()
+        open(indexFile, 'w').writelines(lines + [lines[2]])
+
+        self.assertRaises(TableIndexException, readTableIndex, indexFile)
+
+    def test_compressed_output_is_not_indexed(self):
+        outputFile = self.writeOutput('output.txt.gz')
+
+        self.assertFalse(os.path.exists(getDefaultIndexPath(outputFile)))
+        self.assertRaises(TableIndexException, readTable, outputFile, { ('pfcrt 76', ''): (0, 10, 5) }, 'pfcrt 76')
+
+if __name__ == '__main__':
+    unittest.main()
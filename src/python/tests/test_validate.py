@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+##
+# Checks that templates are validated while they are tabulated, whether they
+# are read from start to finish or in parallel chunks
+#
+
+import unittest
+
+import wwarnparallel
+
+from synthetic import TemplateTestCase, CN_BINS, writeTemplate
+from WWARN_template_calculations import calculateParallelTemplateStatistics
+from wwarnvalidate import TemplateValidator, ValidationReport
+
+class TemplateValidationTestCase(TemplateTestCase):
+    def setUp(self):
+        TemplateTestCase.setUp(self)
+        writeTemplate(self.templateFile, self.patients, invalidLines=(3, 150, 299))
+        self.validator = TemplateValidator(codons=['K', 'T', 'A', 'G', 'E'])
+
+    def test_invalid_codons_are_reported_at_their_line(self):
+        report = ValidationReport()
+        self.calculateSerialStatistics(validator=self.validator, report=report)
+
+        # Patients start on line 2, after the column header
+        self.assertEqual([(i[0], i[2], i[3], i[4]) for i in report.issues],
+                         [(l, 'pfcrt_76_SNP_AA', 'codon', 'K/X') for l in [5, 152, 301]])
+
+    def test_parallel_report_matches_serial(self):
+        serialReport = ValidationReport()
+        serialState = self.calculateSerialStatistics(validator=self.validator, report=serialReport)
+
+        minChunkBytes = wwarnparallel.MIN_CHUNK_BYTES
+        wwarnparallel.MIN_CHUNK_BYTES = 512
+        try:
+            parallelReport = ValidationReport()
+            parallelState = calculateParallelTemplateStatistics(self.templateFile, CN_BINS, self.markerCatalog, None,
+                                                                self.stratification, 3, self.validator, parallelReport)
+        finally:
+            wwarnparallel.MIN_CHUNK_BYTES = minChunkBytes
+
+        self.assertEqual(serialState, parallelState)
+        self.assertEqual(serialReport.issues, parallelReport.issues)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+##
+# Checks that the watch state keeps the counts of a template that could not
+# be tabulated and tries it again on the next poll
+#
+
+import copy
+import os
+import time
+import unittest
+
+from synthetic import TemplateTestCase, CN_BINS
+from wwarnconfig import hashFile
+from wwarnwatch import createWatchState, findTemplates, findChangedTemplates, updateWatchState, SETTLE_SECONDS
+
+class WatchStateTestCase(TemplateTestCase):
+    def setUp(self):
+        TemplateTestCase.setUp(self)
+
+        self.bundle = { 'stratification': self.stratification, 'copy_number_groups': CN_BINS,
+                        'marker_catalog': self.markerCatalog }
+        self.settleTemplate()
+
+    def settleTemplate(self):
+        """
+        Backdates our template so that it is not skipped as still being written
+        """
+        settled = time.time() - SETTLE_SECONDS - 10
+        os.utime(self.templateFile, (settled, settled))
+
+    def poll(self, watchState):
+        (changed, removed) = findChangedTemplates(findTemplates(self.tempDir, 'template*.txt'), watchState)
+        updateWatchState(watchState, changed, removed, self.bundle, None)
+
+        return changed
+
+    def test_failed_template_is_kept_and_retried(self):
+        watchState = createWatchState(None)
+        self.poll(watchState)
+
+        tabulated = copy.deepcopy(watchState)
+        self.assertEqual(sorted(self.calculateSerialStatistics().keys()), sorted(tabulated['aggregate'].keys()))
+
+        # A template missing its header cannot be tabulated
+        lines = open(self.templateFile).readlines()
+        open(self.templateFile, 'w').writelines(lines[1:])
+        self.settleTemplate()
+
+        self.assertEqual([(self.templateFile, hashFile(self.templateFile))], self.poll(watchState))
+        self.assertEqual(tabulated, watchState)
+
+        # The template is tried again until it can be tabulated
+        self.assertEqual(1, len(self.poll(watchState)))
+        self.assertEqual(tabulated, watchState)
+
+        open(self.templateFile, 'w').writelines(lines[:-1])
+        self.settleTemplate()
+        self.assertEqual(1, len(self.poll(watchState)))
+        self.assertNotEqual(tabulated['files'], watchState['files'])
+        self.assertEqual([], self.poll(watchState))
+
+if __name__ == '__main__':
+    unittest.main()
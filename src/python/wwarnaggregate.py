@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+
+##
+# This module provides a memory-bounded alternative to holding the complete
+# statistics state in memory while tabulating.
+#
+# Once the state grows past a configured number of genotype counters it is
+# flattened into partial counts sorted on their keys, spilled to a temporary 
+# file and cleared. When all rows have been tabulated the spill files and 
+# whatever is left in memory are merged back together in two passes:
+#
+#   1. the spill files are k-way merged on their keys, summing the partial 
+#      counts of each key, and written out to runs sorted on the position each
+#      key was first tabulated at
+#   2. the runs are k-way merged on those positions, one metadata key at a
+#      time, producing the same counts in the same order as the in-memory 
+#      engine
+#
+# Only the partial counts of a single metadata key and one run of at most 
+# maxGenotypes counts are held in memory at any one time.
+#
+
+import cPickle
+import heapq
+import os
+import tempfile
+
+from collections import OrderedDict
+from itertools import groupby
+from wwarncalculations import tabulateMarkerCounts, calculatePrevalenceStatistic
+
+# Number of partial counts pickled together when writing a spill file. Runs
+# written while merging hold at least this many counts so that a small 
+# maxGenotypes does not leave us merging thousands of runs at once.
+SPILL_BATCH_SIZE = 1000
+
+# Number of levels of keys of each count: metadata key, marker, genotype and group
+KEY_LEVELS = 4
+
+class ExternalCountTable(object):
+    """
+    Tracks the size of a statistics state while it is being tabulated and
+    spills it to disk whenever it holds more than maxGenotypes genotypes.
+
+    Nothing but the names of our spill files is kept in memory across spills.
+    Each partial count is spilled along with the position of its metadata key,
+    marker, genotype and group in the state it was spilled from, and spill 
+    files are sorted on the keys themselves so they can be merged without a 
+    lookup of every key seen so far. These positions are used to restore the
+    order the keys were first tabulated in once they have been merged (see 
+    iterateMergedState).
+    """
+    def __init__(self, maxGenotypes, spillDir=None):
+        self.maxGenotypes = maxGenotypes
+        self.spillDir = spillDir
+        self.spillFiles = []
+        self.genotypeCount = 0
+
+    def genotypeAdded(self, state):
+        """
+        Called whenever a new genotype is added to our state, spilling the state
+        once it has grown past our limit
+        """
+        self.genotypeCount += 1
+        if self.genotypeCount >= self.maxGenotypes:
+            self.spill(state)
+
+    def spill(self, state):
+        """
+        Writes the partial counts held in our state to a new spill file sorted on
+        their keys and clears the state
+        """
+        records = sorted(self._flattenState(state, len(self.spillFiles)))
+        self.spillFiles.append(self._writeSpillFile(records))
+
+        state.clear()
+        self.genotypeCount = 0
+
+    def _writeSpillFile(self, records):
+        (spillFD, spillFile) = tempfile.mkstemp(prefix='wwarn.', suffix='.spill', dir=self.spillDir)
+        spillFH = os.fdopen(spillFD, 'wb')
+        for i in xrange(0, len(records), SPILL_BATCH_SIZE):
+            cPickle.dump(records[i:i + SPILL_BATCH_SIZE], spillFH, cPickle.HIGHEST_PROTOCOL)
+        spillFH.close()
+
+        return spillFile
+
+    def _flattenState(self, state, spillIndex):
+        """
+        Converts a state dictionary into a list of partial counts in the following
+        format:
+
+            (METADATA KEY, MARKER KEY, GENOTYPE, GROUP, COUNT, ORDER)
+
+        Sample sizes are stored under the 'sample_size' genotype. ORDER holds a
+        (SPILL INDEX, POSITION) tuple for each of the four keys, where POSITION
+        is the position of the key among its siblings in the state. As the state
+        keeps its keys in the order they were tabulated, a key first tabulated in
+        an earlier spill or earlier in the same spill has the lower ORDER.
+        """
+        records = []
+
+        for (metaPos, (metaKey, markers)) in enumerate(state.iteritems()):
+            for (markerPos, (markerKey, genotypes)) in enumerate(markers.iteritems()):
+                for (genotypePos, (genotype, groups)) in enumerate(genotypes.iteritems()):
+                    for (groupPos, (group, count)) in enumerate(groups.iteritems()):
+                        if genotype != 'sample_size':
+                            count = count.get('genotyped')
+
+                        order = tuple([(spillIndex, p) for p in [metaPos, markerPos, genotypePos, groupPos]])
+                        records.append((metaKey, markerKey, genotype, group, count, order))
+
+        return records
+
+    def _readSpillFile(self, spillFile):
+        spillFH = open(spillFile, 'rb')
+
+        while True:
+            try:
+                records = cPickle.load(spillFH)
+            except EOFError:
+                break
+
+            for record in records:
+                yield record
+
+        spillFH.close()
+
+    def _mergeMetaRecords(self, metaRecords):
+        """
+        Sums the partial counts of a single metadata key read in key order, 
+        returning one count per key in the following format:
+
+            (ORDER, METADATA KEY, MARKER KEY, GENOTYPE, GROUP, COUNT)
+
+        Each level of ORDER is the lowest order its key was spilled with, so
+        that every count under the same metadata key, marker or genotype shares
+        the same order at that level.
+        """
+        counts = []
+        firstSeen = {}
+
+        for (key, records) in groupby(metaRecords, lambda r: r[0:KEY_LEVELS]):
+            records = list(records)
+            counts.append((key, sum([r[4] for r in records])))
+
+            # The metadata key is the same for every record so each level is 
+            # keyed on the marker, genotype and group keys above it
+            for record in records:
+                for level in xrange(KEY_LEVELS):
+                    levelKey = key[1:level + 1]
+                    if levelKey not in firstSeen or record[5][level] < firstSeen[levelKey]:
+                        firstSeen[levelKey] = record[5][level]
+
+        return [(tuple([firstSeen[key[1:l + 1]] for l in xrange(KEY_LEVELS)]),) + key + (count,)
+                for (key, count) in counts]
+
+    def iterateMergedState(self, state):
+        """
+        Merges every spill file with the partial counts still held in our state,
+        yielding a tuple of (METADATA KEY, MARKERS) for each metadata key in the
+        order they were first tabulated. MARKERS is built in the same format as
+        the markers of a state dictionary.
+
+        Spill files, and the runs written while merging them, are removed once
+        they have been merged.
+        """
+        sources = [self._readSpillFile(f) for f in self.spillFiles]
+        sources.append(iter(sorted(self._flattenState(state, len(self.spillFiles)))))
+        state.clear()
+
+        try:
+            # Counts are summed across spill files in key order and written out 
+            # to runs sorted on the order their keys were first tabulated in
+            runFiles = []
+            run = []
+            for (metaKey, metaRecords) in groupby(heapq.merge(*sources), lambda r: r[0]):
+                run.extend(self._mergeMetaRecords(metaRecords))
+
+                if len(run) >= max(self.maxGenotypes, SPILL_BATCH_SIZE):
+                    runFiles.append(self._writeSpillFile(sorted(run)))
+                    self.spillFiles.append(runFiles[-1])
+                    run = []
+
+            runs = [self._readSpillFile(f) for f in runFiles]
+            runs.append(iter(sorted(run)))
+            run = None
+
+            for (metaOrder, records) in groupby(heapq.merge(*runs), lambda r: r[0][0]):
+                markers = OrderedDict()
+                metaKey = None
+
+                for (order, metaKey, markerKey, genotype, group, count) in records:
+                    groupsDict = markers.setdefault(markerKey, OrderedDict()).setdefault(genotype, OrderedDict())
+                    if genotype == 'sample_size':
+                        groupsDict[group] = count
+                    else:
+                        groupsDict[group] = OrderedDict([('genotyped', count)])
+
+                yield (metaKey, markers)
+        finally:
+            self.removeSpillFiles()
+
+    def removeSpillFiles(self):
+        for spillFile in self.spillFiles:
+            if os.path.exists(spillFile):
+                os.remove(spillFile)
+
+        self.spillFiles = []
+
+def calculateSpilledWWARNStatistics(data, ageGroups, spillTable):
+    """
+    Memory-bounded counterpart of calculateWWARNStatistics. Tabulates all rows
+    of data, spilling to disk through the passed in ExternalCountTable, and then
+    yields a single-key state dictionary containing the statistics of each
+    metadata key, prevalence included, in the order they were first tabulated.
+    """
+    state = OrderedDict()
+    tabulateMarkerCounts(state, data, ageGroups, spillTable=spillTable)
+
+    for (metaKey, markers) in spillTable.iterateMergedState(state):
+        metaState = OrderedDict([(metaKey, markers)])
+        calculatePrevalenceStatistic(metaState)
+
+        yield metaState
@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+
+##
+# This module builds and queries a bitmap index of the single marker genotype
+# calls of our calculation input, from which the counts of any combination of
+# loci can be worked out without a stored procedure or another pass over the
+# data.
+#
+# The index is partitioned by metadata key (study, site and year group when
+# binning by year). Within each partition every patient is given an ordinal
+# and the index holds a bitmap (a Python long) over those ordinals for:
+#
+#     each (LOCUS NAME, LOCUS POSITION) and called genotype
+#     each group of our stratification (i.e. age groups)
+#
+# The patients carrying a combination of genotypes are found by ANDing the
+# bitmaps of each genotype together, dropping any combination that leaves no
+# patients as soon as it is found, and the genotyped count of each group is
+# the number of bits set in the result ANDed with the bitmap of the group.
+# Uncalled genotypes (Not Genotyped, Genotyping Failure) are left out of the
+# index just as they are left out of our combination markers.
+#
+# Patients are identified by their patient ID within each metadata key, the
+# same way the haplotype stored procedures join genotypes on their subject, so
+# several rows of the same patient count towards a combination only once.
+#
+# The index is written out in the following format:
+#
+#     MAGIC (8 bytes) | VERSION (uint32) | HEADER LENGTH (uint32)
+#     HEADER (JSON)
+#     PARTITION 1 | PARTITION 2 | ... | PARTITION N
+#
+# The header lists the groups of the index and, for each partition, its
+# metadata key, number of patients, the genotypes it holds bitmaps for and
+# the offset and length of its bitmaps. Each partition is zlib compressed and
+# only decompressed the first time it is queried.
+#
+
+import argparse
+import binascii
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+from array import array
+from collections import OrderedDict
+from wwarncalculations import (createStratification, parseMarkerComponents, parseGenotypeValues,
+                               calculatePrevalence)
+from wwarnconfig import loadConfigBundle
+from wwarncubefile import decodeValue
+from wwarnexceptions import BitmapIndexException
+from wwarnutils import validateGenotypes
+
+BITMAP_FILE_MAGIC = 'WWARNBI\0'
+
+# Bumped whenever the layout of our index files changes
+BITMAP_FILE_VERSION = 1
+
+PREAMBLE = struct.Struct('<8sII')
+
+def ordinalsToBitmap(ordinals, size):
+    """
+    Returns a bitmap over size patients with the bit of each of the passed in
+    ordinals set
+    """
+    buf = bytearray((size + 7) // 8)
+    for ordinal in ordinals:
+        buf[ordinal >> 3] |= 1 << (ordinal & 7)
+
+    buf.reverse()
+    return long(binascii.hexlify(str(buf)), 16)
+
+def bitmapToBytes(bitmap, size):
+    """
+    Packs a bitmap over size patients into a big-endian string of bytes
+    """
+    return binascii.unhexlify(('%x' % bitmap).rjust(((size + 7) // 8) * 2, '0'))
+
+def bytesToBitmap(data):
+    return long(binascii.hexlify(data), 16)
+
+def countBits(bitmap):
+    return bin(bitmap).count('1')
+
+class BitmapPartition(object):
+    """
+    The genotype and group bitmaps over the patients of a single metadata key
+    """
+    def __init__(self, metadataKey, patients, genotypes=None, groups=None):
+        self.metadataKey = metadataKey
+        self.patients = patients
+        self.genotypes = genotypes if genotypes is not None else OrderedDict()
+        self.groups = groups if groups is not None else OrderedDict()
+
+    def getGenotypes(self, locus):
+        """
+        Returns an ordered dictionary of the bitmap of each genotype called at
+        the given (LOCUS NAME, LOCUS POSITION)
+        """
+        return self.genotypes.get(locus, {})
+
+    def pack(self, groups):
+        """
+        Returns a tuple of the list of ((LOCUS NAME, LOCUS POSITION), GENOTYPE)
+        bitmaps held by this partition and all of its bitmaps, followed by the
+        bitmap of each of the passed in groups, compressed into one string
+        """
+        keys = []
+        data = []
+        for (locus, genotypeIter) in self.genotypes.iteritems():
+            for (genotype, bitmap) in genotypeIter.iteritems():
+                keys.append((locus, genotype))
+                data.append(bitmapToBytes(bitmap, self.patients))
+
+        for group in groups:
+            data.append(bitmapToBytes(self.groups.get(group, 0), self.patients))
+
+        return (keys, zlib.compress("".join(data)))
+
+    @classmethod
+    def unpack(cls, metadataKey, patients, keys, groups, packed):
+        """
+        Rebuilds a partition from the output of pack
+        """
+        data = zlib.decompress(packed)
+        size = (patients + 7) // 8
+        bitmaps = [bytesToBitmap(data[i:i + size]) for i in xrange(0, len(data), size)]
+
+        if len(bitmaps) != len(keys) + len(groups):
+            raise BitmapIndexException("Partition %s holds %s bitmaps, expected %s" %
+                                       (str(metadataKey), len(bitmaps), len(keys) + len(groups)))
+
+        partition = cls(metadataKey, patients)
+        for ((locus, genotype), bitmap) in zip(keys, bitmaps):
+            partition.genotypes.setdefault(locus, OrderedDict())[genotype] = bitmap
+        for (group, bitmap) in zip(groups, bitmaps[len(keys):]):
+            partition.groups[group] = bitmap
+
+        return partition
+
+class BitmapIndexBuilder(object):
+    """
+    Collects the patient ordinals of each genotype and group while rows of
+    calculation input are added and turns them into a BitmapIndex. Only
+    single marker rows are indexed.
+    """
+    def __init__(self, ageGroups=None):
+        self.stratification = createStratification(ageGroups)
+        self.groups = list(self.stratification.getLabels()) if self.stratification else []
+        self.partitions = OrderedDict()
+
+    def addRows(self, data):
+        """
+        Adds every row of calculation input to the index, returning the number
+        of rows added
+        """
+        rowsAdded = 0
+
+        # The same few marker and genotype strings repeat on every row so each
+        # is only parsed the first time it is seen
+        markerKeys = {}
+        genotypeKeys = {}
+
+        for line in data:
+            markerKey = markerKeys.get(line[7])
+            if markerKey is None:
+                markerKey = markerKeys.setdefault(line[7], parseMarkerComponents(line[7]))
+            if len(markerKey) != 1:
+                continue
+
+            genotype = genotypeKeys.get(line[8])
+            if genotype is None:
+                genotype = parseGenotypeValues(line[8])
+                genotype = genotypeKeys.setdefault(line[8], genotype[0] if validateGenotypes(genotype) else False)
+            if not genotype:
+                continue
+
+            metadataKey = (line[0], line[1], line[3], line[4], line[2])
+            partition = self.partitions.get(metadataKey)
+            if partition is None:
+                partition = self.partitions.setdefault(metadataKey, (OrderedDict(), OrderedDict(), OrderedDict()))
+            (patients, genotypes, groups) = partition
+
+            ordinal = patients.get(line[5])
+            if ordinal is None:
+                ordinal = patients.setdefault(line[5], len(patients))
+
+            ordinals = genotypes.get((markerKey[0], genotype))
+            if ordinals is None:
+                ordinals = genotypes.setdefault((markerKey[0], genotype), array('i'))
+            ordinals.append(ordinal)
+
+            if self.stratification:
+                for group in self.stratification.getRowGroups(line):
+                    groups.setdefault(group, array('i')).append(ordinal)
+
+            rowsAdded += 1
+
+        return rowsAdded
+
+    def build(self):
+        index = BitmapIndex(self.groups)
+
+        for (metadataKey, (patients, genotypes, groups)) in self.partitions.iteritems():
+            partition = BitmapPartition(metadataKey, len(patients))
+
+            for ((locus, genotype), ordinals) in genotypes.iteritems():
+                bitmap = ordinalsToBitmap(ordinals, len(patients))
+                partition.genotypes.setdefault(locus, OrderedDict())[genotype] = bitmap
+
+            for (group, ordinals) in groups.iteritems():
+                partition.groups[group] = ordinalsToBitmap(ordinals, len(patients))
+
+            index.addPartition(partition)
+
+        return index
+
+class BitmapIndex(object):
+    """
+    Genotype and group bitmaps partitioned by metadata key. Partitions read
+    from an index file are decompressed the first time they are queried.
+    """
+    def __init__(self, groups):
+        self.groups = list(groups)
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def addPartition(self, partition):
+        self.entries.append((partition.metadataKey, partition))
+
+    def iteratePartitions(self, predicate=None):
+        """
+        Yields every partition whose metadata key satisfies the predicate
+        """
+        for (i, (metadataKey, partition)) in enumerate(self.entries):
+            if predicate is not None and not predicate(metadataKey):
+                continue
+
+            if callable(partition):
+                partition = partition()
+                self.entries[i] = (metadataKey, partition)
+
+            yield partition
+
+    def countCombination(self, loci, predicate=None):
+        """
+        Counts the patients carrying each combination of genotypes called at
+        the passed in list of (LOCUS NAME, LOCUS POSITION) tuples in every
+        partition whose metadata key satisfies the predicate. Returns a state
+        variable in the same format as tabulateMarkerCounts in
+        wwarncalculations.py for the combination marker.
+        """
+        if not loci:
+            raise BitmapIndexException("A combination needs at least one locus")
+
+        state = OrderedDict()
+        markerKey = tuple(loci)
+        groups = ['All'] + self.groups
+
+        for partition in self.iteratePartitions(predicate):
+            combinations = [((), (1 << partition.patients) - 1)]
+
+            # Combinations carried by no patients are dropped as soon as they
+            # are found so they are never extended by the following loci
+            for locus in loci:
+                extended = []
+                for (genotype, patients) in combinations:
+                    for (locusGenotype, bitmap) in partition.getGenotypes(locus).iteritems():
+                        carriers = patients & bitmap
+                        if carriers:
+                            extended.append((genotype + (locusGenotype,), carriers))
+                combinations = extended
+
+            if not combinations:
+                continue
+
+            markerState = state.setdefault(partition.metadataKey, OrderedDict()).setdefault(markerKey, OrderedDict())
+            sampleSize = markerState.setdefault('sample_size', OrderedDict([(g, 0) for g in groups]))
+
+            for (genotype, carriers) in combinations:
+                counts = OrderedDict()
+                for group in groups:
+                    if group == 'All':
+                        genotyped = countBits(carriers)
+                    else:
+                        genotyped = countBits(carriers & partition.groups.get(group, 0))
+
+                    counts[group] = { 'genotyped': genotyped }
+                    sampleSize[group] += genotyped
+
+                markerState[genotype] = counts
+
+        return state
+
+    def write(self, indexFile):
+        """
+        Writes the index out to an index file. The file is written to a
+        temporary file first and moved into place once complete.
+        """
+        header = { 'groups': self.groups, 'partitions': [] }
+        blocks = []
+        offset = 0
+
+        for partition in self.iteratePartitions():
+            (keys, packed) = partition.pack(self.groups)
+            header['partitions'].append({ 'metadata': partition.metadataKey, 'patients': partition.patients,
+                                          'genotypes': keys, 'offset': offset, 'length': len(packed) })
+            blocks.append(packed)
+            offset += len(packed)
+
+        headerStr = json.dumps(header, separators=(',', ':'))
+
+        tmpFile = "%s.%s.tmp" % (indexFile, os.getpid())
+        indexFH = open(tmpFile, 'wb')
+        indexFH.write(PREAMBLE.pack(BITMAP_FILE_MAGIC, BITMAP_FILE_VERSION, len(headerStr)))
+        indexFH.write(headerStr)
+        for packed in blocks:
+            indexFH.write(packed)
+
+        indexFH.close()
+        os.rename(tmpFile, indexFile)
+
+def loadBitmapIndex(indexFile):
+    """
+    Loads a bitmap index from an index file. Only the header is parsed up
+    front; each partition is read and decompressed when it is first queried.
+    """
+    indexFH = open(indexFile, 'rb')
+    preamble = indexFH.read(PREAMBLE.size)
+
+    if len(preamble) < PREAMBLE.size:
+        raise BitmapIndexException("%s is not a WWARN bitmap index" % indexFile)
+
+    (magic, version, headerLength) = PREAMBLE.unpack(preamble)
+    if magic != BITMAP_FILE_MAGIC:
+        raise BitmapIndexException("%s is not a WWARN bitmap index" % indexFile)
+    if version != BITMAP_FILE_VERSION:
+        raise BitmapIndexException("%s was written in bitmap index version %s, expected version %s" %
+                                   (indexFile, version, BITMAP_FILE_VERSION))
+
+    header = json.loads(indexFH.read(headerLength))
+    dataStart = PREAMBLE.size + headerLength
+    indexFH.close()
+
+    index = BitmapIndex([decodeValue(g) for g in header['groups']])
+    for entry in header['partitions']:
+        entry = dict([(decodeValue(k), decodeValue(v)) for (k, v) in entry.iteritems()])
+        index.entries.append((entry['metadata'], createPartitionLoader(indexFile, dataStart, entry, index.groups)))
+
+    return index
+
+def createPartitionLoader(indexFile, dataStart, entry, groups):
+    """
+    Returns a function reading a single partition back from an index file
+    """
+    def loadPartition():
+        indexFH = open(indexFile, 'rb')
+        indexFH.seek(dataStart + entry['offset'])
+        packed = indexFH.read(entry['length'])
+        indexFH.close()
+
+        return BitmapPartition.unpack(entry['metadata'], entry['patients'], entry['genotypes'], groups, packed)
+
+    return loadPartition
+
+def parseLoci(markerStr):
+    """
+    Parses a combination of loci written in the same format as the markers of
+    our calculation input (i.e. pfdhps_437_SNP + pfdhps_540_SNP)
+    """
+    return list(parseMarkerComponents(markerStr))
+
+def buildArgParser():
+    """
+    Creates an argparser object using the command-line arguments passed into this script
+    """
+    parser = argparse.ArgumentParser(description='Builds a bitmap index of single marker genotype calls and '
+                                        + 'counts any combination of loci from it')
+    parser.add_argument('-c', '--config_file', required=True, help='A configuration file containing parameters '
+                            + 'required for execution of the calculations script.')
+    parser.add_argument('-m', '--marker_list', required=False, help='A list of all possible markers that should be '
+                            + 'looked at in tabulating these statistics.')
+    parser.add_argument('--config_bundle', required=False, help='The compiled configuration bundle to use. Defaults '
+                            + 'to the configuration file path with a .bundle extension')
+    parser.add_argument('-x', '--index_file', required=True, help='The bitmap index to build or query')
+    parser.add_argument('--build', required=False, action='store_true', default=False, help='Build the bitmap '
+                            + 'index from a WWARN template (-i) or, without one, from the WWARN database')
+    parser.add_argument('-i', '--input_file', required=False, help='The WWARN template the index is built from')
+    parser.add_argument("-b", "--bin-by-year", required=False, help="Bin all studies by a year range when "
+                            + "building the index", type=int, dest="year_step")
+    parser.add_argument('-l', '--loci', required=False, help='The combination of loci to count, written as a '
+                            + 'combination marker, i.e. "pfdhps_437_SNP + pfdhps_540_SNP"')
+    parser.add_argument('-s', '--study_id', required=False, help='Only count the patients of this study')
+    parser.add_argument('-t', '--site', required=False, help='Only count the patients of this site')
+    args = parser.parse_args()
+
+    if not args.build and not args.loci:
+        parser.error("Either --build or --loci is required")
+
+    return args
+
+def buildIndex(parser, bundle):
+    """
+    Builds a bitmap index from the rows of a WWARN template or the WWARN
+    database in the same format our calculations are tabulated from
+    """
+    stratification = bundle['stratification']
+    builder = BitmapIndexBuilder(stratification)
+
+    if parser.input_file:
+        from WWARN_template_calculations import createFileIterator
+        dataIter = createFileIterator(parser.input_file, bundle['copy_number_groups'], bundle['marker_catalog'],
+                                      parser.year_step, stratification.getExtraColumns())
+    else:
+        from WWARN_db_calculations import createMysqlIterator
+        dataIter = createMysqlIterator(bundle['config'], [], [], bundle['copy_number_groups'], {}, parser.year_step)
+
+    rowsAdded = builder.addRows(dataIter)
+    index = builder.build()
+    index.write(parser.index_file)
+
+    print >> sys.stderr, "DEBUG: Indexed %s genotype calls across %s partitions to %s" % (rowsAdded, len(index), parser.index_file)
+
+def main(parser):
+    bundle = loadConfigBundle(parser.config_file, parser.marker_list, parser.config_bundle)
+
+    if parser.build:
+        buildIndex(parser, bundle)
+
+    if not parser.loci:
+        return
+
+    index = loadBitmapIndex(parser.index_file)
+    loci = parseLoci(parser.loci)
+
+    predicate = None
+    if parser.study_id or parser.site:
+        predicate = lambda m: ((not parser.study_id or m[0] == parser.study_id) and
+                               (not parser.site or m[3] == parser.site))
+
+    start = time.time()
+    state = index.countCombination(loci, predicate)
+    elapsed = time.time() - start
+
+    print "\t".join(['STUDY_ID', 'STUDY_LABEL', 'COUNTRY', 'SITE', 'INVESTIGATOR', 'GROUP', 'MARKER', 'GENOTYPE',
+                     'SAMPLE SIZE', 'GENOTYPED', 'PREVALENCE'])
+
+    marker = " + ".join([" ".join([c for c in l if c]) for l in loci])
+    for (metadataKey, markerIter) in state.iteritems():
+        (studyId, studyLabel, country, site, investigator) = metadataKey
+
+        for (markerKey, genotypeIter) in markerIter.iteritems():
+            sampleSizeDict = genotypeIter['sample_size']
+
+            for (genotype, groupIter) in genotypeIter.iteritems():
+                if genotype == 'sample_size': continue
+
+                for (group, counts) in groupIter.iteritems():
+                    sampleSize = sampleSizeDict[group]
+                    prevalence = calculatePrevalence(counts['genotyped'], sampleSize) if sampleSize else 0
+                    print "\t".join([studyId, studyLabel, country, site, investigator, group, marker,
+                                     " + ".join(genotype), str(sampleSize), str(counts['genotyped']),
+                                     "{0:.0%}".format(prevalence)])
+
+    # Kept off stdout so that the table above can be piped on as is
+    print >> sys.stderr, "DEBUG: Counted %s in %.1f ms" % (marker, elapsed * 1000)
+
+if __name__ == "__main__":
+    main(buildArgParser())
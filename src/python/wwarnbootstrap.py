@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+##
+# This module calculates bootstrap percentile intervals for the prevalence
+# statistics of a calculation run, worked out from the counts already held in
+# our site-level result cube (see wwarncube.py) rather than from the input rows.
+#
+# Every prevalence cell is resampled in one of two ways:
+#
+#     site    - a cluster bootstrap; the sites pooled into a cell (i.e. every
+#               site of a country) are drawn with replacement and the counts
+#               of the drawn sites summed. A cell made up of a single site
+#               cannot be resampled by site so its patients are resampled
+#               instead.
+#     patient - the patients of each site are drawn with replacement, keeping
+#               the sample size of each site fixed
+#
+# Cells sharing a unit, year group, marker and group are resampled together as
+# a single task since they share their sites and sample sizes. Tasks are split
+# into chunks worked through by a pool of processes. Each task is seeded from
+# a single random number generator before any work is handed out, so the same
+# seed gives the same intervals however many processes are used.
+#
+# When numpy is installed the replicates of a task are drawn in a handful of
+# array operations; otherwise they are drawn one at a time with the random
+# module. The two draw different random numbers so intervals are only
+# reproducible from a seed with the same one.
+#
+
+import bisect
+import math
+import multiprocessing
+import random
+
+from collections import OrderedDict
+from wwarnutils import importOptionalModule
+
+BOOTSTRAP_METHODS = ['site', 'patient']
+DEFAULT_REPLICATES = 1000
+
+# Level holding the intervals of our site-level cells, alongside any of our
+# roll-up levels (see ROLL_UP_LEVELS in wwarncube.py)
+SITE_LEVEL = 'site'
+
+# Number of tasks handed to a worker process at a time
+TASK_CHUNK_SIZE = 64
+
+# Largest seed accepted by numpy's random number generator
+MAX_SEED = 2 ** 32 - 1
+
+def calculateBootstrapIntervals(siteCube, method='site', replicates=DEFAULT_REPLICATES, confidence=0.95,
+                                seed=0, processes=1, levels=None):
+    """
+    Calculates the bootstrap percentile interval of the prevalence of every
+    cell of a site-level result cube, and of every cell of each of the passed
+    in roll-up levels (an ordered dictionary of level names and the functions
+    mapping a study and site to those of the level, see ROLL_UP_LEVELS).
+    Returns an ordered dictionary in the following format:
+
+        { <LEVEL>: { <CELL COORDINATES>: (<LOWER>, <UPPER>) } }
+
+    where the site-level intervals are held under SITE_LEVEL. The interval of
+    a cell without a sample size is (None, None).
+    """
+    if method not in BOOTSTRAP_METHODS:
+        raise ValueError("Unknown bootstrap method %s" % method)
+
+    allLevels = OrderedDict([(SITE_LEVEL, None)])
+    allLevels.update(levels or {})
+
+    seeds = random.Random(seed)
+    tasks = []
+    for (level, mapFunc) in allLevels.iteritems():
+        for task in buildBootstrapTasks(siteCube, mapFunc):
+            tasks.append((level,) + task + (seeds.randint(0, MAX_SEED),))
+
+    chunks = [(tasks[i:i + TASK_CHUNK_SIZE], method, replicates, confidence)
+              for i in xrange(0, len(tasks), TASK_CHUNK_SIZE)]
+
+    intervals = OrderedDict([(l, {}) for l in allLevels])
+    for results in mapChunks(chunks, processes):
+        for (level, cellKeys, cellIntervals) in results:
+            intervals[level].update(zip(cellKeys, cellIntervals))
+
+    return intervals
+
+def buildBootstrapTasks(siteCube, mapFunc=None):
+    """
+    Groups the cells of a site-level cube by the unit (study and site of a
+    level, see ROLL_UP_LEVELS) they are pooled into, year group, marker and
+    group. Returns a list of tasks in the following format:
+
+        ([<CELL COORDINATES>], [[<GENOTYPED AT EACH SITE>]], [<SAMPLE SIZE OF EACH SITE>])
+
+    holding the coordinates and genotyped counts of every genotype of the task.
+    Sites without a sample size are left out.
+    """
+    tasks = OrderedDict()
+    columns = [(siteCube.values[d], siteCube.codes[d]) for d in siteCube.dimensions]
+    mapped = {}
+
+    for i in xrange(len(siteCube)):
+        sampleSize = siteCube.measures['sample_size'][i]
+        if not sampleSize:
+            continue
+
+        (study, site, yearGroup, marker, genotype, group) = [values[codes[i]] for (values, codes) in columns]
+
+        unit = (study, site)
+        if mapFunc is not None:
+            unit = mapped.get((study, site))
+            if unit is None:
+                unit = mapped.setdefault((study, site), mapFunc(study, site))
+
+        (genotypes, sites) = tasks.setdefault(unit + (yearGroup, marker, group), (OrderedDict(), OrderedDict()))
+        sites.setdefault((study, site), sampleSize)
+        genotypes.setdefault(genotype, {})[(study, site)] = siteCube.measures['genotyped'][i]
+
+    bootstrapTasks = []
+    for ((study, site, yearGroup, marker, group), (genotypes, sites)) in tasks.iteritems():
+        cellKeys = [(study, site, yearGroup, marker, genotype, group) for genotype in genotypes]
+        genotypedCounts = [[counts.get(s, 0) for s in sites] for counts in genotypes.itervalues()]
+        bootstrapTasks.append((cellKeys, genotypedCounts, sites.values()))
+
+    return bootstrapTasks
+
+def mapChunks(chunks, processes):
+    """
+    Resamples each chunk of tasks, in a pool of processes if more than one
+    is requested, yielding the results of each chunk in order
+    """
+    if processes <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield resampleChunk(chunk)
+        return
+
+    pool = multiprocessing.Pool(min(processes, len(chunks)))
+    try:
+        for results in pool.imap(resampleChunk, chunks):
+            yield results
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def resampleChunk(chunk):
+    """
+    Resamples every task of a chunk, returning a list of the level, cell
+    coordinates and intervals of each task
+    """
+    (tasks, method, replicates, confidence) = chunk
+    results = []
+
+    for (level, cellKeys, genotypedCounts, sampleSizes, seed) in tasks:
+        # A single site is resampled by patient whatever the method
+        if method == 'site' and len(sampleSizes) > 1:
+            prevalences = resampleSites(genotypedCounts, sampleSizes, replicates, seed)
+        else:
+            prevalences = resamplePatients(genotypedCounts, sampleSizes, replicates, seed)
+
+        alpha = (1 - confidence) / 2.0
+        cellIntervals = [(percentile(p, alpha), percentile(p, 1 - alpha)) for p in prevalences]
+        results.append((level, cellKeys, cellIntervals))
+
+    return results
+
+def resampleSites(genotypedCounts, sampleSizes, replicates, seed):
+    """
+    Draws the passed in number of cluster bootstrap replicates of the pooled
+    prevalence of each genotype, returning a sorted list of the replicate
+    prevalences of each genotype
+    """
+    siteCount = len(sampleSizes)
+
+    numpy = importOptionalModule('numpy')
+    if numpy is not None:
+        rng = numpy.random.RandomState(seed)
+        weights = rng.multinomial(siteCount, [1.0 / siteCount] * siteCount, size=replicates)
+        pooledSizes = weights.dot(numpy.array(sampleSizes, dtype=float))
+        pooledCounts = weights.dot(numpy.array(genotypedCounts, dtype=float).T)
+        prevalences = pooledCounts / pooledSizes[:, numpy.newaxis]
+        return numpy.sort(prevalences, axis=0).T.tolist()
+
+    rng = random.Random(seed)
+    prevalences = [[] for counts in genotypedCounts]
+
+    for r in xrange(replicates):
+        drawn = [rng.randrange(siteCount) for s in xrange(siteCount)]
+        pooledSize = float(sum([sampleSizes[s] for s in drawn]))
+
+        for (counts, replicatePrevalences) in zip(genotypedCounts, prevalences):
+            replicatePrevalences.append(sum([counts[s] for s in drawn]) / pooledSize)
+
+    return [sorted(p) for p in prevalences]
+
+def resamplePatients(genotypedCounts, sampleSizes, replicates, seed):
+    """
+    Draws the passed in number of bootstrap replicates of the prevalence of
+    each genotype with the patients of each site resampled, returning a sorted
+    list of the replicate prevalences of each genotype. Resampling the
+    patients of a site draws its genotyped count from a binomial distribution.
+    """
+    pooledSize = float(sum(sampleSizes))
+
+    numpy = importOptionalModule('numpy')
+    if numpy is not None:
+        rng = numpy.random.RandomState(seed)
+        sizes = numpy.array(sampleSizes)
+        counts = numpy.array(genotypedCounts, dtype=float)
+        draws = rng.binomial(sizes, numpy.minimum(counts / sizes, 1.0), size=(replicates,) + counts.shape)
+        prevalences = draws.sum(axis=2) / pooledSize
+        return numpy.sort(prevalences, axis=0).T.tolist()
+
+    rng = random.Random(seed)
+    prevalences = []
+
+    for counts in genotypedCounts:
+        replicateCounts = [0] * replicates
+
+        for (genotyped, sampleSize) in zip(counts, sampleSizes):
+            cdf = buildBinomialCDF(sampleSize, float(genotyped) / sampleSize)
+            for r in xrange(replicates):
+                replicateCounts[r] += bisect.bisect_left(cdf, rng.random())
+
+        prevalences.append(sorted([c / pooledSize for c in replicateCounts]))
+
+    return prevalences
+
+def buildBinomialCDF(n, p):
+    """
+    Returns the cumulative distribution function of a binomial distribution
+    as a list, so that a uniform draw can be turned into a binomial draw with
+    a binary search
+    """
+    if p <= 0:
+        return [1.0]
+    if p >= 1:
+        return [0.0] * n + [1.0]
+
+    logP = math.log(p)
+    logQ = math.log(1 - p)
+    logNFactorial = math.lgamma(n + 1)
+    pmf = [math.exp(logNFactorial - math.lgamma(k + 1) - math.lgamma(n - k + 1) + k * logP + (n - k) * logQ)
+           for k in xrange(n + 1)]
+
+    cdf = []
+    total = 0.0
+    for probability in pmf:
+        total += probability
+        cdf.append(total)
+
+    # Guard against rounding leaving the last value just short of 1
+    cdf[-1] = 1.0
+    return cdf
+
+def percentile(sortedValues, q):
+    """
+    Returns the q-th quantile of a sorted list of values, interpolating
+    linearly between the two nearest values
+    """
+    position = q * (len(sortedValues) - 1)
+    lower = int(math.floor(position))
+    upper = min(lower + 1, len(sortedValues) - 1)
+
+    return sortedValues[lower] + (sortedValues[upper] - sortedValues[lower]) * (position - lower)
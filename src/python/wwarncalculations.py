@@ -6,14 +6,33 @@ __maintainer__ = "Cesar Arze"
 __email__ = "carze@som.umaryland.edu"
 __status__ = "Development"
 
+import time
+
 from collections import OrderedDict
-from wwarnutils import validateGenotypes
+from itertools import product
+from wwarnutils import validateGenotypes, canonicalGenotype
 
 ##
 # This library performs the necessary WWARN calculations to produce both prevalence 
 # and total genotyped statistics
 
-def calculateWWARNStatistics(state, data, ageGroups=None):
+# Index of the age of a patient in each row of input to our calculations. Any 
+# columns a stratification needs beyond the age are appended to the end of each
+# row, after the marker and genotype, starting at EXTRA_COLUMN_START.
+AGE_COLUMN = 6
+EXTRA_COLUMN_START = 9
+
+# Separates the labels of each dimension in the group of a crossed stratum, 
+# i.e. "< 1 / F"
+STRATUM_SEPARATOR = " / "
+
+# Minimum number of seconds between two previews of our statistics. Each 
+# preview walks our whole state, so a preview due less than this long after the
+# previous one is skipped.
+PREVIEW_MIN_SECONDS = 10
+
+def calculateWWARNStatistics(state, data, ageGroups=None, previewInterval=None, previewCallback=None,
+                             previewSeconds=PREVIEW_MIN_SECONDS):
     """
     Calculates the sample size and prevalence statistics for the data
     source passed in. Returned in a dictionary built in the following 
@@ -24,20 +43,47 @@ def calculateWWARNStatistics(state, data, ageGroups=None):
                 'sample_size': <SAMPLE SIZE>
                 MAKRER_VALUE: {
                     <VALUE>: <COUNT> } } }
+
+    If a preview callback is provided it is called every previewInterval rows
+    with a snapshot of the statistics tabulated so far (see generatePreviewSnapshot),
+    the number of rows processed and a flag set to False. A preview is skipped
+    if fewer than previewSeconds have passed since the last one was published.
+    Once all rows have been tabulated the callback is called one final time 
+    with the exact statistics and the flag set to True.
     """
     # Tabulate our sample size and marker counts
-    tabulateMarkerCounts(state, data, ageGroups)
+    rowsProcessed = tabulateMarkerCounts(state, data, ageGroups, previewInterval, previewCallback, 
+                                         previewSeconds=previewSeconds)
 
     # Calculate prevalence
     calculatePrevalenceStatistic(state)
 
-def tabulateMarkerCounts(state, data, ageGroups):
+    if previewCallback:
+        previewCallback(generatePreviewSnapshot(state), rowsProcessed, True)
+
+def tabulateMarkerCounts(state, data, ageGroups, previewInterval=None, previewCallback=None, spillTable=None,
+                         previewSeconds=PREVIEW_MIN_SECONDS):
     """
     This function iterates over the source of data and updates
     a state variable used to keep track of the current sample 
     size and total genotyped counts for a given marker or set
     of markers
+
+    Counts are broken down into the groups of either a list of age groups or a
+    Stratification. Every group of the stratification is tabulated in this one
+    pass over our data.
+
+    If an ExternalCountTable (see wwarnaggregate.py) is passed in it is told
+    of every new genotype added to our state so that the state can be spilled
+    to disk once it grows past the table's limit.
+
+    Previews are throttled as described in calculateWWARNStatistics.
+
+    Returns the number of rows that were tabulated
     """
+    rowsProcessed = 0
+    stratification = createStratification(ageGroups)
+    lastPreview = time.time()
 
     # Loop over each line of our input and pull out all the information we are
     # going to need to take accurate sample size and genotyped counts
@@ -47,16 +93,13 @@ def tabulateMarkerCounts(state, data, ageGroups):
         investigator = line[2]
         country = line[3]
         site = line[4]
-        age = line[6]
 
         # Our outer key in the calculations dictionary is a tuple containing 
         # some metadata: study label, country, site, investigator
         metadataKey = (wwarnStudyID, studyLabel, country, site, investigator)
 
-        # Check if our age is empty (empty string or NODATA) and if so set it
-        # equal to None
-        if age in ['', 'NODATA', 'NULL']:
-            age = None
+        # Work out which groups (i.e. age groups) this row falls into
+        rowGroups = stratification.getRowGroups(line) if stratification else ()
 
         # Split out our marker name + type combination and the genotype value 
         # from our last list element
@@ -64,7 +107,17 @@ def tabulateMarkerCounts(state, data, ageGroups):
         genotypesKey = parseGenotypeValues(line[8]) 
 
         # Increment count for this marker
-        incrementGenotypeCount(state, metadataKey, markersKey, genotypesKey, ageGroups, age)
+        created = incrementGenotypeCount(state, metadataKey, markersKey, genotypesKey, stratification, rowGroups)
+        if spillTable and created:
+            spillTable.genotypeAdded(state)
+
+        rowsProcessed += 1
+        if (previewCallback and previewInterval and rowsProcessed % previewInterval == 0
+                and time.time() - lastPreview >= previewSeconds):
+            previewCallback(generatePreviewSnapshot(state), rowsProcessed, False)
+            lastPreview = time.time()
+
+    return rowsProcessed
     
 def parseMarkerComponents(rawMarkerStr):
     """
@@ -103,6 +156,9 @@ def parseGenotypeValues(genotypeStr):
     Parses the genotype(s) provided in the input file. Genotypes
     can be one or many values that are delimited by a '+'. Only in
     combinations should multiple genotype values be provided. 
+
+    Each genotype is converted to its canonical form so that equivalent
+    calls (i.e. A/B and B/A) share a single counter.
     """
     genotypeList = []
 
@@ -113,84 +169,260 @@ def parseGenotypeValues(genotypeStr):
     else:
         genotypes = [genotypeStr]
 
-    genotypeList.extend(genotypes)
+    genotypeList.extend([canonicalGenotype(g) for g in genotypes])
     return tuple(genotypeList)
 
-def incrementGenotypeCount(dict, metaKey, markerKey, genotype, groups, age):
+def incrementGenotypeCount(dict, metaKey, markerKey, genotype, stratification=None, rowGroups=(), count=1):
     """
     Increment the state dictionary with the three keys provided. If the key does
     not already exist in the dictionary the default value is set to 1 otherwise
-    it is incremented by 1
+    it is incremented by 1. A count can be passed in to add several identical 
+    rows at once (i.e. when re-binning a histogram, see wwarnhistogram.py)
     
-    If a group of ages is passed into this function we also want to categorize 
-    all of our increments 
+    If a stratification is passed into this function we also want to categorize 
+    all of our increments into the groups of the stratification the row falls
+    into (see Stratification.getRowGroups)
+
+    Returns True if this genotype was not yet present in the state dictionary
     """
+    created = genotype not in dict.get(metaKey, {}).get(markerKey, {})
+
     dict.setdefault(metaKey, OrderedDict()).setdefault(markerKey, OrderedDict()).setdefault(genotype, OrderedDict()).setdefault('All', OrderedDict()).setdefault('genotyped', 0)
     genotypeAll = dict[metaKey][markerKey][genotype]['All']['genotyped']
-    genotypeAll += 1
+    genotypeAll += count
 
     # Initialize our sample size to 0 to avoid any errors
     dict[metaKey][markerKey].setdefault('sample_size', OrderedDict()).setdefault('All', 0)
 
     sampleAll = dict[metaKey][markerKey]['sample_size']['All']
     if validateGenotypes(genotype):
-        sampleAll += 1
+        sampleAll += count
         dict[metaKey][markerKey]['sample_size']['All'] = sampleAll
     
     dict[metaKey][markerKey][genotype]['All']['genotyped'] = genotypeAll
 
-    # If our age key is not None we need to add this age group
-    if groups:
-        incrementCountsByAgeGroup(dict, metaKey, markerKey, genotype, groups, age)
-
-def incrementCountsByAgeGroup(dict, metaKey, markerKey, genotype, groups, age):
-    """
-    Initializes all age groups in our statistics dictionary and increments
-    only the age groups where a row of data containing that age was found
-    """
-    groupKey = None
-
-    for group in groups:
-        # The groups list should contain a list of age groups in the following
-        # tuple format:
-        #
-        #     [ (lower, upper, label), (lower, upper, label), .... ]
-        #
-        # We should always assume that our grouping will be lower <= age <= upper 
-        # and our group key will be returned as "lower - upper".
-        # 
-        # The two fringe cases we will have to look out for will be (0, upper) 
-        # and (lower, 200) in these cases we are dealing with edge cases such as   
-        # (0, 1) and (12, 200) which would be represented as age < 1 and
-        # age > 12
-        #
-        # The third element in the tuple, 'label', will represent the key assigned 
-        #in the dictionary housing our statistics
-        (lower, upper, label) = group   
+    # If we are stratifying our counts we need to add them to our groups 
+    if stratification:
+        incrementCountsByGroup(dict, metaKey, markerKey, genotype, stratification.getLabels(), rowGroups, count)
 
+    return created
+
+def incrementCountsByGroup(dict, metaKey, markerKey, genotype, labels, rowGroups, count=1):
+    """
+    Initializes all groups in our statistics dictionary and increments only 
+    the groups the current row of data was found to fall into
+    """
+    for label in labels:
         dict[metaKey][markerKey]['sample_size'].setdefault(label, 0)
         dict[metaKey][markerKey][genotype].setdefault(label, OrderedDict()).setdefault('genotyped', 0)
 
-        if age is not None:
+    for groupKey in rowGroups:
+        # Once again, hacky but we do not want to increment the sample size for a given
+        # group if our genotype is 'Not genotyped' or 'Genotyping failure'
+        if validateGenotypes(genotype): 
+            dict[metaKey][markerKey]['sample_size'][groupKey] += count
+                
+        dict[metaKey][markerKey][genotype][groupKey]['genotyped'] += count
+
+class Binner(object):
+    """
+    Base class of the dimensions our counts can be stratified by. Each binner 
+    takes the value of a single column of a row of input and returns the label 
+    of the bin it falls into, or None if it falls into none of them. Values are
+    binned on their own label by default.
+
+    The column is either the index of the column in each row or the name of a 
+    template column that is appended to the end of each row (see Stratification)
+    """
+    def __init__(self, name, column, labels):
+        self.name = name
+        self.column = column
+        self.labels = list(labels)
+
+    def bin(self, value):
+        if value in ['', 'NODATA', 'NULL', None]:
+            return None
+
+        return self.binValue(value)
+
+    def binValue(self, value):
+        value = value.strip()
+        return value if value in self.labels else None
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.__dict__ == other.__dict__
+
+    def __ne__(self, other):
+        return not self == other
+
+class RangeBinner(Binner):
+    """
+    Bins a numeric column (i.e. age or parasitemia) into a list of 
+    (LOWER, UPPER, LABEL) ranges
+    """
+    def __init__(self, name, column, ranges):
+        Binner.__init__(self, name, column, [r[2] for r in ranges])
+        self.ranges = list(ranges)
+
+    def binValue(self, value):
+        groupKey = None
+
+        for (lower, upper, label) in self.ranges:
+            # We should always assume that our grouping will be lower <= value <= upper 
+            # and our group key will be returned as "lower - upper".
+            # 
+            # The two fringe cases we will have to look out for will be (0, upper) 
+            # and (lower, 200) in these cases we are dealing with edge cases such as   
+            # (0, 1) and (12, 200) which would be represented as age < 1 and
+            # age > 12
             if lower is None:
-                if float(age) < upper:
+                if float(value) < upper:
                     groupKey = label
             
             if upper is None:
-                if float(age) > lower:
+                if float(value) > lower:
                     groupKey = label
 
             if lower is not None and upper is not None:       
-                if lower <= float(age) <= upper:
+                if lower <= float(value) <= upper:
                     groupKey = label
-     
-    if groupKey is not None: 
-        # Once again, hacky but we do not want to increment the sample size for a given
-        # group if our genotype is 'Not genotyped' or 'Genotyping failure'
-        if validateGenotypes(genotype): 
-            dict[metaKey][markerKey]['sample_size'][groupKey] += 1
-                
-        dict[metaKey][markerKey][genotype][groupKey]['genotyped'] += 1
+
+        return groupKey
+
+class ValueBinner(Binner):
+    """
+    Bins a categorical column (i.e. sex) on its value. Values that are not one
+    of our labels fall into no bin.
+    """
+
+class YearBinner(Binner):
+    """
+    Bins a date column (i.e. sample collection date) into ranges of years from
+    a start year up to an end year. Dates are either date objects or strings
+    starting with a four digit year (i.e. 2007-02-01).
+    """
+    def __init__(self, name, column, start, end, step):
+        labels = ["%s-%s" % (y, min(y + step - 1, end)) for y in xrange(start, end + 1, step)]
+        Binner.__init__(self, name, column, labels)
+        self.start = start
+        self.end = end
+        self.step = step
+
+    def binValue(self, value):
+        year = value.year if hasattr(value, 'year') else int(str(value)[0:4])
+        if not self.start <= year <= self.end:
+            return None
+
+        return self.labels[(year - self.start) // self.step]
+
+class Stratification(object):
+    """
+    A set of dimensions (binners) our counts are broken down by along with the 
+    combinations of dimensions, or marginals, to tabulate. A marginal of more 
+    than one dimension crosses them, i.e. the marginal ('age', 'sex') tabulates 
+    every age group of each sex under groups labelled "< 1 / F". When no 
+    marginals are requested the cross-product of every dimension is tabulated.
+    """
+    def __init__(self, binners, marginals=None):
+        self.binners = OrderedDict([(b.name, b) for b in binners])
+        self.marginals = [tuple(m) for m in (marginals or [tuple(self.binners.keys())])]
+
+        # Any binners reading template columns by name read them from the end 
+        # of each row in the order they are listed here
+        self.extraColumns = []
+        self.columnIndexes = OrderedDict()
+        for binner in binners:
+            index = binner.column
+            if not isinstance(index, int):
+                if binner.column not in self.extraColumns:
+                    self.extraColumns.append(binner.column)
+                index = EXTRA_COLUMN_START + self.extraColumns.index(binner.column)
+            self.columnIndexes[binner.name] = index
+
+        self.labels = []
+        for marginal in self.marginals:
+            for labels in product(*[self.binners[n].labels for n in marginal]):
+                self.labels.append(STRATUM_SEPARATOR.join(labels))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def getLabels(self):
+        """
+        Returns the label of every group tabulated, in the order they are 
+        tabulated
+        """
+        return self.labels
+
+    def getExtraColumns(self):
+        """
+        Returns the names of the template columns that must be appended to each
+        row of input
+        """
+        return self.extraColumns
+
+    def getRowGroups(self, row):
+        """
+        Returns the labels of the groups a row of input falls into, one for
+        each marginal the row has a value for in every dimension
+        """
+        bins = {}
+        for (name, binner) in self.binners.iteritems():
+            index = self.columnIndexes[name]
+            bins[name] = binner.bin(row[index] if index < len(row) else None)
+        rowGroups = []
+
+        for marginal in self.marginals:
+            labels = [bins[n] for n in marginal]
+            if None not in labels:
+                rowGroups.append(STRATUM_SEPARATOR.join(labels))
+
+        return rowGroups
+
+    def __eq__(self, other):
+        return (isinstance(other, Stratification) and self.binners == other.binners 
+                and self.marginals == other.marginals)
+
+    def __ne__(self, other):
+        return not self == other
+
+def createStratification(groups):
+    """
+    Returns the Stratification used to break our counts down into the passed
+    in groups, which is either a Stratification or a list of (LOWER, UPPER, 
+    LABEL) age groups. Returns None if there are no groups.
+    """
+    if not groups:
+        return None
+    if isinstance(groups, Stratification):
+        return groups
+
+    return Stratification([RangeBinner('age', AGE_COLUMN, groups)])
+
+def mergeCountStates(target, source):
+    """
+    Adds the genotyped counts and sample sizes tabulated in one state variable 
+    into another, i.e. to combine the statistics tabulated from several data 
+    sources. Any prevalence statistics in the source are ignored so prevalence 
+    must be calculated once all states have been merged.
+
+    Returns the target state variable
+    """
+    for (metaKey, markers) in source.iteritems():
+        for (markerKey, genotypes) in markers.iteritems():
+            targetGenotypes = target.setdefault(metaKey, OrderedDict()).setdefault(markerKey, OrderedDict())
+
+            for (genotype, groups) in genotypes.iteritems():
+                targetGroups = targetGenotypes.setdefault(genotype, OrderedDict())
+
+                for (group, count) in groups.iteritems():
+                    if genotype == 'sample_size':
+                        targetGroups[group] = targetGroups.get(group, 0) + count
+                    else:
+                        targetGroups.setdefault(group, OrderedDict()).setdefault('genotyped', 0)
+                        targetGroups[group]['genotyped'] += count['genotyped']
+
+    return target
 
 def calculatePrevalenceStatistic(data):
     """
@@ -206,16 +438,43 @@ def calculatePrevalenceStatistic(data):
         # 'No data' we want to skip prevalence calculations
         if not validateGenotypes(list(dataElemList[2])): continue
         
-        sampleSize = dataElemList[4]
-        markerGenotyped = dataElemList[5]
+        markerPrevalence = calculatePrevalence(dataElemList[5], dataElemList[4])
+        data[ dataElemList[0] ][ dataElemList[1] ][ dataElemList[2] ][ dataElemList[3] ]['prevalence'] = markerPrevalence 
 
-        # If our genotyped count is 0 we want to set prevalence to 0 
-        # to avoid division by zero
-        markerPrevalence = 0
-        if float(markerGenotyped) > 0:
-            markerPrevalence = float(markerGenotyped) / sampleSize
+def calculatePrevalence(genotyped, sampleSize):
+    """
+    Returns the prevalence of a genotype given the number of times it was 
+    genotyped and the sample size of its marker
+    """
+    # If our genotyped count is 0 we want to set prevalence to 0 
+    # to avoid division by zero
+    prevalence = 0
+    if float(genotyped) > 0:
+        prevalence = float(genotyped) / sampleSize
 
-        data[ dataElemList[0] ][ dataElemList[1] ][ dataElemList[2] ][ dataElemList[3] ]['prevalence'] = markerPrevalence 
+    return prevalence
+
+def generatePreviewSnapshot(data):
+    """
+    Builds a snapshot of the sample size and prevalence statistics currently
+    held in a state variable without modifying it, allowing partial results
+    to be published while rows are still being tabulated. The snapshot is a 
+    list of lists in the following format:
+
+    [ [METADATA_KEY, (LOCUS_NAME, LOCUS_POS), GENOTYPE, GROUP, SAMPLE_SIZE, GENOTYPED, PREVALENCE], ... ]
+
+    PREVALENCE is None for 'Not genotyped' and 'Genotyping failure' genotypes.
+    """
+    snapshot = []
+
+    for dataElemList in generateCountList(data):
+        prevalence = None
+        if validateGenotypes(list(dataElemList[2])):
+            prevalence = calculatePrevalence(dataElemList[5], dataElemList[4])
+
+        snapshot.append(dataElemList + [prevalence])
+
+    return snapshot
 
 def generateCountList(data):    
     """
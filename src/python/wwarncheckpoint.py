@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+##
+# This module allows long running calculations to be checkpointed and resumed.
+#
+# Data is pulled down in a list of named stages (the single marker query and
+# one stage per combination marker procedure). While rows are streamed out of
+# these stages the statistics state tabulated so far, the stages already
+# completed and the number of rows read from the current stage are
+# periodically written to disk. A resumed run reloads the state, skips the
+# completed stages and the rows of the current stage that were already
+# tabulated and carries on from there.
+#
+# Rows are skipped by count rather than by key, so a checkpoint can only be
+# resumed if every stage returns the same rows in the same order as the run
+# that wrote it. Our database stages guarantee this by ordering their rows on 
+# id_genotype (see WWARN_db_calculations.py). Genotypes loaded into or deleted
+# from the database between the two runs would shift the rows that are skipped,
+# so a calculation must be started over rather than resumed after a load.
+#
+
+import cPickle
+import os
+import zlib
+
+from wwarnexceptions import CheckpointException
+
+# Bumped whenever the layout of a checkpoint changes
+CHECKPOINT_VERSION = 1
+
+class Checkpoint(object):
+    """
+    Writes checkpoints of a calculation to a single file on disk. Checkpoints
+    are pickled and compressed and written to a temporary file first so a
+    crash while checkpointing never leaves a partially written checkpoint
+    behind.
+
+    The signature identifies the inputs of a calculation (query parameters,
+    groups, etc.) so that a checkpoint is never used to resume a different
+    calculation.
+    """
+    def __init__(self, checkpointFile, signature, interval=None):
+        self.checkpointFile = checkpointFile
+        self.signature = signature
+        self.interval = interval
+
+    def write(self, state, completed, stage, offset):
+        """
+        Writes the state of our calculation along with our position in the
+        stream of data to disk
+        """
+        checkpoint = { 'version': CHECKPOINT_VERSION,
+                       'signature': self.signature,
+                       'state': state,
+                       'completed': list(completed),
+                       'stage': stage,
+                       'offset': offset }
+
+        tmpFile = "%s.%s.tmp" % (self.checkpointFile, os.getpid())
+        checkpointFH = open(tmpFile, 'wb')
+        checkpointFH.write(zlib.compress(cPickle.dumps(checkpoint, cPickle.HIGHEST_PROTOCOL), 1))
+        checkpointFH.close()
+        os.rename(tmpFile, self.checkpointFile)
+
+    def read(self):
+        """
+        Reads the last checkpoint written for this calculation, returning None
+        if no checkpoint exists. Raises a CheckpointException if the checkpoint
+        belongs to a different calculation or cannot be read.
+        """
+        if not os.path.exists(self.checkpointFile):
+            return None
+
+        checkpointFH = open(self.checkpointFile, 'rb')
+        try:
+            checkpoint = cPickle.loads(zlib.decompress(checkpointFH.read()))
+        except Exception, e:
+            raise CheckpointException('Could not read checkpoint %s: %s' % (self.checkpointFile, e))
+        finally:
+            checkpointFH.close()
+
+        if checkpoint.get('version') != CHECKPOINT_VERSION:
+            raise CheckpointException('Checkpoint %s was written by an incompatible version' % self.checkpointFile)
+
+        if checkpoint.get('signature') != self.signature:
+            raise CheckpointException('Checkpoint %s was written for a calculation with different parameters'
+                                      % self.checkpointFile)
+
+        return checkpoint
+
+    def remove(self):
+        """
+        Removes our checkpoint once a calculation has completed
+        """
+        if os.path.exists(self.checkpointFile):
+            os.remove(self.checkpointFile)
+
+def iterateStages(stages, state, checkpoint=None, resume=None):
+    """
+    Iterates over the rows of each of the passed in stages in order. Stages are
+    a list of (NAME, ROWS FUNCTION) tuples where calling ROWS FUNCTION returns
+    an iterable of the stage's rows; a stage is only executed once it is
+    reached.
+
+    Rows are yielded to the code tabulating our statistics so once this
+    generator is resumed the previous row has been added to our state, which
+    is when checkpoints are written: every checkpoint.interval rows and after
+    every completed stage.
+
+    If a checkpoint read via Checkpoint.read is passed in as resume, completed
+    stages are skipped entirely and the rows of the interrupted stage that were
+    already tabulated are read but not yielded. This relies on each stage
+    returning the same rows in the same order on every run (see the notes at
+    the top of this module).
+    """
+    completed = []
+    resumeStage = None
+    resumeOffset = 0
+    rowsSinceCheckpoint = 0
+
+    if resume:
+        completed = list(resume.get('completed'))
+        resumeStage = resume.get('stage')
+        resumeOffset = resume.get('offset')
+
+    for (name, rowsFunc) in stages:
+        if name in completed:
+            continue
+
+        skip = resumeOffset if name == resumeStage else 0
+        offset = 0
+
+        for row in rowsFunc():
+            offset += 1
+            if offset <= skip:
+                continue
+
+            yield row
+
+            rowsSinceCheckpoint += 1
+            if checkpoint and checkpoint.interval and rowsSinceCheckpoint >= checkpoint.interval:
+                checkpoint.write(state, completed, name, offset)
+                rowsSinceCheckpoint = 0
+
+        completed.append(name)
+        if checkpoint:
+            checkpoint.write(state, completed, None, 0)
+            rowsSinceCheckpoint = 0
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+
+##
+# This module reads and writes gzip, bzip2, xz and zstd compressed text files
+# transparently, alongside plain text files.
+#
+# Compressed input is detected by the magic bytes at the start of the file
+# rather than by its extension. It is read back through a RowPipeline (see
+# wwarnpipeline.py) so that reading compressed blocks off disk and
+# decompressing them run in background threads while the calling thread
+# parses the lines already decompressed:
+#
+#     read thread -> [queue] -> decompress thread -> [queue] -> parsing
+#
+# Compressed output is chosen by the extension of the output file (.gz, .bz2,
+# .xz or .zst). Lines written to it are handed over in blocks to a background
+# thread that compresses and writes them out while the next block is being
+# formatted.
+#
+# gzip and bzip2 are always available; xz requires the lzma module (Python 3
+# or backports.lzma) and zstd the zstandard module.
+#
+
+import bz2
+import sys
+import threading
+import zlib
+
+from functools import partial
+from Queue import Queue
+from wwarnexceptions import CompressionException
+from wwarnpipeline import RowPipeline
+
+# Magic bytes at the start of each compressed format we can read
+COMPRESSION_MAGIC = [('gzip', '\x1f\x8b'),
+                     ('bz2', 'BZh'),
+                     ('xz', '\xfd7zXZ\x00'),
+                     ('zstd', '\x28\xb5\x2f\xfd')]
+
+# Extension of the files each compressed format is written to
+COMPRESSION_EXTENSIONS = { 'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz', 'zstd': '.zst' }
+
+# Number of bytes read from or handed to a background thread at a time, and
+# the number of such blocks that may be waiting on each queue
+BLOCK_SIZE = 256 * 1024
+QUEUE_SIZE = 8
+
+# Compression level used when writing gzip, bzip2 and zstd files. Our output
+# is highly repetitive so higher levels buy little but take much longer.
+COMPRESSION_LEVEL = 6
+
+def detectCompression(inputFile):
+    """
+    Returns the compressed format of a file ('gzip', 'bz2', 'xz' or 'zstd')
+    going by its first few bytes, or None if the file is not compressed
+    """
+    inputFH = open(inputFile, 'rb')
+    start = inputFH.read(max([len(m) for (c, m) in COMPRESSION_MAGIC]))
+    inputFH.close()
+
+    for (compression, magic) in COMPRESSION_MAGIC:
+        if start.startswith(magic):
+            return compression
+
+    return None
+
+def getOutputCompression(outputFile):
+    """
+    Returns the compressed format an output file is written in going by its
+    extension, or None if the file should be written as plain text
+    """
+    for (compression, extension) in COMPRESSION_EXTENSIONS.iteritems():
+        if outputFile.lower().endswith(extension):
+            return compression
+
+    return None
+
+def openInput(inputFile):
+    """
+    Opens a text file for reading, decompressing it if it is compressed
+    """
+    compression = detectCompression(inputFile)
+    if compression is None:
+        return open(inputFile)
+
+    return DecompressedFile(inputFile, compression)
+
+def openOutput(outputFile):
+    """
+    Opens a text file for writing, compressing it if its extension names a
+    compressed format
+    """
+    compression = getOutputCompression(outputFile)
+    if compression is None:
+        return open(outputFile, 'w')
+
+    return CompressedFile(outputFile, compression)
+
+def importCodecModule(compression):
+    """
+    Imports the module providing xz or zstd (de)compression, raising a
+    CompressionException if it is not installed
+    """
+    try:
+        if compression == 'xz':
+            try:
+                import lzma
+            except ImportError:
+                from backports import lzma
+            return lzma
+        else:
+            import zstandard
+            return zstandard
+    except ImportError:
+        raise CompressionException("Reading and writing %s files requires the %s module" %
+                                   (compression, 'lzma' if compression == 'xz' else 'zstandard'))
+
+def createDecompressor(compression):
+    """
+    Returns an object decompressing a single stream of the given format
+    """
+    if compression == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif compression == 'bz2':
+        return bz2.BZ2Decompressor()
+    elif compression == 'xz':
+        return importCodecModule(compression).LZMADecompressor()
+    elif compression == 'zstd':
+        return importCodecModule(compression).ZstdDecompressor().decompressobj()
+
+    raise CompressionException("Unknown compressed format %s" % compression)
+
+def createCompressor(compression):
+    """
+    Returns an object compressing a single stream in the given format
+    """
+    if compression == 'gzip':
+        return zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif compression == 'bz2':
+        return bz2.BZ2Compressor(COMPRESSION_LEVEL)
+    elif compression == 'xz':
+        return importCodecModule(compression).LZMACompressor()
+    elif compression == 'zstd':
+        return importCodecModule(compression).ZstdCompressor(level=COMPRESSION_LEVEL).compressobj()
+
+    raise CompressionException("Unknown compressed format %s" % compression)
+
+def iterateFileBlocks(inputFile):
+    """
+    Yields the contents of a file in blocks of BLOCK_SIZE bytes
+    """
+    inputFH = open(inputFile, 'rb')
+    try:
+        while True:
+            block = inputFH.read(BLOCK_SIZE)
+            if not block:
+                return
+            yield block
+    finally:
+        inputFH.close()
+
+class StreamDecompressor(object):
+    """
+    Decompresses consecutive blocks of a compressed file. A file may hold
+    several compressed streams one after the other (i.e. files joined with
+    cat), each of which is decompressed in turn.
+    """
+    def __init__(self, compression):
+        self.compression = compression
+        self.decompressor = createDecompressor(compression)
+
+    def decompress(self, data):
+        decompressed = []
+
+        while data:
+            try:
+                decompressed.append(self.decompressor.decompress(data))
+            except EOFError:
+                # The previous stream ended exactly at the end of the last block
+                self.decompressor = createDecompressor(self.compression)
+                continue
+
+            data = self.decompressor.unused_data
+            if data or getattr(self.decompressor, 'eof', False):
+                self.decompressor = createDecompressor(self.compression)
+
+        return "".join(decompressed)
+
+class DecompressedFile(object):
+    """
+    A read-only file of the decompressed contents of a compressed file.
+    tell() and seek() work in decompressed bytes; seeking backwards restarts
+    decompression from the start of the file.
+    """
+    def __init__(self, inputFile, compression):
+        self.inputFile = inputFile
+        self.compression = compression
+        self.pipeline = None
+        self._start()
+
+    def _start(self):
+        if self.pipeline is not None:
+            self.pipeline.close()
+
+        self.pipeline = RowPipeline([('blocks', partial(iterateFileBlocks, self.inputFile))],
+                                    StreamDecompressor(self.compression).decompress, QUEUE_SIZE, 1)
+        ((name, blocksFunc),) = self.pipeline.start()
+
+        self._blocks = blocksFunc()
+        self._buffer = ''
+        self._offset = 0
+        self.position = 0
+
+    def _fill(self):
+        """
+        Appends the next decompressed block to our buffer, returning False
+        once the whole file has been read
+        """
+        for block in self._blocks:
+            if block:
+                self._buffer = self._buffer[self._offset:] + block
+                self._offset = 0
+                return True
+
+        return False
+
+    def readline(self):
+        while True:
+            end = self._buffer.find('\n', self._offset)
+            if end >= 0 or not self._fill():
+                break
+
+        end = end + 1 if end >= 0 else len(self._buffer)
+        line = self._buffer[self._offset:end]
+        self._offset = end
+        self.position += len(line)
+
+        return line
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) - self._offset < size:
+            if not self._fill():
+                break
+
+        end = len(self._buffer) if size < 0 else min(self._offset + size, len(self._buffer))
+        data = self._buffer[self._offset:end]
+        self._offset = end
+        self.position += len(data)
+
+        return data
+
+    def __iter__(self):
+        # Every complete line in our buffer is split off in one go rather than
+        # searching for the end of each line in turn
+        while True:
+            end = self._buffer.rfind('\n', self._offset)
+            if end < 0:
+                if self._fill():
+                    continue
+
+                line = self.readline()
+                if line:
+                    yield line
+                return
+
+            lines = self._buffer[self._offset:end].split('\n')
+            for line in lines:
+                line += '\n'
+                self._offset += len(line)
+                self.position += len(line)
+                yield line
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if whence != 0:
+            raise IOError("Compressed files can only be seeked from the start of the file")
+
+        if offset < self.position:
+            self._start()
+
+        while self.position < offset and self.read(min(offset - self.position, BLOCK_SIZE)):
+            pass
+
+    def close(self):
+        self.pipeline.close()
+        self.pipeline.join()
+
+class CompressedFile(object):
+    """
+    A write-only file compressed by a background thread as it is written.
+    tell() returns the number of uncompressed bytes written.
+    """
+    def __init__(self, outputFile, compression):
+        self.outputFile = outputFile
+        self.compressor = createCompressor(compression)
+        self.position = 0
+        self.error = None
+        self._pending = []
+        self._pendingSize = 0
+
+        self.outputFH = open(outputFile, 'wb')
+        self.queue = Queue(QUEUE_SIZE)
+        self.thread = threading.Thread(target=self._compress, name='wwarn-compress')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, data):
+        self.position += len(data)
+        self._pending.append(data)
+        self._pendingSize += len(data)
+
+        if self._pendingSize >= BLOCK_SIZE:
+            self._flushPending()
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        if self.thread is None:
+            return
+
+        self._flushPending()
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self.outputFH.close()
+
+        self._raiseError()
+
+    def _flushPending(self):
+        self._raiseError()
+
+        if self._pending:
+            self.queue.put("".join(self._pending))
+            self._pending = []
+            self._pendingSize = 0
+
+    def _raiseError(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error[0], error[1], error[2]
+
+    def _compress(self):
+        failed = False
+
+        while True:
+            block = self.queue.get()
+
+            # Once compression has failed the remaining blocks are drained
+            # from the queue so the writing thread is never left blocked
+            if failed:
+                if block is None:
+                    return
+                continue
+
+            try:
+                if block is None:
+                    self.outputFH.write(self.compressor.flush())
+                    return
+
+                self.outputFH.write(self.compressor.compress(block))
+            except Exception:
+                self.error = sys.exc_info()
+                failed = True
+                if block is None:
+                    return
@@ -0,0 +1,494 @@
+#!/usr/bin/env python
+
+##
+# This module compiles the WWARN configuration files (the INI file, the age
+# groups and copy number groups files, the mutant status table and the marker
+# list) into a single bundle. The calculation scripts load this bundle instead of parsing
+# each file on every run and only recompile it when one of the source files
+# has changed.
+#
+# A bundle only holds plain data (strings, numbers, tuples, lists and 
+# dictionaries) written out as Python literals and read back with 
+# ast.literal_eval, so reading a bundle never runs code from it. The 
+# stratification, marker catalog and template validator are rebuilt from this
+# data each time a bundle is loaded. Bundles owned by another user are ignored
+# and recompiled.
+#
+
+import argparse
+import ast
+import ConfigParser
+import hashlib
+import os
+
+from wwarncalculations import (Stratification, RangeBinner, ValueBinner, YearBinner, createStratification,
+                               AGE_COLUMN)
+from wwarnexceptions import ConfigBundleException
+from wwarnmarkers import readMarkerList, buildMarkerCatalog
+from wwarnutils import parseAgeGroups, parseCopyNumberGroups, parseMutantStatusTable
+from wwarnvalidate import TemplateValidator
+
+# Bumped whenever the layout of the bundle changes so that bundles written
+# by an older version of this module are recompiled rather than misread
+BUNDLE_VERSION = 8
+
+# Number of hex digits of the marker list hash in a default bundle path
+BUNDLE_KEY_LENGTH = 8
+
+# Types of dimension that can be defined in a [DIMENSION:<NAME>] section of 
+# the INI file
+DIMENSION_TYPES = ['range', 'value', 'year']
+
+# Options that must be present in the INI file for the calculations to run.
+# Scripts that never bin ages or copy numbers (i.e. wwarningest.py) pass their
+# own list of required options to loadConfigBundle instead.
+REQUIRED_OPTIONS = [('GENERAL', 'age_groups'), ('GENERAL', 'copy_number_groups')]
+
+# Options that must be present in the INI file to connect to our database
+DB_OPTIONS = [('DB', 'hostname'), ('DB', 'database_name'), ('DB', 'username'), ('DB', 'password')]
+
+def buildArgParser():
+    """
+    Creates an argparser object using the command-line arguments passed into this script
+    """
+    parser = argparse.ArgumentParser(description='Compiles the WWARN configuration files into a '
+                                        + 'binary bundle used by the calculation scripts')
+    parser.add_argument('-c', '--config_file', required=True, help='The WWARN configuration file')
+    parser.add_argument('-m', '--marker_list', required=True, help='The marker list to compile into the bundle')
+    parser.add_argument('-o', '--output_file', required=False, help='Desired bundle file. Defaults to '
+                            + 'the configuration file path with a .bundle extension keyed on the marker list')
+    args = parser.parse_args()
+
+    return args
+
+def getDefaultBundlePath(configFile, markerList=None):
+    """
+    Returns the path the bundle for the given configuration file and marker
+    list is written to when no path is explicitly provided. Bundles compiled
+    with a marker list are keyed on a short hash of its absolute path so that
+    runs with different marker lists each keep their own bundle rather than
+    recompiling a shared one.
+    """
+    if not markerList:
+        return configFile + '.bundle'
+
+    markerKey = hashlib.sha1(os.path.abspath(markerList)).hexdigest()[:BUNDLE_KEY_LENGTH]
+    return '%s.%s.bundle' % (configFile, markerKey)
+
+def loadConfigBundle(configFile, markerList, bundleFile=None, requiredOptions=REQUIRED_OPTIONS):
+    """
+    Returns the compiled configuration bundle for the given configuration file
+    and marker list. If a bundle exists on disk and none of its source files
+    have changed it is loaded as-is, otherwise the bundle is recompiled and
+    written back out for the next run.
+
+    The returned dictionary is of the following format:
+
+        { 'config': <RawConfigParser>,
+          'age_groups': [ (<LOWER>, <UPPER>, <LABEL>), ... ],
+          'copy_number_groups': [ (<NAME>, <LOWER>, <UPPER>), ... ],
+          'stratification': <Stratification>,
+          'marker_catalog': <MarkerCatalog>,
+          'mutant_status': { (<LOCUS NAME>, <LOCUS POSITION>, <GENOTYPE>): <MUTANT STATUS> },
+          'template_validator': <TemplateValidator> }
+
+    The stratification breaks our counts down by age group alone unless a 
+    [STRATIFICATION] section is present in the INI file (see parseStratification).
+    The age groups, copy number groups and stratification are None unless the
+    INI file names the groups files, and the mutant status table and template 
+    validator are None unless it names a mutant status table.
+
+    A ConfigBundleException is raised if the INI file is missing any of the
+    passed in (SECTION, OPTION) required options.
+    """
+    if bundleFile is None:
+        bundleFile = getDefaultBundlePath(configFile, markerList)
+
+    bundle = readConfigBundle(bundleFile)
+    sources = list(bundle.get('sources')) if bundle is not None else None
+
+    if bundle is None or not isBundleCurrent(bundle, configFile, markerList):
+        bundle = compileConfigBundle(configFile, markerList)
+    elif bundle.get('sources') == sources:
+        return checkRequiredOptions(unpackConfigBundle(bundle), configFile, requiredOptions)
+
+    # A bundle is written back out when it was recompiled or when one of its
+    # source files was touched without changing, so the new modification 
+    # time and size spare the next run from hashing the file again. A bundle
+    # that cannot be written (i.e. read-only configuration directory) is not 
+    # an error, the configuration files will simply be parsed again on the 
+    # next run.
+    try:
+        writeConfigBundle(bundle, bundleFile)
+    except (IOError, OSError):
+        pass
+
+    return checkRequiredOptions(unpackConfigBundle(bundle), configFile, requiredOptions)
+
+def checkRequiredOptions(unpacked, configFile, requiredOptions):
+    """
+    Raises a ConfigBundleException if the configuration of an unpacked bundle
+    is missing any of the required (SECTION, OPTION) options, otherwise hands
+    the unpacked bundle back
+    """
+    for (section, option) in requiredOptions:
+        if not unpacked['config'].has_option(section, option):
+            raise ConfigBundleException('Configuration file %s is missing option %s in section [%s]'
+                                        % (configFile, option, section))
+
+    return unpacked
+
+def compileConfigBundle(configFile, markerList):
+    """
+    Parses and validates all of the configuration files and packs them into
+    a dictionary of plain data that can be written to disk.
+    """
+    config = createConfigParser()
+    if not config.read(configFile):
+        raise ConfigBundleException('Could not read configuration file %s' % configFile)
+
+    sourceFiles = [configFile]
+
+    ageGroups = None
+    if config.has_option('GENERAL', 'age_groups'):
+        ageGroupsFile = config.get('GENERAL', 'age_groups')
+        ageGroups = parseAgeGroups(ageGroupsFile)
+        validateGroupBounds(ageGroups, [g[2] for g in ageGroups], ageGroupsFile)
+        sourceFiles.append(ageGroupsFile)
+
+    copyNumGroups = None
+    if config.has_option('GENERAL', 'copy_number_groups'):
+        copyNumGroupsFile = config.get('GENERAL', 'copy_number_groups')
+        copyNumGroups = parseCopyNumberGroups(copyNumGroupsFile)
+        validateGroupBounds([g[1:] for g in copyNumGroups], [g[0] for g in copyNumGroups], copyNumGroupsFile)
+        sourceFiles.append(copyNumGroupsFile)
+
+    # The groups of each range dimension are kept in the bundle so that the
+    # stratification can be rebuilt without reading the groups files again
+    dimensionGroups = {}
+    (stratification, groupsFiles) = parseStratification(config, ageGroups, configFile, dimensionGroups)
+
+    sections = [(s, config.items(s)) for s in config.sections()]
+    sourceFiles.extend(groupsFiles)
+    if markerList:
+        sourceFiles.append(markerList)
+
+    mutantStatus = None
+    if config.has_option('GENERAL', 'mutant_status'):
+        mutantStatusFile = config.get('GENERAL', 'mutant_status')
+        codons = dict(config.items('CODON')) if config.has_section('CODON') else None
+        statuses = dict(config.items('MUTANT_STATUS')) if config.has_section('MUTANT_STATUS') else None
+
+        mutantStatus = parseMutantStatusTable(mutantStatusFile, codons, statuses)
+        sourceFiles.append(mutantStatusFile)
+
+    bundle = { 'version': BUNDLE_VERSION,
+               'requested': getRequestedFiles(configFile, markerList),
+               'sources': [getFileSignature(f) for f in sourceFiles],
+               'sections': sections,
+               'age_groups': ageGroups,
+               'copy_number_groups': copyNumGroups,
+               'dimension_groups': dimensionGroups,
+               'marker_list': readMarkerList(markerList) if markerList else None,
+               'mutant_status': mutantStatus }
+
+    return bundle
+
+def parseStratification(config, ageGroups, configFile, dimensionGroups=None):
+    """
+    Builds the Stratification our counts are broken down by from the optional
+    [STRATIFICATION] section of the INI file:
+
+        [STRATIFICATION]
+        dimensions=age,sex,collection_year
+        marginals=age,sex*age,collection_year
+
+    Each dimension other than the built-in age dimension is defined in its own
+    section, reading a column of the WWARN template:
+
+        [DIMENSION:sex]
+        type=value
+        column=SEX
+        labels=M,F
+
+        [DIMENSION:parasitemia]
+        type=range
+        column=PARASITEMIA
+        groups=/path/to/conf/parasitemia_groups.txt
+
+        [DIMENSION:collection_year]
+        type=year
+        column=SAMPLE_COLLECTION_DATE
+        start=2000
+        end=2014
+        step=5
+
+    Range groups files are in the same format as the age groups file. Marginals
+    cross dimensions with '*'; if no marginals are listed the cross-product of
+    every dimension is tabulated.
+
+    The groups of each range dimension are read from the passed in dictionary
+    of { <DIMENSION NAME>: [ (<LOWER>, <UPPER>, <LABEL>), ... ] } when present
+    there, otherwise they are read from the groups file and added to it.
+
+    Returns a tuple of the Stratification and the list of any groups files read.
+    The Stratification is None if there are no age groups to break our counts
+    down by.
+    """
+    if dimensionGroups is None:
+        dimensionGroups = {}
+
+    if not config.has_section('STRATIFICATION'):
+        return (createStratification(ageGroups), [])
+
+    binners = []
+    groupsFiles = []
+
+    for name in splitOption(config, 'STRATIFICATION', 'dimensions'):
+        if name == 'age':
+            if not ageGroups:
+                raise ConfigBundleException('Configuration file %s stratifies by age but names no age groups'
+                                            % configFile)
+            binners.append(RangeBinner('age', AGE_COLUMN, ageGroups))
+            continue
+
+        section = 'DIMENSION:%s' % name
+        if not config.has_section(section):
+            raise ConfigBundleException('Configuration file %s is missing section [%s]' % (configFile, section))
+
+        for option in ['type', 'column']:
+            if not config.has_option(section, option):
+                raise ConfigBundleException('Configuration file %s is missing option %s in section [%s]'
+                                            % (configFile, option, section))
+
+        dimensionType = config.get(section, 'type')
+        column = config.get(section, 'column')
+
+        try:
+            if dimensionType == 'range':
+                if name not in dimensionGroups:
+                    groupsFile = config.get(section, 'groups')
+                    groups = parseAgeGroups(groupsFile)
+                    validateGroupBounds(groups, [g[2] for g in groups], groupsFile)
+
+                    dimensionGroups[name] = groups
+                    groupsFiles.append(groupsFile)
+
+                binners.append(RangeBinner(name, column, dimensionGroups[name]))
+            elif dimensionType == 'value':
+                binners.append(ValueBinner(name, column, splitOption(config, section, 'labels')))
+            elif dimensionType == 'year':
+                binners.append(YearBinner(name, column, config.getint(section, 'start'), 
+                                          config.getint(section, 'end'), config.getint(section, 'step')))
+            else:
+                raise ConfigBundleException('Dimension %s in %s has unknown type %s, expected one of %s'
+                                            % (name, configFile, dimensionType, ", ".join(DIMENSION_TYPES)))
+        except (ConfigParser.Error, ValueError, IOError), e:
+            raise ConfigBundleException('Dimension %s in %s is malformed: %s' % (name, configFile, e))
+
+    if not binners:
+        raise ConfigBundleException('Section [STRATIFICATION] in %s lists no dimensions' % configFile)
+
+    names = [b.name for b in binners]
+    marginals = None
+    if config.has_option('STRATIFICATION', 'marginals'):
+        marginals = [tuple([n.strip() for n in m.split('*')]) for m in splitOption(config, 'STRATIFICATION', 'marginals')]
+
+        for marginal in marginals:
+            for name in marginal:
+                if name not in names:
+                    raise ConfigBundleException('Marginal %s in %s uses unknown dimension %s' 
+                                                % ("*".join(marginal), configFile, name))
+
+    stratification = Stratification(binners, marginals)
+    labels = stratification.getLabels()
+    if len(set(labels)) != len(labels) or 'All' in labels:
+        raise ConfigBundleException('Section [STRATIFICATION] in %s produces duplicate group labels' % configFile)
+
+    return (stratification, groupsFiles)
+
+def splitOption(config, section, option):
+    """
+    Returns the comma-delimited values of an option, or an empty list if the 
+    option is not set
+    """
+    if not config.has_option(section, option):
+        return []
+
+    return [v.strip() for v in config.get(section, option).split(',') if v.strip()]
+
+def createConfigParser():
+    """
+    Returns the parser used to read the WWARN configuration file. Option names
+    are kept case-sensitive as the [CODON] and [MUTANT_STATUS] sections are 
+    keyed on codons and statuses rather than plain option names.
+    """
+    config = ConfigParser.RawConfigParser()
+    config.optionxform = str
+    return config
+
+def validateGroupBounds(groups, labels, groupsFile):
+    """
+    Verifies that each group in a groups file has a lower bound that does
+    not exceed its upper bound and that no label is used twice.
+    """
+    for group in groups:
+        (lower, upper) = group[0:2]
+        if lower is not None and upper is not None and lower > upper:
+            raise ConfigBundleException('Group %r in %s has a lower bound greater than its upper bound'
+                                        % (group, groupsFile))
+
+    if len(set(labels)) != len(labels):
+        raise ConfigBundleException('Groups file %s contains duplicate labels' % groupsFile)
+
+def isBundleCurrent(bundle, configFile, markerList):
+    """
+    Checks whether a bundle read from disk was compiled from the same source
+    files that are being requested now and that none of those files have
+    changed since.
+
+    A source file whose modification time and size are unchanged is assumed
+    to be unchanged; if either differs the file is hashed and compared against
+    the hash stored in the bundle so that a simple touch does not trigger a
+    recompile. The signature of a touched file whose hash still matches is
+    updated in the bundle so that it can be written back out.
+    """
+    if bundle.get('version') != BUNDLE_VERSION:
+        return False
+
+    if bundle.get('requested') != getRequestedFiles(configFile, markerList):
+        return False
+
+    sources = list(bundle.get('sources'))
+    for (i, (path, mtime, size, digest)) in enumerate(sources):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+
+        if stat.st_mtime == mtime and stat.st_size == size:
+            continue
+
+        if hashFile(path) != digest:
+            return False
+
+        sources[i] = (path, stat.st_mtime, stat.st_size, digest)
+
+    bundle['sources'] = sources
+    return True
+
+def unpackConfigBundle(bundle):
+    """
+    Rebuilds the configuration parser, stratification, marker catalog and
+    template validator from the plain data of a bundle, returning the 
+    dictionary handed back to the calculation scripts.
+    """
+    config = createConfigParser()
+    for (section, items) in bundle.get('sections'):
+        config.add_section(section)
+        for (option, value) in items:
+            config.set(section, option, value)
+
+    (configFile, markerList) = bundle.get('requested')
+    ageGroups = bundle.get('age_groups')
+    (stratification, groupsFiles) = parseStratification(config, ageGroups, configFile, 
+                                                        dict(bundle.get('dimension_groups')))
+
+    markerLines = bundle.get('marker_list')
+    mutantStatus = bundle.get('mutant_status')
+
+    # Templates are validated against the valid codons and the loci of the
+    # mutant status table (see wwarnvalidate.py)
+    validator = None
+    if mutantStatus is not None:
+        codons = dict(config.items('CODON')) if config.has_section('CODON') else None
+        validator = TemplateValidator(codons, mutantStatus)
+
+    return { 'config': config,
+             'age_groups': ageGroups,
+             'copy_number_groups': bundle.get('copy_number_groups'),
+             'stratification': stratification,
+             'marker_catalog': buildMarkerCatalog(markerLines) if markerLines is not None else None,
+             'mutant_status': mutantStatus,
+             'template_validator': validator }
+
+def readConfigBundle(bundleFile):
+    """
+    Reads a bundle from disk returning None if it does not exist, cannot be
+    read or is owned by another user.
+    """
+    try:
+        bundleFH = open(bundleFile, 'rb')
+    except IOError:
+        return None
+
+    try:
+        if hasattr(os, 'getuid') and os.fstat(bundleFH.fileno()).st_uid != os.getuid():
+            bundle = None
+        else:
+            bundle = ast.literal_eval(bundleFH.read())
+    except (SyntaxError, ValueError, TypeError, MemoryError, RuntimeError):
+        bundle = None
+    finally:
+        bundleFH.close()
+
+    if not isinstance(bundle, dict):
+        return None
+
+    return bundle
+
+def writeConfigBundle(bundle, bundleFile):
+    """
+    Writes a bundle to disk. The bundle is written to a temporary file first and
+    renamed into place so a concurrent run never reads a partially written
+    bundle.
+    """
+    tmpFile = "%s.%s.tmp" % (bundleFile, os.getpid())
+
+    try:
+        bundleFH = open(tmpFile, 'wb')
+        bundleFH.write(repr(bundle))
+        bundleFH.close()
+        os.rename(tmpFile, bundleFile)
+    finally:
+        if os.path.exists(tmpFile):
+            os.remove(tmpFile)
+
+def getFileSignature(path):
+    """
+    Returns a tuple of (absolute path, modification time, size, SHA1 digest)
+    used to detect changes to a bundle source file
+    """
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime, stat.st_size, hashFile(path))
+
+def hashFile(path):
+    """
+    Returns the SHA1 hex digest of the contents of the file at the given path
+    """
+    sha1 = hashlib.sha1()
+
+    fh = open(path, 'rb')
+    for chunk in iter(lambda: fh.read(65536), ''):
+        sha1.update(chunk)
+    fh.close()
+
+    return sha1.hexdigest()
+
+def getRequestedFiles(configFile, markerList):
+    """
+    Returns the absolute paths of the configuration file and marker list a
+    bundle was requested for
+    """
+    if markerList:
+        markerList = os.path.abspath(markerList)
+
+    return (os.path.abspath(configFile), markerList)
+
+def main(parser):
+    bundleFile = parser.output_file or getDefaultBundlePath(parser.config_file, parser.marker_list)
+    bundle = compileConfigBundle(parser.config_file, parser.marker_list)
+    writeConfigBundle(bundle, bundleFile)
+
+if __name__ == "__main__":
+    main(buildArgParser())
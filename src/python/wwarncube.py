@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+
+##
+# This module holds our calculated statistics in a result cube, a queryable
+# alternative to the nested dictionaries produced by calculateWWARNStatistics
+# and generateGroupedStatistics.
+#
+# Every cell of the cube is identified by a value along each of the following
+# dimensions:
+#
+#     study       - (STUDY_ID, STUDY_LABEL, INVESTIGATOR)
+#     site        - (COUNTRY, SITE)
+#     year_group  - year group of the site (None when not binning by year)
+#     marker      - marker category
+#     genotype    - genotype label
+#     group       - age group (or 'All')
+#
+# and carries the genotyped, sample size and prevalence measures. Dimension
+# values are dictionary encoded so each cell only stores one integer code per
+# dimension, and codes and measures are kept column-wise in arrays. Slicing
+# and filtering work on the codes alone and predicates are evaluated once per
+# distinct dimension value rather than once per cell.
+#
+# A HierarchicalRollUp merges the site-level cells of one or more cubes into
+# study, country and global cubes in a single pass, pooling the counts and
+# sample sizes of every site below each level. Cells of a rolled up cube keep
+# all of our dimensions with ROLLED_UP_VALUE in place of every study or site
+# field merged away.
+#
+
+from array import array
+from collections import OrderedDict
+from wwarncalculations import calculatePrevalence
+from wwarnutils import importOptionalModule
+
+CUBE_DIMENSIONS = ['study', 'site', 'year_group', 'marker', 'genotype', 'group']
+CUBE_MEASURES = ['genotyped', 'sample_size', 'prevalence']
+
+# Array typecodes of our dimension codes and of each of our measures
+CODE_TYPECODE = 'i'
+MEASURE_TYPECODES = { 'genotyped': 'l', 'sample_size': 'l', 'prevalence': 'd' }
+
+# Value of a study or site field that has been merged away by a roll-up
+ROLLED_UP_VALUE = ''
+
+# Levels our site-level statistics are rolled up to, each mapping the study
+# and site of a cell to the study and site of the cell it is merged into
+ROLL_UP_LEVELS = OrderedDict([
+    ('study', lambda study, site: (study, (ROLLED_UP_VALUE, ROLLED_UP_VALUE))),
+    ('country', lambda study, site: ((ROLLED_UP_VALUE, ROLLED_UP_VALUE, ROLLED_UP_VALUE), (site[0], ROLLED_UP_VALUE))),
+    ('global', lambda study, site: ((ROLLED_UP_VALUE, ROLLED_UP_VALUE, ROLLED_UP_VALUE), 
+                                    (ROLLED_UP_VALUE, ROLLED_UP_VALUE))),
+])
+
+class ResultCube(object):
+    """
+    Statistics stored as dictionary encoded dimension codes and measure arrays
+    """
+    def __init__(self, dimensions=None):
+        self.dimensions = list(dimensions or CUBE_DIMENSIONS)
+        self.values = dict([(d, []) for d in self.dimensions])
+        self.codes = dict([(d, array(CODE_TYPECODE)) for d in self.dimensions])
+        self.measures = dict([(m, array(t)) for (m, t) in MEASURE_TYPECODES.iteritems()])
+        self._lookup = dict([(d, {}) for d in self.dimensions])
+
+    def __len__(self):
+        return len(self.measures['genotyped'])
+
+    def encode(self, dimension, value):
+        """
+        Returns the code of a dimension value, adding the value to the
+        dimension if it has not been seen before
+        """
+        lookup = self._lookup[dimension]
+        code = lookup.get(value)
+
+        if code is None:
+            code = len(self.values[dimension])
+            lookup[value] = code
+            self.values[dimension].append(value)
+
+        return code
+
+    def addCell(self, coordinates, genotyped, sampleSize, prevalence):
+        """
+        Adds a cell to the cube. Coordinates are given as a tuple holding a
+        value for each dimension, in dimension order.
+        """
+        for (dimension, value) in zip(self.dimensions, coordinates):
+            self.codes[dimension].append(self.encode(dimension, value))
+
+        self.measures['genotyped'].append(genotyped)
+        self.measures['sample_size'].append(sampleSize)
+        self.measures['prevalence'].append(prevalence)
+
+    def iterateCells(self):
+        """
+        Iterates over every cell of the cube in the order they were added,
+        yielding tuples in the following format:
+
+            (<COORDINATES>, <GENOTYPED>, <SAMPLE SIZE>, <PREVALENCE>)
+        """
+        columns = [(self.values[d], self.codes[d]) for d in self.dimensions]
+
+        for i in xrange(len(self)):
+            coordinates = tuple([values[codes[i]] for (values, codes) in columns])
+            yield (coordinates, self.measures['genotyped'][i], self.measures['sample_size'][i],
+                   self.measures['prevalence'][i])
+
+    def getDimensionValues(self, dimension):
+        """
+        Returns the distinct values of a dimension present in the cube
+        """
+        values = self.values[dimension]
+        return [values[c] for c in sorted(set(self.codes[dimension]))]
+
+    def slice(self, **criteria):
+        """
+        Returns a new cube holding only the cells matching all of the passed in
+        criteria. Each criterion maps a dimension to either a single value or a
+        list (or set) of values, i.e.:
+
+            cube.slice(group=['All'], marker='pfcrt 76')
+        """
+        codeSets = {}
+        for (dimension, wanted) in criteria.iteritems():
+            if not isinstance(wanted, (list, set)):
+                wanted = [wanted]
+
+            lookup = self._lookup[dimension]
+            codeSets[dimension] = set([lookup[v] for v in wanted if v in lookup])
+
+        return self._select(self._matchRows(codeSets))
+
+    def filter(self, dimension, predicate):
+        """
+        Returns a new cube holding only the cells whose value along the given
+        dimension satisfies the predicate
+        """
+        codeSet = set([c for (c, v) in enumerate(self.values[dimension]) if predicate(v)])
+        return self._select(self._matchRows({ dimension: codeSet }))
+
+    def rollUp(self, dimensions):
+        """
+        Returns a new cube aggregated down to the passed in list of dimensions.
+        Genotyped counts are summed over every dimension that is dropped.
+        Sample sizes are shared by all genotypes of a marker so they are only
+        summed once per marker of each study, site and year group, and
+        prevalence is recalculated from the summed counts.
+
+        The 'All' group overlaps every age group so the group dimension can
+        only be dropped from a cube that has been sliced down to a single group.
+        """
+        if 'group' not in dimensions and len(set(self.codes['group'])) > 1:
+            raise ValueError("Cannot roll up over more than one age group")
+
+        keptIndexes = [self.dimensions.index(d) for d in dimensions]
+        sampleIndexes = [i for (i, d) in enumerate(self.dimensions) if d != 'genotype']
+        codeColumns = [self.codes[d] for d in self.dimensions]
+
+        cells = OrderedDict()
+        for i in xrange(len(self)):
+            rowCodes = [c[i] for c in codeColumns]
+            key = tuple([rowCodes[k] for k in keptIndexes])
+            cell = cells.setdefault(key, [0, 0, set()])
+
+            cell[0] += self.measures['genotyped'][i]
+
+            sampleKey = tuple([rowCodes[k] for k in sampleIndexes])
+            if sampleKey not in cell[2]:
+                cell[2].add(sampleKey)
+                cell[1] += self.measures['sample_size'][i]
+
+        cube = ResultCube(dimensions)
+        for (key, (genotyped, sampleSize, seen)) in cells.iteritems():
+            coordinates = tuple([self.values[d][c] for (d, c) in zip(dimensions, key)])
+            cube.addCell(coordinates, genotyped, sampleSize,
+                         calculatePrevalence(genotyped, sampleSize) if sampleSize else 0)
+
+        return cube
+
+    def _matchRows(self, codeSets):
+        """
+        Returns the indexes of all cells whose codes are in the passed in sets
+        of codes for each dimension
+        """
+        numpy = importOptionalModule('numpy') if codeSets else None
+        if numpy is not None:
+            mask = numpy.ones(len(self), dtype=bool)
+            for (dimension, codeSet) in codeSets.iteritems():
+                codes = numpy.frombuffer(self.codes[dimension], dtype=numpy.intc) if len(self) else numpy.array([])
+                mask &= numpy.in1d(codes, list(codeSet))
+            return numpy.flatnonzero(mask).tolist()
+
+        rows = xrange(len(self))
+        for (dimension, codeSet) in codeSets.iteritems():
+            codes = self.codes[dimension]
+            rows = [i for i in rows if codes[i] in codeSet]
+
+        return list(rows)
+
+    def _select(self, rows):
+        """
+        Returns a new cube holding the cells at the passed in indexes. The
+        dimension values of our cube are copied into the new cube so that the
+        codes of its cells can be carried over as they are.
+        """
+        cube = ResultCube(self.dimensions)
+
+        for dimension in self.dimensions:
+            cube.values[dimension] = list(self.values[dimension])
+            cube._lookup[dimension] = dict(self._lookup[dimension])
+            codes = self.codes[dimension]
+            cube.codes[dimension] = array(CODE_TYPECODE, [codes[i] for i in rows])
+
+        for (measure, values) in self.measures.iteritems():
+            cube.measures[measure] = array(MEASURE_TYPECODES[measure], [values[i] for i in rows])
+
+        return cube
+
+class HierarchicalRollUp(object):
+    """
+    Pools the site-level cells of result cubes into each of our roll-up levels
+    (see ROLL_UP_LEVELS). Cubes can be added one at a time, i.e. one metadata
+    key at a time as they are merged back from disk, and only the pooled counts
+    of each level are held on to.
+
+    Genotyped counts are summed over every site merged into a cell. Sample
+    sizes are shared by all genotypes of a marker so the sample size of each
+    site is added once to each marker and group of the level it is merged
+    into, and prevalence is recalculated from the pooled counts.
+    """
+    def __init__(self, levels=ROLL_UP_LEVELS):
+        self.levels = levels
+        self.genotyped = OrderedDict([(l, OrderedDict()) for l in levels])
+        self.sampleSizes = dict([(l, {}) for l in levels])
+
+    def addCube(self, cube):
+        """
+        Merges every cell of a site-level cube into each of our levels. All
+        cells of a site are expected to be added in the same cube.
+        """
+        seenSamples = set()
+        studyValues = cube.values['study']
+        siteValues = cube.values['site']
+        columns = [(cube.values[d], cube.codes[d]) for d in ['year_group', 'marker', 'genotype', 'group']]
+
+        # Each level maps a study and site once rather than once per cell
+        levelMaps = [(level, self.genotyped[level], self.sampleSizes[level], mapFunc, {})
+                     for (level, mapFunc) in self.levels.iteritems()]
+
+        for i in xrange(len(cube)):
+            study = studyValues[cube.codes['study'][i]]
+            site = siteValues[cube.codes['site'][i]]
+            (yearGroup, marker, genotype, group) = [values[codes[i]] for (values, codes) in columns]
+            genotyped = cube.measures['genotyped'][i]
+
+            for (level, genotypedDict, sampleSizeDict, mapFunc, mapped) in levelMaps:
+                levelKey = mapped.get((study, site))
+                if levelKey is None:
+                    levelKey = mapped.setdefault((study, site), mapFunc(study, site))
+
+                cellKey = levelKey + (yearGroup, marker, genotype, group)
+                genotypedDict[cellKey] = genotypedDict.get(cellKey, 0) + genotyped
+
+                sampleKey = levelKey + (yearGroup, marker, group)
+                siteSample = (level, study, site, yearGroup, marker, group)
+                if siteSample not in seenSamples:
+                    seenSamples.add(siteSample)
+                    sampleSizeDict[sampleKey] = sampleSizeDict.get(sampleKey, 0) + cube.measures['sample_size'][i]
+
+    def getCubes(self):
+        """
+        Returns an ordered dictionary holding the result cube of each level
+        """
+        cubes = OrderedDict()
+
+        for (level, genotypedDict) in self.genotyped.iteritems():
+            sampleSizeDict = self.sampleSizes[level]
+            cube = ResultCube()
+
+            for (cellKey, genotyped) in genotypedDict.iteritems():
+                (study, site, yearGroup, marker, genotype, group) = cellKey
+                sampleSize = sampleSizeDict.get((study, site, yearGroup, marker, group), 0)
+                cube.addCell(cellKey, genotyped, sampleSize,
+                             calculatePrevalence(genotyped, sampleSize) if sampleSize else 0)
+
+            cubes[level] = cube
+
+        return cubes
+
+def buildResultCube(groupedStats, groups, year_step=None):
+    """
+    Builds a result cube from the statistics grouped by marker category and
+    genotype label (see generateGroupedStatistics in WWARN_db_calculations.py)
+    for each of the passed in age groups.
+
+    When binning by year the site of each metadata key carries its year group
+    in the format <SITE>_<YEAR GROUP>.
+    """
+    cube = ResultCube()
+
+    for (metadata, categoryIter) in groupedStats.iteritems():
+        (studyId, studyLabel, country, site, investigator) = metadata
+
+        yearGroup = None
+        if year_step:
+            (site, yearGroup) = site.split('_', 2)
+
+        for (category, labelIter) in categoryIter.iteritems():
+            sampleSizeDict = labelIter.get('sample_size')
+
+            for (label, groupIter) in labelIter.iteritems():
+                if label == 'sample_size': continue
+
+                for group in groups:
+                    cube.addCell(((studyId, studyLabel, investigator), (country, site), yearGroup, category, label, group),
+                                 groupIter[group]['genotyped'], sampleSizeDict.get(group) or 0,
+                                 groupIter[group]['prevalence'])
+
+    return cube
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+##
+# This module reads and writes result cubes (see wwarncube.py) in a binary
+# format that is loaded by memory mapping the file rather than parsing it.
+#
+# The file is laid out as follows:
+#
+#     MAGIC (8 bytes) | VERSION (uint32) | HEADER LENGTH (uint32)
+#     HEADER (JSON, padded to a multiple of 8 bytes)
+#     COLUMN 1 | COLUMN 2 | ... | COLUMN N
+#
+# The header holds the number of cells, the dimension tables (the values each
+# dimension code stands for) and the name, type and byte offset (relative to
+# the end of the header) of every column. Each column is a little-endian array
+# of one dimension's codes or of one measure's raw values and starts on an 8
+# byte boundary so it can be used in place straight from the mapped file. When numpy is installed
+# columns are loaded as numpy arrays over the mapped file, otherwise values
+# are unpacked from the mapped file as they are accessed.
+#
+
+import argparse
+import json
+import mmap
+import os
+import struct
+
+from wwarncube import ResultCube
+from wwarnexceptions import ResultFileException
+from wwarnutils import importOptionalModule
+
+RESULT_FILE_MAGIC = 'WWARNRC\0'
+
+# Bumped whenever the layout of our result files changes
+RESULT_FILE_VERSION = 1
+
+PREAMBLE = struct.Struct('<8sII')
+
+# struct formats of our dimension code and measure columns
+CODE_FORMAT = 'i'
+MEASURE_FORMATS = { 'genotyped': 'q', 'sample_size': 'q', 'prevalence': 'd' }
+
+# Number of values packed at a time when writing out a column
+WRITE_BATCH_SIZE = 65536
+
+class MappedColumn(object):
+    """
+    A read-only column of values unpacked from a memory mapped result file
+    as they are accessed
+    """
+    def __init__(self, buffer, offset, format, length):
+        self.buffer = buffer
+        self.offset = offset
+        self.length = length
+        self._struct = struct.Struct('<' + format)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError("column index out of range")
+
+        return self._struct.unpack_from(self.buffer, self.offset + i * self._struct.size)[0]
+
+    def __iter__(self):
+        for i in xrange(self.length):
+            yield self._struct.unpack_from(self.buffer, self.offset + i * self._struct.size)[0]
+
+def getDefaultResultPath(outputDir, outputPrefix):
+    """
+    Returns the path of the binary result file written for a calculation
+    """
+    return os.path.join(outputDir, outputPrefix + '.cube')
+
+def writeResultCube(cube, resultFile):
+    """
+    Writes a result cube out to a binary result file. The file is written to a
+    temporary file first and moved into place once complete.
+    """
+    columns = [('code', d, CODE_FORMAT, cube.codes[d]) for d in cube.dimensions]
+    columns.extend([('measure', m, MEASURE_FORMATS[m], cube.measures[m]) for m in sorted(MEASURE_FORMATS)])
+
+    # Column offsets are stored relative to the end of the header
+    layout = []
+    position = 0
+    for (kind, name, format, values) in columns:
+        layout.append({ 'kind': kind, 'name': name, 'format': format, 'offset': position })
+        position += padLength(len(values) * struct.calcsize('<' + format))
+
+    header = { 'cells': len(cube),
+               'dimensions': cube.dimensions,
+               'values': cube.values,
+               'columns': layout }
+
+    headerStr = json.dumps(header, separators=(',', ':'))
+    headerStr += ' ' * (padLength(PREAMBLE.size + len(headerStr)) - PREAMBLE.size - len(headerStr))
+
+    tmpFile = "%s.%s.tmp" % (resultFile, os.getpid())
+    resultFH = open(tmpFile, 'wb')
+    resultFH.write(PREAMBLE.pack(RESULT_FILE_MAGIC, RESULT_FILE_VERSION, len(headerStr)))
+    resultFH.write(headerStr)
+
+    for (kind, name, format, values) in columns:
+        size = 0
+        for start in xrange(0, len(values), WRITE_BATCH_SIZE):
+            batch = values[start:start + WRITE_BATCH_SIZE]
+            packed = struct.pack('<%d%s' % (len(batch), format), *batch)
+            resultFH.write(packed)
+            size += len(packed)
+
+        resultFH.write('\0' * (padLength(size) - size))
+
+    resultFH.close()
+    os.rename(tmpFile, resultFile)
+
+def loadResultCube(resultFile):
+    """
+    Loads a result cube from a binary result file by memory mapping it. The
+    returned cube is read-only, although slices and roll-ups of it are
+    regular in-memory cubes.
+    """
+    resultFH = open(resultFile, 'rb')
+    try:
+        buffer = mmap.mmap(resultFH.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        resultFH.close()
+
+    if len(buffer) < PREAMBLE.size:
+        raise ResultFileException("%s is not a WWARN result file" % resultFile)
+
+    (magic, version, headerLength) = PREAMBLE.unpack_from(buffer, 0)
+    if magic != RESULT_FILE_MAGIC:
+        raise ResultFileException("%s is not a WWARN result file" % resultFile)
+    if version != RESULT_FILE_VERSION:
+        raise ResultFileException("%s was written in result file version %s, expected version %s" %
+                                  (resultFile, version, RESULT_FILE_VERSION))
+
+    header = json.loads(buffer[PREAMBLE.size:PREAMBLE.size + headerLength])
+    cells = header['cells']
+    dataStart = PREAMBLE.size + headerLength
+
+    cube = ResultCube([decodeValue(d) for d in header['dimensions']])
+    for dimension in cube.dimensions:
+        for value in header['values'][dimension]:
+            cube.encode(dimension, decodeValue(value))
+
+    numpy = importOptionalModule('numpy')
+    for entry in header['columns']:
+        if numpy is not None:
+            column = numpy.frombuffer(buffer, dtype='<' + entry['format'], count=cells, 
+                                      offset=dataStart + entry['offset'])
+        else:
+            column = MappedColumn(buffer, dataStart + entry['offset'], entry['format'], cells)
+
+        if entry['kind'] == 'code':
+            cube.codes[decodeValue(entry['name'])] = column
+        else:
+            cube.measures[decodeValue(entry['name'])] = column
+
+    # Our columns refer to the mapped file so it has to live as long as the cube
+    cube.buffer = buffer
+    return cube
+
+def decodeValue(value):
+    """
+    Converts a value read from the JSON header of a result file back into the
+    value it was in our cube: lists back to tuples and unicode back to strings
+    """
+    if isinstance(value, list):
+        return tuple([decodeValue(v) for v in value])
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+
+    return value
+
+def padLength(length):
+    """
+    Rounds a length up to the next multiple of 8 bytes
+    """
+    return (length + 7) & ~7
+
+def buildArgParser():
+    """
+    Creates an argparser object using the command-line arguments passed into this script
+    """
+    parser = argparse.ArgumentParser(description='Prints the exact statistics held in a binary WWARN result file')
+    parser.add_argument('-i', '--input_file', required=True, help='Binary result file written by '
+                            + 'WWARN_db_calculations.py')
+    parser.add_argument('-s', '--study_id', required=False, help='Only print the statistics of this study')
+    parser.add_argument('-t', '--site', required=False, help='Only print the statistics of this site')
+    parser.add_argument('-m', '--marker', required=False, help='Only print the statistics of this marker category')
+    parser.add_argument('-g', '--group', required=False, help='Only print the statistics of this age group')
+    args = parser.parse_args()
+
+    return args
+
+def main(parser):
+    cube = loadResultCube(parser.input_file)
+
+    if parser.study_id:
+        cube = cube.filter('study', lambda s: s[0] == parser.study_id)
+    if parser.site:
+        cube = cube.filter('site', lambda s: s[1] == parser.site)
+    if parser.marker:
+        cube = cube.slice(marker=parser.marker)
+    if parser.group:
+        cube = cube.slice(group=parser.group)
+
+    print "\t".join(['STUDY_ID', 'STUDY_LABEL', 'COUNTRY', 'SITE', 'YEAR GROUP', 'INVESTIGATOR', 'GROUP',
+                     'MARKER', 'GENOTYPE', 'SAMPLE SIZE', 'GENOTYPED', 'PREVALENCE'])
+
+    for (coordinates, genotyped, sampleSize, prevalence) in cube.iterateCells():
+        ((studyId, studyLabel, investigator), (country, site), yearGroup, marker, genotype, group) = coordinates
+        print "\t".join([studyId, studyLabel, country, site, yearGroup or "", investigator, group, marker,
+                         genotype, str(sampleSize), str(genotyped), repr(prevalence)])
+
+if __name__ == "__main__":
+    main(buildArgParser())
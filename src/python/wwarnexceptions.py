@@ -20,3 +20,103 @@ class CopyNumberGroupException(Exception):
         
     def __str__(self):
         return repr(self.error_msg) 
+
+class ConfigBundleException(Exception):
+    """
+    A custom exception class that should be raised when the WWARN
+    configuration files cannot be compiled into a configuration bundle
+    """
+    def __init__(self, value):
+        self.error_msg = value
+
+    def __str__(self):
+        return repr(self.error_msg)
+
+class TemplateFormatException(Exception):
+    """
+    A custom exception class that should be raised when a WWARN template
+    contains a malformed header or marker column
+    """
+    def __init__(self, value):
+        self.error_msg = value
+
+    def __str__(self):
+        return repr(self.error_msg)
+
+class CheckpointException(Exception):
+    """
+    A custom exception class that should be raised when a calculation
+    checkpoint cannot be used to resume the current run
+    """
+    def __init__(self, value):
+        self.error_msg = value
+
+    def __str__(self):
+        return repr(self.error_msg)
+
+class ResultFileException(Exception):
+    """
+    A custom exception class that should be raised when a binary
+    result file is malformed or was written in an unknown version
+    """
+    def __init__(self, value):
+        self.error_msg = value
+
+    def __str__(self):
+        return repr(self.error_msg)
+
+class StratificationException(Exception):
+    """
+    A custom exception class that should be raised when our counts
+    cannot be broken down by the configured stratification
+    """
+    def __init__(self, value):
+        self.error_msg = value
+
+    def __str__(self):
+        return repr(self.error_msg)
+
+class CompressionException(Exception):
+    """
+    A custom exception class that should be raised when a compressed
+    file cannot be read or written
+    """
+    def __init__(self, value):
+        self.error_msg = value
+
+    def __str__(self):
+        return repr(self.error_msg)
+
+class BitmapIndexException(Exception):
+    """
+    A custom exception class that should be raised when a bitmap index
+    is malformed or cannot answer the query made of it
+    """
+    def __init__(self, value):
+        self.error_msg = value
+
+    def __str__(self):
+        return repr(self.error_msg)
+
+class HistogramException(Exception):
+    """
+    A custom exception class that should be raised when a fine-grained
+    histogram cannot be read or re-binned
+    """
+    def __init__(self, value):
+        self.error_msg = value
+
+    def __str__(self):
+        return repr(self.error_msg)
+
+class TableIndexException(Exception):
+    """
+    A custom exception class that should be raised when the sidecar
+    index of an output file is ambiguous or cannot be used to look up
+    its tables
+    """
+    def __init__(self, value):
+        self.error_msg = value
+
+    def __str__(self):
+        return repr(self.error_msg)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+##
+# This module maintains a denormalized copy of the WWARN database holding one
+# row per genotype call along with the study, location, subject and marker it
+# belongs to. The calculation scripts can query this table directly rather
+# than joining the study, location, subject, sample, genotype and marker
+# tables on every run.
+#
+# The table is refreshed incrementally: only genotypes with an id_genotype
+# greater than the largest one already present are copied over, so a refresh
+# after each load only touches the rows that load added.
+#
+# An incremental refresh can only pick up rows appended to the normalized
+# tables. Rows that were updated or deleted, i.e. a corrected study label or a
+# re-keyed genotype, would leave stale rows behind. So each refresh records
+# the row count and a checksum of every source table in FACT_SOURCE_TABLE. The
+# next refresh compares these against the rows that were already there and
+# rebuilds the fact table from scratch if any of them differ.
+#
+
+import argparse
+
+from wwarnconfig import loadConfigBundle, DB_OPTIONS
+from wwarnquery import buildFilterClause
+from wwarnutils import open_db_connection
+
+FACT_TABLE = 'genotype_fact'
+
+FACT_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS `genotype_fact` (
+  `id_genotype` int(10) unsigned NOT NULL,
+  `id_subject` int(10) unsigned NOT NULL,
+  `wwarn_study_id` varchar(45) default NULL,
+  `label` varchar(45) NOT NULL,
+  `investigator` varchar(45) NOT NULL,
+  `country` varchar(45) NOT NULL,
+  `site` varchar(45) default NULL,
+  `patient_id` varchar(45) NOT NULL,
+  `age` decimal(13,10) default NULL,
+  `date_of_inclusion` date default NULL,
+  `locus_name` varchar(45) NOT NULL,
+  `locus_position` int(11) NOT NULL,
+  `marker_type` set('SNP','Copy Number','Fragment') NOT NULL,
+  `marker` varchar(120) NOT NULL,
+  `value` varchar(45) NOT NULL,
+  `mutant_status` set('Wild','Mutant','Mixed','No data') default NULL,
+  `molecule_type` set('Amino Acid','Nucleotide') default NULL,
+  PRIMARY KEY  (`id_genotype`),
+  KEY `fact_study_site` (`wwarn_study_id`, `site`),
+  KEY `fact_site` (`site`),
+  KEY `fact_label_site_doi` (`label`, `site`, `date_of_inclusion`),
+  KEY `fact_locus_subject` (`locus_name`, `locus_position`, `id_subject`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1
+"""
+
+FACT_SOURCE_TABLE = 'genotype_fact_source'
+
+FACT_SOURCE_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS `genotype_fact_source` (
+  `table_name` varchar(45) NOT NULL,
+  `max_id` int(10) unsigned NOT NULL,
+  `row_count` int(10) unsigned NOT NULL,
+  `checksum` bigint(20) unsigned NOT NULL,
+  PRIMARY KEY  (`table_name`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1
+"""
+
+# The (ID COLUMN, [COLUMN, ...]) of each normalized table copied into the fact
+# table. The checksum of a table covers its ID and every listed column.
+SOURCE_TABLES = [('study', 'id_study', ['wwarn_study_id', 'label', 'investigator']),
+                 ('location', 'id_location', ['fk_study_id', 'country', 'site']),
+                 ('subject', 'id_subject', ['fk_location_id', 'patient_id', 'age', 'date_of_inclusion']),
+                 ('sample', 'id_sample', ['fk_subject_id']),
+                 ('genotype', 'id_genotype', ['fk_sample_id', 'fk_marker_id', 'value', 'mutant_status',
+                                              'molecule_type']),
+                 ('marker', 'id_marker', ['locus_name', 'locus_position', 'type'])]
+
+# Columns selected from the fact table in the same order createMysqlIterator
+# expects rows pulled from the normalized tables to be in
+SELECT_COLUMNS = ['wwarn_study_id', 'label', 'investigator', 'country', 'site', 'patient_id',
+                  'age', 'date_of_inclusion', 'marker', 'value']
+
+# Genotype values that are excluded from combination markers
+UNCALLED_GENOTYPES = ['Genotyping Failure', 'Not Genotyped']
+
+def buildArgParser():
+    """
+    Creates an argparser object using the command-line arguments passed into this script
+    """
+    parser = argparse.ArgumentParser(description='Creates or incrementally refreshes the denormalized '
+                                        + 'genotype fact table in the WWARN database')
+    parser.add_argument('-c', '--config_file', required=True, help='A configuration file containing the WWARN '
+                            + 'database credentials')
+    parser.add_argument('-r', '--rebuild', required=False, action='store_true', default=False,
+                        help='Empty the fact table and rebuild it from scratch. The table is also rebuilt '
+                        + 'whenever rows already copied into it were changed or deleted in the normalized tables')
+    args = parser.parse_args()
+
+    return args
+
+def createFactTable(conn):
+    """
+    Creates the fact table, its indexes and the table of source signatures if
+    they do not exist yet
+    """
+    cursor = conn.cursor()
+    cursor.execute(FACT_TABLE_DDL)
+    cursor.execute(FACT_SOURCE_TABLE_DDL)
+    cursor.close()
+
+def refreshFactTable(conn, rebuild=False):
+    """
+    Copies every genotype not yet present in the fact table over from the
+    normalized tables. Returns the number of rows added.
+
+    The fact table is emptied and rebuilt from scratch if requested, or if any
+    source table no longer matches the signature recorded by the last refresh
+    (see findChangedSourceTables).
+    """
+    createFactTable(conn)
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT COALESCE(MAX(id_genotype), 0) FROM `%s`" % FACT_TABLE)
+    lastId = cursor.fetchone()[0]
+
+    (changed, signatures) = findChangedSourceTables(cursor)
+    if changed and lastId and not rebuild:
+        print "WARN: Table(s) %s changed since %s was last refreshed, rebuilding it" % (", ".join(changed),
+                                                                                         FACT_TABLE)
+        rebuild = True
+
+    if rebuild:
+        cursor.execute("DELETE FROM `%s`" % FACT_TABLE)
+        lastId = 0
+
+    cursor.execute("INSERT INTO `%s` " % FACT_TABLE +
+                   "SELECT g.id_genotype, p.id_subject, s.wwarn_study_id, s.label, s.investigator, l.country, " \
+                   "l.site, p.patient_id, p.age, p.date_of_inclusion, m.locus_name, m.locus_position, m.type, " \
+                   "CONCAT(m.locus_name, \"_\", m.locus_position, \"_\", m.type), g.value, g.mutant_status, " \
+                   "g.molecule_type " \
+                   "FROM study s JOIN location l ON s.id_study = l.fk_study_id " \
+                   "JOIN subject p ON p.fk_location_id = l.id_location " \
+                   "JOIN sample sp ON sp.fk_subject_id = p.id_subject " \
+                   "JOIN genotype g ON g.fk_sample_id = sp.id_sample " \
+                   "JOIN marker m ON m.id_marker = g.fk_marker_id " \
+                   "WHERE g.id_genotype > %s", (lastId,))
+    rowCount = cursor.rowcount
+
+    recordSourceSignatures(cursor, signatures)
+
+    cursor.close()
+    conn.commit()
+
+    return rowCount
+
+def recordSourceSignatures(cursor, signatures):
+    """
+    Records the signature of each source table the fact table was refreshed
+    from (see findChangedSourceTables)
+    """
+    for (table, signature) in signatures.iteritems():
+        cursor.execute("REPLACE INTO `%s` (table_name, max_id, row_count, checksum) " % FACT_SOURCE_TABLE +
+                       "VALUES (%s, %s, %s, %s)", (table,) + signature)
+
+def findChangedSourceTables(cursor):
+    """
+    Compares each normalized table against the (MAX ID, ROW COUNT, CHECKSUM)
+    signature recorded by the last refresh. The count and checksum of a table
+    are taken over the rows with IDs up to the recorded MAX ID, so rows 
+    appended since are not counted as changes. A table with no recorded 
+    signature counts as changed.
+
+    Returns a tuple of the list of changed tables and the current signature of
+    every table, in the following format:
+
+        ([ <TABLE>, ... ], { <TABLE>: (<MAX ID>, <ROW COUNT>, <CHECKSUM>) })
+    """
+    cursor.execute("SELECT table_name, max_id, row_count, checksum FROM `%s`" % FACT_SOURCE_TABLE)
+    recorded = dict([(r[0], tuple(r[1:])) for r in cursor.fetchall()])
+
+    changed = []
+    signatures = {}
+
+    for (table, idColumn, columns) in SOURCE_TABLES:
+        (lastId, lastCount, lastChecksum) = recorded.get(table, (0, None, None))
+
+        # A single pass over the table returns both the signature of the rows 
+        # seen by the last refresh and the signature of the whole table
+        rowChecksum = "CRC32(CONCAT_WS('#', %s))" % ", ".join(["`%s`" % c for c in [idColumn] + columns])
+        cursor.execute("SELECT COALESCE(MAX(`%s`), 0), COUNT(*), COALESCE(BIT_XOR(%s), 0), " % (idColumn, rowChecksum) +
+                       "COALESCE(SUM(`%s` <= %%s), 0), " % idColumn +
+                       "COALESCE(BIT_XOR(IF(`%s` <= %%s, %s, 0)), 0) FROM `%s`" % (idColumn, rowChecksum, table),
+                       (lastId, lastId))
+        (maxId, rowCount, checksum, knownCount, knownChecksum) = [int(v) for v in cursor.fetchone()]
+
+        if (knownCount, knownChecksum) != (lastCount, lastChecksum):
+            changed.append(table)
+
+        signatures[table] = (maxId, rowCount, checksum)
+
+    return (changed, signatures)
+
+def buildFactQueryStatement(studyIds, sites):
+    """
+    Builds the query pulling down all single marker data from the fact table.
+    Returns the same [SELECT, FROM, WHERE] components and parameters as
+    buildQueryStatement in WWARN_db_calculations.py so the components can be
+    reused to pull down date bounds.
+    """
+    selectStmt = "SELECT %s " % ", ".join(["f.%s" % c for c in SELECT_COLUMNS])
+    fromStmt = "FROM %s f " % FACT_TABLE
+    (whereStmt, params) = buildFactWhereStmt('f', studyIds, sites)
+
+    return ([selectStmt, fromStmt, whereStmt], params)
+
+def buildFactWhereStmt(alias, studyIds, sites, keyword='WHERE'):
+    """
+    Builds a clause restricting the fact table rows under the given alias to
+    the requested study IDs and sites (see wwarnquery.py). Returns a tuple of
+    the clause and its parameters.
+    """
+    return buildFilterClause([('%s.wwarn_study_id' % alias, studyIds), ('%s.site' % alias, sites)], keyword)
+
+def buildFactComboStatement(loci, studyIds, sites):
+    """
+    Builds the query pulling down combination marker data for the given list of
+    (LOCUS NAME, LOCUS POSITION) tuples from the fact table. The fact table is
+    joined to itself once per locus on the subject, replacing the multi-table
+    joins done by the haplotype stored procedures. Returns a tuple of the query
+    and its parameters.
+    """
+    aliases = ["f%s" % (i + 1) for i in xrange(len(loci))]
+    first = aliases[0]
+
+    selectStmt = "SELECT %s, " % ", ".join(["%s.%s" % (first, c) for c in SELECT_COLUMNS[0:8]])
+    selectStmt += "CONCAT_WS(\" + \", %s), " % ", ".join(["%s.marker" % a for a in aliases])
+    selectStmt += "CONCAT_WS(\" + \", %s) " % ", ".join(["%s.value" % a for a in aliases])
+
+    fromStmt = "FROM %s %s " % (FACT_TABLE, first)
+    for alias in aliases[1:]:
+        fromStmt += "JOIN %s %s ON %s.id_subject = %s.id_subject " % (FACT_TABLE, alias, alias, first)
+
+    conditions = []
+    params = []
+    for (alias, (name, position)) in zip(aliases, loci):
+        conditions.append("%s.locus_name = %%s AND %s.locus_position = %%s" % (alias, alias))
+        conditions.append("%s.value NOT IN (%s)" % (alias, ", ".join(["%s"] * len(UNCALLED_GENOTYPES))))
+        params.extend([name, position] + UNCALLED_GENOTYPES)
+
+    whereStmt = "WHERE " + " AND ".join(conditions)
+    (filterStmt, filterParams) = buildFactWhereStmt(first, studyIds, sites, 'AND')
+    if filterStmt:
+        whereStmt += " " + filterStmt
+        params.extend(filterParams)
+
+    # Ordered so that the rows come back in the same order on every run, which a
+    # resumed run relies on (see wwarncheckpoint.py)
+    orderStmt = " ORDER BY %s" % ", ".join(["%s.id_genotype" % a for a in aliases])
+
+    return (selectStmt + fromStmt + whereStmt + orderStmt, params)
+
+def getFactCombinationMarkerData(statements, loci, studyIds, sites):
+    """
+    Pulls down the data for a combination marker from the fact table in the
+    same row format returned by the haplotype stored procedures, executing its
+    query as a prepared statement (see wwarnquery.py)
+    """
+    (query, params) = buildFactComboStatement(loci, studyIds, sites)
+    cursor = statements.execute(query, params)
+    for row in cursor:
+        yield row
+
+    cursor.close()
+
+def main(parser):
+    bundle = loadConfigBundle(parser.config_file, None, requiredOptions=DB_OPTIONS)
+    config = bundle['config']
+
+    conn = open_db_connection(config.get('DB', 'hostname'), config.get('DB', 'database_name'),
+                              config.get('DB', 'username'), config.get('DB', 'password'))
+
+    rowCount = refreshFactTable(conn, parser.rebuild)
+    print "DEBUG: Added %s genotypes to %s" % (rowCount, FACT_TABLE)
+
+    conn.close()
+
+if __name__ == "__main__":
+    main(buildArgParser())
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+##
+# This module keeps fine-grained histograms of the rows tabulated by our
+# calculations so that our statistics can be re-binned into new age groups,
+# copy number groups or year bins without reading the source data again.
+#
+# Binning a row throws its exact age, copy number and date of inclusion away.
+# A FineHistogram is filled in with each row before it is binned and counts
+# the rows of every distinct combination of:
+#
+#     study ID, study label, investigator, country, site (before it is binned
+#     by year), exact age, marker, genotype (copy numbers rounded to
+#     CN_DECIMALS places), extra columns and month of inclusion
+#
+# along with the earliest and latest date of inclusion of every study label
+# and site, which is all our year bins are worked out from. Patient IDs are
+# not used by our calculations and are not kept.
+#
+# Re-binning a histogram (see rebinHistogram) builds the same state variable
+# our counts are tabulated into (see tabulateMarkerCounts in
+# wwarncalculations.py), adding the count of each histogram entry in a single
+# increment. Statistics re-binned under the groups a histogram was kept with
+# match those calculated from the source data except that:
+#
+#     - copy numbers are binned after being rounded to CN_DECIMALS places
+#     - rows are binned by year on the first day of their month of inclusion,
+#       so the rows of a month a year bin starts part-way through all fall
+#       into the earlier bin
+#
+# Histograms are written to disk pickled and compressed behind a short magic
+# string:
+#
+#     MAGIC (8 bytes) | ZLIB COMPRESSED PICKLE
+#
+
+import cPickle
+import zlib
+
+from collections import OrderedDict
+from wwarncalculations import (incrementGenotypeCount, calculatePrevalenceStatistic, createStratification,
+                               parseMarkerComponents, parseGenotypeValues, AGE_COLUMN, EXTRA_COLUMN_START)
+from wwarncompress import getOutputCompression, COMPRESSION_EXTENSIONS
+from wwarnexceptions import HistogramException, StratificationException
+from wwarnutils import preBinCopyNumberData, validateGenotypes, create_year_bins, parse_site
+
+HISTOGRAM_MAGIC = 'WWARNFH\0'
+
+# Bumped whenever the layout of a histogram file changes
+HISTOGRAM_VERSION = 1
+
+HISTOGRAM_EXTENSION = '.histogram'
+
+# Number of decimal places copy numbers are kept to
+CN_DECIMALS = 2
+
+# Columns of the rows of input to our calculations read by a histogram
+SITE_COLUMN = 4
+MARKER_COLUMN = 7
+GENOTYPE_COLUMN = 8
+
+def isHistogramFile(inputFile):
+    """
+    Returns True if the passed in file is a histogram kept by our calculations
+    rather than source data
+    """
+    return inputFile.lower().endswith(HISTOGRAM_EXTENSION)
+
+def getDefaultHistogramPath(outputFile):
+    """
+    Returns the path the histogram of a template output file is kept at. The
+    histogram is compressed on its own so any compression extension of the
+    output file is dropped.
+    """
+    compression = getOutputCompression(outputFile)
+    if compression is not None:
+        outputFile = outputFile[:-len(COMPRESSION_EXTENSIONS[compression])]
+
+    return outputFile + HISTOGRAM_EXTENSION
+
+def isCopyNumberCall(marker, genotype):
+    """
+    Returns True if the passed in genotype is a copy number that is binned
+    into our copy number groups
+    """
+    return marker.find('CN') != -1 and validateGenotypes([genotype])
+
+class FineHistogram(object):
+    """
+    Counts the rows of input to our calculations by their unbinned values.
+    The values of any extra columns (see Stratification) are kept in the
+    order of extraColumns.
+
+    Year bins are looked up by study label and site (see parse_site) and the
+    label is read from labelColumn of each row, which differs between our
+    database and template rows.
+    """
+    def __init__(self, extraColumns=(), labelColumn=1):
+        self.extraColumns = list(extraColumns)
+        self.labelColumn = labelColumn
+        self.counts = OrderedDict()
+        self.dateBounds = OrderedDict()
+
+    def __len__(self):
+        return len(self.counts)
+
+    def getRowCount(self):
+        """
+        Returns the number of rows counted into this histogram
+        """
+        return sum(self.counts.itervalues())
+
+    def addDate(self, label, site, doi):
+        """
+        Records a date of inclusion at a site, widening the bounds the site's
+        year bins are worked out from
+        """
+        if doi is None:
+            return
+
+        bounds = self.dateBounds.get((label, site))
+        if bounds is None:
+            self.dateBounds[(label, site)] = [doi, doi]
+        elif doi < bounds[0]:
+            bounds[0] = doi
+        elif doi > bounds[1]:
+            bounds[1] = doi
+
+    def addRow(self, row, doi):
+        """
+        Counts a row of input to our calculations whose site and genotype have
+        not been binned yet, along with its date of inclusion
+        """
+        marker = row[MARKER_COLUMN]
+        genotype = row[GENOTYPE_COLUMN]
+        if isCopyNumberCall(marker, genotype):
+            genotype = '%.*f' % (CN_DECIMALS, float(genotype))
+
+        month = (doi.year, doi.month) if doi is not None else None
+        key = (tuple(row[0:SITE_COLUMN + 1]), row[AGE_COLUMN], marker, genotype,
+               tuple(row[EXTRA_COLUMN_START:]), month)
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+        self.addDate(row[self.labelColumn], row[SITE_COLUMN], doi)
+
+    def iterateRows(self, cnBins, year_step=None, extraColumns=(), studyIds=None, sites=None):
+        """
+        Bins the rows counted into this histogram into the passed in copy
+        number groups and year bins, yielding a tuple of each binned row and
+        the number of rows it stands for. Only the passed in extra columns are
+        appended to each row, in the order given. Rows can be restricted to
+        a list of study IDs and (unbinned) sites.
+        """
+        missingColumns = [c for c in extraColumns if c not in self.extraColumns]
+        if missingColumns:
+            raise StratificationException('Column(s) %s were not kept in this histogram' % ", ".join(missingColumns))
+        extraIndexes = [self.extraColumns.index(c) for c in extraColumns]
+
+        year_bins = None
+        if year_step:
+            bounds = [(label, site, lower, upper) for ((label, site), (lower, upper)) in self.dateBounds.iteritems()]
+            year_bins = create_year_bins(year_step, bounds)
+
+        for ((metadata, age, marker, genotype, extraValues, month), count) in self.counts.iteritems():
+            site = metadata[SITE_COLUMN]
+            if (studyIds and metadata[0] not in studyIds) or (sites and site not in sites):
+                continue
+
+            # Rows without a date of inclusion are never binned by year
+            if year_bins and month is not None:
+                label = metadata[self.labelColumn]
+                site = parse_site(site, label, self.getMonthDate(label, site, month), year_bins)
+
+            if isCopyNumberCall(marker, genotype):
+                genotype = preBinCopyNumberData(genotype, cnBins)
+
+            row = metadata[0:SITE_COLUMN] + (site, None, age, marker, genotype) + tuple([extraValues[i] for i in extraIndexes])
+            yield (row, count)
+
+    def getMonthDate(self, label, site, month):
+        """
+        Returns the date rows included in the given (YEAR, MONTH) at a site are
+        binned by year on, the first day of the month or the site's earliest
+        date of inclusion if later
+        """
+        lower = self.dateBounds[(label, site)][0]
+        return max(lower, lower.replace(year=month[0], month=month[1], day=1))
+
+    def write(self, histogramFile):
+        histogram = { 'version': HISTOGRAM_VERSION,
+                      'extra_columns': self.extraColumns,
+                      'label_column': self.labelColumn,
+                      'counts': self.counts,
+                      'date_bounds': self.dateBounds }
+
+        histogramFH = open(histogramFile, 'wb')
+        histogramFH.write(HISTOGRAM_MAGIC)
+        histogramFH.write(zlib.compress(cPickle.dumps(histogram, cPickle.HIGHEST_PROTOCOL), 1))
+        histogramFH.close()
+
+def loadHistogram(histogramFile):
+    """
+    Reads a histogram written out by FineHistogram.write, raising a
+    HistogramException if it cannot be read
+    """
+    histogramFH = open(histogramFile, 'rb')
+    try:
+        if histogramFH.read(len(HISTOGRAM_MAGIC)) != HISTOGRAM_MAGIC:
+            raise HistogramException('%s is not a WWARN histogram' % histogramFile)
+
+        try:
+            histogram = cPickle.loads(zlib.decompress(histogramFH.read()))
+        except Exception, e:
+            raise HistogramException('Could not read histogram %s: %s' % (histogramFile, e))
+    finally:
+        histogramFH.close()
+
+    if histogram.get('version') != HISTOGRAM_VERSION:
+        raise HistogramException('Histogram %s was written by an incompatible version' % histogramFile)
+
+    fineHistogram = FineHistogram(histogram['extra_columns'], histogram['label_column'])
+    fineHistogram.counts = histogram['counts']
+    fineHistogram.dateBounds = histogram['date_bounds']
+
+    return fineHistogram
+
+def rebinHistogram(histogram, groups, cnBins, year_step=None, studyIds=None, sites=None):
+    """
+    Tabulates the rows counted into a histogram under new groups (either a
+    Stratification or a list of age groups), copy number groups and year bins,
+    returning a state variable in the same format, and order, as
+    calculateWWARNStatistics
+    """
+    state = OrderedDict()
+    stratification = createStratification(groups)
+    extraColumns = stratification.getExtraColumns() if stratification else ()
+
+    for (row, count) in histogram.iterateRows(cnBins, year_step, extraColumns, studyIds, sites):
+        metadataKey = (row[0], row[1], row[3], row[4], row[2])
+        rowGroups = stratification.getRowGroups(row) if stratification else ()
+
+        incrementGenotypeCount(state, metadataKey, parseMarkerComponents(row[MARKER_COLUMN]),
+                               parseGenotypeValues(row[GENOTYPE_COLUMN]), stratification, rowGroups, count)
+
+    calculatePrevalenceStatistic(state)
+
+    return state
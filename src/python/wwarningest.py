@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+
+##
+# This script parses a WWARN template and produces load files for each of the
+# WWARN database tables (study, location, subject, sample, marker, genotype),
+# optionally loading them into the database.
+#
+# Rather than querying the database for every entity on every row, the primary
+# keys of all existing rows are read up front with one query per table and
+# held in memory keyed on each table's natural key. New rows are assigned ids
+# locally so loading a template takes a handful of round trips to the database.
+#
+
+import argparse
+import datetime
+
+from collections import OrderedDict
+from decimal import Decimal
+from os.path import join, basename, splitext
+from wwarnconfig import loadConfigBundle, DB_OPTIONS
+from wwarnfacttable import refreshFactTable
+from wwarntemplate import (openTemplate, readTemplateHeader, iterateNumberedTemplateRows, parseMarkerColumn,
+                           MARKER_START_COL)
+from wwarnutils import open_db_connection, canonicalGenotype, validateGenotypes
+from wwarnvalidate import ValidationReport
+
+# Columns of each WWARN table in the order they are written to our load files.
+# The first column is the primary key and the remaining columns make up the
+# natural key used to check whether a row already exists. Tables are listed in
+# the order they must be loaded to satisfy foreign key constraints.
+TABLE_COLUMNS = OrderedDict([
+    ('study', ['id_study', 'wwarn_study_id', 'investigator', 'label']),
+    ('location', ['id_location', 'fk_study_id', 'country', 'site']),
+    ('marker', ['id_marker', 'locus_name', 'locus_position', 'type']),
+    ('subject', ['id_subject', 'fk_study_id', 'fk_location_id', 'patient_id', 'age', 'date_of_inclusion']),
+    ('sample', ['id_sample', 'fk_subject_id', 'collection_date']),
+    ('genotype', ['id_genotype', 'fk_sample_id', 'fk_marker_id', 'value', 'mutant_status', 'molecule_type'])
+])
+
+# Value written to our load files in place of NULL
+NULL = '\\N'
+
+# Number of sample ids placed in each query when pulling down the genotypes
+# already stored for existing samples
+SAMPLE_CHUNK_SIZE = 1000
+
+def buildArgParser():
+    """
+    Creates an argparser object using the command-line arguments passed into this script
+    """
+    parser = argparse.ArgumentParser(description='Produces WWARN database load files from a WWARN template '
+                                        + 'and optionally loads them into the database')
+    parser.add_argument('-i', '--input_file', required=True, help='The tab-delimited text file produced from the '
+                            + 'TEMPLATE worksheet in the WWARN Template, or the template workbook (.xlsx/.xltm) itself')
+    parser.add_argument('-c', '--config_file', required=True, help='A configuration file containing the WWARN '
+                            + 'database credentials, mutant status table and output file names')
+    parser.add_argument('-o', '--output_directory', required=False, help='Directory to write load files to. '
+                            + 'Defaults to the output directory in the configuration file')
+    parser.add_argument('-l', '--load', required=False, action='store_true', default=False,
+                        help='Load the parsed data into the WWARN database')
+    parser.add_argument('--load_method', required=False, default='files', choices=['files', 'insert'],
+                        help='Load data with LOAD DATA LOCAL INFILE from our load files or with batched '
+                            + 'multi-row INSERT statements')
+    parser.add_argument('--batch_size', required=False, type=int, default=1000, help='Number of rows in each '
+                            + 'INSERT statement when loading with --load_method=insert')
+    parser.add_argument('--load_invalid', required=False, action='store_true', default=False, help='Load the '
+                            + 'parsed data even if the template failed validation')
+    args = parser.parse_args()
+
+    return args
+
+class TableIdMap(object):
+    """
+    Maps the natural key of every row in a WWARN table to its primary key and
+    collects the rows that need to be added to the table.
+    """
+    def __init__(self, table, nextId=1):
+        self.table = table
+        self.ids = {}
+        self.newRows = []
+        self.nextId = nextId
+
+    def seed(self, key, id):
+        """
+        Adds a row already present in the database to the map
+        """
+        self.ids[key] = id
+        if id >= self.nextId:
+            self.nextId = id + 1
+
+    def getId(self, key):
+        return self.ids.get(key)
+
+    def getOrCreateId(self, key, values):
+        """
+        Returns the primary key of the row with the given natural key, assigning
+        a new id and queueing the row for loading if it does not exist yet.
+        Returns a tuple of the id and whether or not the row was created.
+        """
+        id = self.ids.get(key)
+        if id is not None:
+            return (id, False)
+
+        id = self.nextId
+        self.nextId += 1
+        self.ids[key] = id
+        self.newRows.append([id] + list(values))
+
+        return (id, True)
+
+def normalizeKeyValue(value):
+    """
+    Converts a value read from either the database or a template into the
+    string form used in our natural keys so that the two compare equal
+    """
+    if value is None or value == NULL:
+        return NULL
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        return value.strftime('%Y-%m-%d')
+    elif isinstance(value, (Decimal, float)):
+        return repr(float(value))
+    else:
+        return str(value)
+
+def normalizeAge(age):
+    """
+    Ages are stored as decimals in the database so any age read from a template
+    must be converted to a number before it can be compared
+    """
+    try:
+        return repr(float(age))
+    except (TypeError, ValueError):
+        return normalizeKeyValue(age)
+
+def seedIdMaps(conn):
+    """
+    Reads the primary and natural keys of every existing row in each WWARN table,
+    one query per table. Genotypes are only seeded with the next available id
+    here, the natural keys of existing genotypes are pulled down later only for
+    the samples found in our template (see seedExistingGenotypes).
+    """
+    idMaps = OrderedDict()
+    cursor = conn.cursor()
+
+    for (table, columns) in TABLE_COLUMNS.iteritems():
+        idMap = idMaps.setdefault(table, TableIdMap(table))
+
+        if table == 'genotype':
+            cursor.execute("SELECT MAX(id_genotype) FROM genotype")
+            maxId = cursor.fetchone()[0]
+            idMap.nextId = (maxId or 0) + 1
+            continue
+
+        cursor.execute("SELECT %s FROM `%s`" % (", ".join(columns), table))
+        for row in cursor.fetchall():
+            key = tuple([normalizeKeyValue(v) for v in row[1:]])
+            if table == 'subject':
+                key = key[0:3] + (normalizeAge(row[4]),) + key[4:]
+
+            idMap.seed(key, row[0])
+
+    cursor.close()
+    return idMaps
+
+def seedExistingGenotypes(conn, idMap, sampleIds):
+    """
+    Pulls down the natural keys of all genotypes already stored for the given
+    samples in chunks of SAMPLE_CHUNK_SIZE samples per query.
+    """
+    sampleIds = sorted(sampleIds)
+    columns = TABLE_COLUMNS.get('genotype')
+    cursor = conn.cursor()
+
+    for i in xrange(0, len(sampleIds), SAMPLE_CHUNK_SIZE):
+        chunk = sampleIds[i:i + SAMPLE_CHUNK_SIZE]
+        query = "SELECT %s FROM genotype WHERE fk_sample_id IN (%s)" % (", ".join(columns),
+                                                                       ", ".join(["%s"] * len(chunk)))
+        cursor.execute(query, chunk)
+
+        for row in cursor.fetchall():
+            idMap.seed(tuple([normalizeKeyValue(v) for v in row[1:]]), row[0])
+
+    cursor.close()
+
+def parseTemplate(inputFile, idMaps, mutantStatus, conn=None, validator=None, report=None):
+    """
+    Parses a WWARN template resolving or assigning the primary key of every study,
+    location, subject, sample, marker and genotype found in it. New rows are
+    queued in each table's TableIdMap.
+
+    Genotypes belonging to samples that already exist in the database are held
+    back until the genotypes stored for those samples have been read in a single
+    pass once the whole template has been parsed.
+
+    If a TemplateValidator is passed in the template is validated in the same 
+    pass, with any problems found added to the passed in ValidationReport. 
+    Values of malformed marker columns are then skipped rather than failing 
+    the whole template.
+    """
+    existingSamples = set()
+    deferredGenotypes = []
+    firstNewSampleId = idMaps['sample'].nextId
+
+    templateFH = openTemplate(inputFile)
+    (header, metadata) = readTemplateHeader(templateFH)
+
+    # The column header follows an optional #METADATA line
+    headerLine = 2 if metadata else 1
+
+    if validator is not None:
+        markerColumns = validator.validateHeader(headerLine, header, report)
+    else:
+        markerColumns = [parseMarkerColumn(c) for c in header[MARKER_START_COL:]]
+
+    for (lineNumber, fields) in iterateNumberedTemplateRows(templateFH, headerLine + 1):
+        fields = [f.strip() for f in fields]
+
+        if len(fields) <= MARKER_START_COL:
+            print "WARN: Row has no marker data: %s" % "\t".join(fields)
+            continue
+
+        if validator is not None:
+            validator.validateRow(lineNumber, fields, header, markerColumns, report)
+
+        (studyId, investigator, label, country, site, patientId, age, doi, sampleDate) = fields[0:MARKER_START_COL]
+
+        if age in ['', 'NODATA']:
+            age = NULL
+
+        doi = doi or NULL
+        sampleDate = sampleDate or NULL
+
+        (dbStudyId, created) = idMaps['study'].getOrCreateId(tuple([normalizeKeyValue(v) for v in (studyId, investigator, label)]),
+                                                             (studyId, investigator, label))
+        (dbLocationId, created) = idMaps['location'].getOrCreateId((str(dbStudyId), country, site),
+                                                                   (dbStudyId, country, site))
+        (dbSubjectId, created) = idMaps['subject'].getOrCreateId((str(dbStudyId), str(dbLocationId), patientId, normalizeAge(age), doi),
+                                                                 (dbStudyId, dbLocationId, patientId, age, doi))
+        (dbSampleId, created) = idMaps['sample'].getOrCreateId((str(dbSubjectId), sampleDate), (dbSubjectId, sampleDate))
+
+        if dbSampleId < firstNewSampleId:
+            existingSamples.add(dbSampleId)
+
+        for (marker, value) in zip(markerColumns, fields[MARKER_START_COL:]):
+            if value == "" or marker is None:
+                continue
+
+            # Copy number markers carry no position, these are stored as position 0
+            # which matches the marker lists used by our calculations
+            position = marker.get('position') or '0'
+            moleculeType = marker.get('molecule_type') or ''
+            if not validateGenotypes([value]):
+                moleculeType = ''
+
+            status = 'No data'
+            if marker.get('type') == 'SNP':
+                status = mutantStatus.get((marker.get('name'), position, canonicalGenotype(value)), 'No data')
+
+            (dbMarkerId, created) = idMaps['marker'].getOrCreateId((marker.get('name'), position, marker.get('type')),
+                                                                   (marker.get('name'), position, marker.get('type')))
+
+            genotype = (dbSampleId, dbMarkerId, value, status, moleculeType)
+            if dbSampleId in existingSamples:
+                deferredGenotypes.append(genotype)
+            else:
+                addGenotype(idMaps['genotype'], genotype)
+
+    templateFH.close()
+
+    if deferredGenotypes and conn is not None:
+        seedExistingGenotypes(conn, idMaps['genotype'], existingSamples)
+
+    for genotype in deferredGenotypes:
+        addGenotype(idMaps['genotype'], genotype)
+
+def addGenotype(idMap, genotype):
+    """
+    Queues a genotype for loading unless it is a duplicate of a genotype
+    already stored or found earlier in our template
+    """
+    (id, created) = idMap.getOrCreateId(tuple([normalizeKeyValue(v) for v in genotype]), genotype)
+
+    if not created:
+        print "WARN: Duplicate genotype skipped: %s" % "\t".join([str(v) for v in genotype])
+
+def writeLoadFiles(idMaps, outputDir, filePrefix, fileSuffixes):
+    """
+    Writes the new rows for each table to a tab-delimited file that can be
+    loaded with LOAD DATA INFILE. Returns a dictionary of table name to
+    load file.
+    """
+    loadFiles = OrderedDict()
+
+    for (table, idMap) in idMaps.iteritems():
+        loadFile = join(outputDir, filePrefix + fileSuffixes.get(table, '.%s.txt' % table))
+        loadFiles[table] = loadFile
+
+        loadFH = open(loadFile, 'w')
+        for row in idMap.newRows:
+            loadFH.write("\t".join([str(v) for v in row]))
+            loadFH.write("\n")
+        loadFH.close()
+
+    return loadFiles
+
+def loadFromFiles(conn, loadFiles):
+    """
+    Loads each of our load files into the database in a single transaction
+    """
+    cursor = conn.cursor()
+
+    for (table, loadFile) in loadFiles.iteritems():
+        cursor.execute("LOAD DATA LOCAL INFILE %%s INTO TABLE `%s` (%s)" % (table, ", ".join(TABLE_COLUMNS.get(table))),
+                       (loadFile,))
+
+    cursor.close()
+
+def loadWithInserts(conn, idMaps, batchSize):
+    """
+    Loads the new rows for each table into the database using multi-row INSERT
+    statements of batchSize rows each
+    """
+    cursor = conn.cursor()
+
+    for (table, idMap) in idMaps.iteritems():
+        columns = TABLE_COLUMNS.get(table)
+        insertStmt = "INSERT INTO `%s` (%s) VALUES (%s)" % (table, ", ".join(columns), ", ".join(["%s"] * len(columns)))
+
+        rows = [[None if v == NULL else v for v in row] for row in idMap.newRows]
+        for i in xrange(0, len(rows), batchSize):
+            cursor.executemany(insertStmt, rows[i:i + batchSize])
+
+    cursor.close()
+
+def loadDatabase(conn, idMaps, loadFiles, loadMethod, batchSize):
+    """
+    Loads all new rows into the WWARN database, rolling back everything if
+    any table fails to load
+    """
+    try:
+        if loadMethod == 'insert':
+            loadWithInserts(conn, idMaps, batchSize)
+        else:
+            loadFromFiles(conn, loadFiles)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def main(parser):
+    bundle = loadConfigBundle(parser.config_file, None, 
+                              requiredOptions=DB_OPTIONS + [('GENERAL', 'mutant_status')])
+    config = bundle['config']
+
+    outputDir = parser.output_directory or config.get('GENERAL', 'output_directory')
+    filePrefix = splitext(basename(parser.input_file))[0]
+    fileSuffixes = dict(config.items('FILES'))
+
+    # Our mutant status table and the lookups our template is validated 
+    # against are precompiled into the configuration bundle
+    mutantStatus = bundle['mutant_status']
+
+    conn = open_db_connection(config.get('DB', 'hostname'), config.get('DB', 'database_name'),
+                              config.get('DB', 'username'), config.get('DB', 'password'), local_infile=1)
+
+    idMaps = seedIdMaps(conn)
+    report = ValidationReport()
+    parseTemplate(parser.input_file, idMaps, mutantStatus, conn, bundle['template_validator'], report)
+    loadFiles = writeLoadFiles(idMaps, outputDir, filePrefix, fileSuffixes)
+
+    reportFile = join(outputDir, filePrefix + '.validation.txt')
+    report.write(reportFile)
+
+    if report.hasIssues():
+        counts = ", ".join(["%s %s" % (n, c) for (c, n) in report.getCounts().iteritems() if n])
+        print "WARN: Template failed validation (%s), see %s" % (counts, reportFile)
+
+        if parser.load and not parser.load_invalid:
+            print "WARN: Not loading the database, use --load_invalid to load a template that failed validation"
+            conn.close()
+            return
+
+    if parser.load:
+        loadDatabase(conn, idMaps, loadFiles, parser.load_method, parser.batch_size)
+
+        # Bring the denormalized fact table up to date with the genotypes we just loaded
+        rowCount = refreshFactTable(conn)
+        print "DEBUG: Added %s genotypes to the genotype fact table" % rowCount
+
+    conn.close()
+
+if __name__ == "__main__":
+    main(buildArgParser())
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+##
+# This module calculates confidence intervals for our prevalence statistics.
+#
+# Intervals are calculated in batches: every (GENOTYPED, SAMPLE SIZE) pair
+# that needs an interval is collected first and each distinct pair is only
+# calculated once, as the same pair tends to show up across many sites,
+# markers and age groups. When numpy is installed Wilson intervals are
+# calculated over arrays of all distinct pairs at once and when scipy is
+# installed its inverse incomplete beta function is used for Clopper-Pearson
+# intervals. Neither is required and each is only imported once intervals are
+# calculated.
+#
+
+import math
+
+from wwarnutils import importOptionalModule
+
+INTERVAL_METHODS = ['wilson', 'clopper-pearson']
+
+# Maximum number of iterations used when evaluating the continued fraction of
+# the incomplete beta function and when searching for one of its quantiles
+BETACF_MAX_ITERATIONS = 300
+QUANTILE_MAX_ITERATIONS = 60
+
+def calculateIntervalLookup(pairs, method='wilson', confidence=0.95):
+    """
+    Calculates the confidence interval of the prevalence for each of the passed
+    in (GENOTYPED, SAMPLE SIZE) pairs, returning a dictionary in the following
+    format:
+
+        { (<GENOTYPED>, <SAMPLE SIZE>): (<LOWER>, <UPPER>) }
+
+    The interval of a pair with a sample size of 0 is (None, None), as is the
+    interval of a pair genotyped more often than its sample size (i.e. two
+    studies sharing a site name), which has no valid prevalence.
+    """
+    if method not in INTERVAL_METHODS:
+        raise ValueError("Unknown confidence interval method %s" % method)
+
+    pairs = sorted(set([(int(k), int(n)) for (k, n) in pairs]))
+    lookup = dict([(p, (None, None)) for p in pairs if not 0 <= p[0] <= p[1] or p[1] == 0])
+    pairs = [p for p in pairs if p not in lookup]
+
+    if not pairs:
+        return lookup
+
+    if method == 'wilson':
+        intervals = calculateWilsonIntervals(pairs, confidence)
+    else:
+        intervals = calculateClopperPearsonIntervals(pairs, confidence)
+
+    lookup.update(zip(pairs, intervals))
+    return lookup
+
+def calculateWilsonIntervals(pairs, confidence):
+    """
+    Calculates the Wilson score interval of each (GENOTYPED, SAMPLE SIZE) pair
+    """
+    z = normalQuantile(1 - (1 - confidence) / 2.0)
+
+    numpy = importOptionalModule('numpy')
+    if numpy is not None:
+        k = numpy.array([p[0] for p in pairs], dtype=float)
+        n = numpy.array([p[1] for p in pairs], dtype=float)
+        p = k / n
+
+        denominator = 1 + z * z / n
+        center = (p + z * z / (2 * n)) / denominator
+        halfWidth = z * numpy.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+
+        lower = numpy.clip(center - halfWidth, 0.0, 1.0)
+        upper = numpy.clip(center + halfWidth, 0.0, 1.0)
+        return zip(lower.tolist(), upper.tolist())
+
+    intervals = []
+    for (k, n) in pairs:
+        p = float(k) / n
+
+        denominator = 1 + z * z / n
+        center = (p + z * z / (2 * n)) / denominator
+        halfWidth = z * math.sqrt(p * (1 - p) / n + z * z / (4.0 * n * n)) / denominator
+
+        intervals.append((max(0.0, center - halfWidth), min(1.0, center + halfWidth)))
+
+    return intervals
+
+def calculateClopperPearsonIntervals(pairs, confidence):
+    """
+    Calculates the exact Clopper-Pearson interval of each (GENOTYPED, SAMPLE SIZE)
+    pair from quantiles of the beta distribution
+    """
+    alpha = 1 - confidence
+    quantile = betaQuantile
+
+    special = importOptionalModule('scipy.special')
+    if special is not None:
+        quantile = lambda q, a, b, guess: float(special.betaincinv(a, b, q))
+
+    # The Wilson interval lies close to the exact interval and makes a good 
+    # starting point when searching for the beta quantiles
+    guesses = calculateWilsonIntervals(pairs, confidence)
+
+    intervals = []
+    for ((k, n), (lowerGuess, upperGuess)) in zip(pairs, guesses):
+        lower = 0.0 if k == 0 else quantile(alpha / 2.0, k, n - k + 1, lowerGuess)
+        upper = 1.0 if k == n else quantile(1 - alpha / 2.0, k + 1, n - k, upperGuess)
+        intervals.append((lower, upper))
+
+    return intervals
+
+def normalQuantile(p):
+    """
+    Returns the quantile of the standard normal distribution at p using Peter
+    Acklam's rational approximation (relative error below 1.15e-9)
+    """
+    a = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+         1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00]
+    b = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+         6.680131188771972e+01, -1.328068155288572e+01]
+    c = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+         -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00]
+    d = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+         3.754408661907416e+00]
+
+    if p < 0.02425:
+        q = math.sqrt(-2 * math.log(p))
+        return (((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) / \
+               ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1)
+    elif p > 1 - 0.02425:
+        return -normalQuantile(1 - p)
+
+    q = p - 0.5
+    r = q * q
+    return (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * q / \
+           (((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1)
+
+def regularizedIncompleteBeta(x, a, b):
+    """
+    Returns the regularized incomplete beta function I_x(a, b)
+    """
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1 - x))
+
+    # The continued fraction converges quickly for x < (a + 1) / (a + b + 2),
+    # otherwise the symmetry relation I_x(a, b) = 1 - I_1-x(b, a) is used
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * betaContinuedFraction(x, a, b) / a
+
+    return 1.0 - front * betaContinuedFraction(1 - x, b, a) / b
+
+def betaContinuedFraction(x, a, b):
+    """
+    Evaluates the continued fraction of the incomplete beta function using the
+    modified Lentz method
+    """
+    tiny = 1e-300
+    qab = a + b
+    qap = a + 1.0
+    qam = a - 1.0
+
+    c = 1.0
+    d = 1.0 - qab * x / qap
+    if abs(d) < tiny:
+        d = tiny
+    d = 1.0 / d
+    h = d
+
+    for m in xrange(1, BETACF_MAX_ITERATIONS + 1):
+        m2 = 2 * m
+
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        if abs(d) < tiny:
+            d = tiny
+        c = 1.0 + aa / c
+        if abs(c) < tiny:
+            c = tiny
+        d = 1.0 / d
+        h *= d * c
+
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        if abs(d) < tiny:
+            d = tiny
+        c = 1.0 + aa / c
+        if abs(c) < tiny:
+            c = tiny
+        d = 1.0 / d
+        delta = d * c
+        h *= delta
+
+        if abs(delta - 1.0) < 1e-15:
+            break
+
+    return h
+
+def betaQuantile(q, a, b, guess=0.5):
+    """
+    Returns the quantile of the beta distribution with parameters a and b at q.
+    Newton's method is used starting from the passed in guess, falling back to
+    bisection whenever a Newton step would leave the bracket known to hold the
+    quantile.
+    """
+    lower = 0.0
+    upper = 1.0
+    logBeta = math.lgamma(a) + math.lgamma(b) - math.lgamma(a + b)
+
+    x = min(max(guess, 1e-12), 1 - 1e-12)
+    for i in xrange(QUANTILE_MAX_ITERATIONS):
+        error = regularizedIncompleteBeta(x, a, b) - q
+        if abs(error) < 1e-12:
+            break
+
+        if error < 0:
+            lower = x
+        else:
+            upper = x
+
+        density = math.exp((a - 1) * math.log(x) + (b - 1) * math.log(1 - x) - logBeta)
+        nextX = x - error / density if density > 0 else None
+        if nextX is None or not lower < nextX < upper:
+            nextX = (lower + upper) / 2.0
+
+        if abs(nextX - x) < 1e-15:
+            break
+        x = nextX
+
+    return x
+
+def formatInterval(interval):
+    """
+    Formats an interval as percentages in the same style as our prevalence
+    statistics, i.e. 21% - 45%
+    """
+    (lower, upper) = interval
+    if lower is None:
+        return ""
+
+    return "{0:.0%} - {1:.0%}".format(lower, upper)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+##
+# This module houses the marker catalog shared by the WWARN calculation
+# scripts. The catalog is built once from a marker list file and provides
+# constant time lookups of valid genotypes, categories, labels and combination
+# markers.
+#
+
+from collections import OrderedDict
+from wwarnutils import commaDelimToTuple, canonicalGenotype
+
+def parseMarkerList(markerListFile):
+    """
+    Parses the passed in marker list and returns a MarkerCatalog containing all
+    of its markers (see readMarkerList)
+    """
+    return buildMarkerCatalog(readMarkerList(markerListFile))
+
+def readMarkerList(markerListFile):
+    """
+    Reads the passed in marker list and returns its markers as a list of plain
+    (LOCUS NAMES, LOCUS POSITIONS, TYPE, GENOTYPE, CATEGORY, LABEL, PROCEDURE)
+    tuples that can be handed to buildMarkerCatalog. The marker list is a 
+    tab-delimited file of the following format:
+
+        # LOCUS NAME\\tLOCUS POSITION\\tTYPE\\tGENOTYPE\\tCATEGORY\\tLABEL\\tPROCEDURE
+        pfcrt\\t76\\tSNP\\tK,T,K/T,Not Genotyped,Genotyping Failure
+        pfcrt\\t76\\tSNP\\tT\\tpfcrt 76T\\tPure\\t
+        pfdhps,pfdhps\\t437,540\\tSNP\\tG,E\\tdhps double\\tPure\\tdouble_haplotype_genotype_counts
+
+    Combination markers list their locus names, positions and genotypes as
+    comma-delimited values, one per locus. A single marker line without a
+    CATEGORY lists all of the valid genotypes for that marker instead. The
+    CATEGORY, LABEL and PROCEDURE fields are optional.
+    """
+    markerLines = []
+
+    markerListFH = open(markerListFile)
+    for line in markerListFH:
+        if line.startswith('#') or not line.strip():
+            continue
+
+        elts = line.rstrip('\r\n').split('\t')
+        elts.extend([''] * (7 - len(elts)))
+        (nameRaw, posRaw, type, genotypeRaw, category, label, procedure) = elts[0:7]
+
+        markerLines.append((commaDelimToTuple(nameRaw), commaDelimToTuple(posRaw), type,
+                            genotypeRaw, category, label, procedure))
+
+    markerListFH.close()
+    return markerLines
+
+def buildMarkerCatalog(markerLines):
+    """
+    Returns a MarkerCatalog containing each of the markers read from a marker
+    list by readMarkerList
+    """
+    catalog = MarkerCatalog()
+    for markerLine in markerLines:
+        catalog.addMarker(*markerLine)
+
+    return catalog
+
+class MarkerCatalog(object):
+    """
+    Holds every marker from a marker list along with hash indexes used to look
+    up combination markers, their pretty names and the category and label of a
+    genotype.
+
+    Markers are keyed on a tuple of (LOCUS NAME, LOCUS POSITION) tuples which
+    matches the marker key used in the statistics dictionary, i.e.:
+
+        (('pfdhps', '437'), ('pfdhps', '540'))
+
+    Lookups for combination markers and their genotypes are keyed on frozensets
+    so that the order the loci are listed in does not matter. Genotypes are
+    stored in their canonical form (see wwarnutils.canonicalGenotype) so they
+    can be used to probe the statistics dictionary directly, while the spelling
+    used in the marker list is kept for display.
+    """
+    def __init__(self):
+        # { <MARKER KEY>: { 'valid': [<GENOTYPE>, ...], 'display': { <GENOTYPE>: <DISPLAY NAME> },
+        #                   'labels': [<LABEL>, ...], 'category': <CATEGORY> } }
+        self.markers = OrderedDict()
+
+        # Stored procedures used to pull down combination marker data and the
+        # list of (LOCUS NAME, LOCUS POSITION) tuples passed to each
+        self.procedures = OrderedDict()
+
+        self._combinations = []
+        self._comboIndex = {}
+        self._genotypeIndex = {}
+
+    def addMarker(self, names, positions, type, genotypeRaw, category=None, label=None, procedure=None):
+        """
+        Adds a line from the marker list to the catalog, updating all lookup
+        indexes
+        """
+        markerKey = tuple(zip(names, positions))
+        marker = self.markers.get(markerKey)
+
+        if marker is None:
+            marker = self.markers.setdefault(markerKey, OrderedDict())
+            marker['type'] = type
+            marker['valid'] = []
+            marker['display'] = {}
+            marker['labels'] = []
+            marker['category'] = None
+
+            if len(markerKey) > 1:
+                self._combinations.append(markerKey)
+                self._comboIndex[frozenset(markerKey)] = markerKey
+
+        if len(markerKey) == 1 and not category:
+            # A single marker without a category lists all of its valid
+            # genotypes in one comma-delimited field
+            for genotype in genotypeRaw.split(','):
+                self._addValidGenotype(marker, (genotype,))
+            return
+
+        genotype = self._addValidGenotype(marker, commaDelimToTuple(genotypeRaw))
+
+        if category:
+            if len(markerKey) > 1:
+                marker['category'] = category
+
+            if label and label not in marker['labels']:
+                marker['labels'].append(label)
+
+            self._genotypeIndex[self._getGenotypeIndexKey(markerKey, genotype)] = { 'category': category,
+                                                                                     'label': label }
+
+        if procedure and procedure not in self.procedures:
+            self.procedures[procedure] = zip(names, positions)
+
+    def _addValidGenotype(self, marker, genotypeRaw):
+        """
+        Adds a genotype to the list of valid genotypes of a marker returning
+        its canonical form
+        """
+        genotype = tuple([canonicalGenotype(g) for g in genotypeRaw])
+
+        if genotype not in marker['valid']:
+            marker['valid'].append(genotype)
+            marker['display'][genotype] = " + ".join([g.strip() for g in genotypeRaw])
+
+        return genotype
+
+    def _getGenotypeIndexKey(self, markerKey, genotype):
+        """
+        Pairs each locus with its genotype so that a genotype can be looked up
+        regardless of the order its loci are listed in
+        """
+        return frozenset(zip(markerKey, genotype))
+
+    def __contains__(self, markerKey):
+        return markerKey in self.markers
+
+    def __iter__(self):
+        return iter(self.markers)
+
+    def getCombinations(self):
+        """
+        Returns all combination markers in the order they were listed
+        """
+        return self._combinations
+
+    def getCombination(self, markerKey):
+        """
+        Returns the marker key of the combination marker made up of the same
+        loci as the passed in marker key, or None if no such combination exists
+        """
+        return self._comboIndex.get(frozenset(markerKey))
+
+    def getValidGenotypes(self, markerKey):
+        """
+        Returns a list of all valid genotypes for the given marker as tuples
+        containing one value per locus
+        """
+        combo = self.getCombination(markerKey) if len(markerKey) > 1 else markerKey
+        if combo not in self.markers:
+            return []
+
+        return self.markers[combo]['valid']
+
+    def getGenotypeColumns(self, markerKey):
+        """
+        Returns a list of (DISPLAY NAME, GENOTYPE) tuples for all valid genotypes
+        of the given marker, where DISPLAY NAME is the genotype as it was spelled
+        in the marker list
+        """
+        combo = self.getCombination(markerKey) if len(markerKey) > 1 else markerKey
+        if combo not in self.markers:
+            return []
+
+        marker = self.markers[combo]
+        return [(marker['display'][g], g) for g in marker['valid']]
+
+    def getComboLabels(self, markerKey):
+        """
+        Retrieves the labels (i.e. Pure, Mixed) that the genotypes of a combination
+        marker are grouped under
+        """
+        combo = self.getCombination(markerKey)
+        if combo is None:
+            return []
+
+        return self.markers[combo]['labels']
+
+    def getPrettyComboMarkerLabel(self, markerKey):
+        """
+        Retrieves the pretty name for our combo markers (i.e. pfdhps 540 +
+        pfdhps 437 -->  dhps double)
+        """
+        combo = self.getCombination(markerKey)
+        if combo is None:
+            return None
+
+        return self.markers[combo]['category']
+
+    def getGenotypeCategory(self, markerKey, genotype):
+        """
+        Returns the category a genotype of the given marker is grouped under
+        """
+        return self._genotypeIndex.get(self._getGenotypeIndexKey(markerKey, genotype), {}).get('category')
+
+    def getGenotypeLabel(self, markerKey, genotype):
+        """
+        Returns the label (i.e. Pure, Mixed) of a genotype of the given marker
+        """
+        return self._genotypeIndex.get(self._getGenotypeIndexKey(markerKey, genotype), {}).get('label')
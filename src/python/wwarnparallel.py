@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+##
+# This module parses and tabulates a single large input file with several
+# worker processes.
+#
+# The data rows of the file are split into byte ranges aligned on line
+# boundaries. Each worker is handed the function that turns lines of the file
+# into rows of calculation input once, when it is started, and then parses
+# and tabulates whole chunks into its own partial state. The partial states
+# are merged back in chunk order so that the merged state is identical to the
+# state tabulated by reading the file from start to finish.
+#
+# A file can also be validated while it is tabulated. Each worker validates
+# its chunks into a report of their own, numbering lines from the start of
+# the chunk, and these are shifted to line numbers of the file as they are
+# merged.
+#
+
+import multiprocessing
+import os
+
+from collections import OrderedDict
+from wwarncalculations import tabulateMarkerCounts, mergeCountStates
+from wwarnvalidate import ValidationReport
+
+# Files are never split into chunks smaller than this many bytes as the cost
+# of merging partial states would outweigh the time saved parsing
+MIN_CHUNK_BYTES = 4 * 1024 * 1024
+
+# Set in each worker process when it is started (see initWorker)
+_workerPlan = None
+
+def findChunkBoundaries(inputFile, dataStart, chunks):
+    """
+    Splits the data of a file starting at dataStart into at most the given
+    number of chunks, returning a list of (START, END) byte ranges. Every
+    range starts at the beginning of a line and ends at the start of the next
+    range.
+    """
+    size = os.path.getsize(inputFile)
+    chunks = max(1, min(chunks, (size - dataStart) // MIN_CHUNK_BYTES))
+
+    boundaries = [dataStart]
+    inputFH = open(inputFile, 'rb')
+
+    for i in xrange(1, chunks):
+        # Seeking to the byte before our target means a target that already
+        # falls on the start of a line is kept as it is
+        inputFH.seek(dataStart + (size - dataStart) * i // chunks - 1)
+        inputFH.readline()
+
+        position = inputFH.tell()
+        if boundaries[-1] < position < size:
+            boundaries.append(position)
+
+    inputFH.close()
+
+    boundaries.append(size)
+    return zip(boundaries[:-1], boundaries[1:])
+
+def iterateChunkLines(inputFH, start, end, lineCount=None):
+    """
+    Yields each line of an open file between the passed in byte offsets,
+    counting the lines read into the first item of lineCount (if passed in)
+    """
+    inputFH.seek(start)
+    position = start
+
+    while position < end:
+        line = inputFH.readline()
+        if not line:
+            break
+
+        position += len(line)
+        if lineCount is not None:
+            lineCount[0] += 1
+        yield line
+
+def initWorker(inputFile, rowsFunc, groups, validate=False):
+    """
+    Stores the plan used to parse and tabulate chunks of our input file in a
+    worker process
+    """
+    global _workerPlan
+    _workerPlan = (inputFile, rowsFunc, groups, validate)
+
+def tabulateChunk(chunk):
+    """
+    Parses and tabulates the lines of a single chunk of our input file,
+    returning a tuple of the partial state tabulated from them, the report
+    they were validated into (None if we are not validating) and the number
+    of lines in the chunk
+    """
+    (inputFile, rowsFunc, groups, validate) = _workerPlan
+    (start, end) = chunk
+
+    state = OrderedDict()
+    report = ValidationReport() if validate else None
+    lineCount = [0]
+
+    inputFH = open(inputFile, 'rb')
+    lines = iterateChunkLines(inputFH, start, end, lineCount)
+    rows = rowsFunc(lines, report=report) if validate else rowsFunc(lines)
+    tabulateMarkerCounts(state, rows, groups)
+    inputFH.close()
+
+    return (state, report, lineCount[0])
+
+def tabulateFileInParallel(inputFile, dataStart, rowsFunc, groups, processes, report=None, firstLine=1):
+    """
+    Tabulates the marker counts of an input file using the given number of
+    worker processes. rowsFunc is called with an iterable of lines of the
+    file and must return the rows of calculation input parsed from them.
+    Counts are broken down into the passed in groups, either a list of age 
+    groups or a Stratification (see tabulateMarkerCounts).
+
+    If a ValidationReport is passed in rowsFunc is also passed a report 
+    keyword argument to validate the lines of each chunk into, numbering them
+    from 1 at the start of the chunk. Problems found are added to the passed 
+    in report at their line of the file, firstLine being the line number at
+    dataStart.
+
+    Returns the merged state variable (see tabulateMarkerCounts); prevalence
+    has not yet been calculated.
+    """
+    chunks = findChunkBoundaries(inputFile, dataStart, processes)
+    plan = (inputFile, rowsFunc, groups, report is not None)
+
+    if len(chunks) == 1:
+        initWorker(*plan)
+        (state, chunkReport, lineCount) = tabulateChunk(chunks[0])
+        if report is not None:
+            report.addReport(chunkReport, firstLine - 1)
+        return state
+
+    pool = multiprocessing.Pool(min(processes, len(chunks)), initWorker, plan)
+    state = OrderedDict()
+    lineOffset = firstLine - 1
+
+    try:
+        for (partialState, chunkReport, lineCount) in pool.imap(tabulateChunk, chunks):
+            mergeCountStates(state, partialState)
+            if report is not None:
+                report.addReport(chunkReport, lineOffset)
+            lineOffset += lineCount
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return state
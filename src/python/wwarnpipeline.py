@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+##
+# This module runs the fetching and transforming of our calculation input in
+# background threads so that the database can work on the next batch of rows
+# while the current one is being tabulated.
+#
+# Rows flow through the pipeline in batches over bounded queues:
+#
+#     fetch thread -> [queue] -> transform thread -> [queue] -> tabulation
+#
+# The fetch thread runs each stage (see iterateStages in wwarncheckpoint.py)
+# in order, one after the other, and the pipeline hands back stages of the
+# same form whose rows are read off the last queue. Tabulation and
+# checkpointing therefore stay on the calling thread and see exactly the rows,
+# in exactly the order, they would without the pipeline. Any error raised in
+# a background thread is raised again on the calling thread.
+#
+
+import sys
+import threading
+
+from functools import partial
+from Queue import Queue, Full, Empty
+
+# Markers passed down our queues alongside batches of rows
+STAGE_END = 'STAGE_END'
+PIPELINE_END = 'PIPELINE_END'
+PIPELINE_ERROR = 'PIPELINE_ERROR'
+
+# Number of seconds a background thread waits on a full or empty queue before
+# checking whether the pipeline has been closed
+QUEUE_TIMEOUT = 0.5
+
+class RowPipeline(object):
+    """
+    Fetches the rows of a list of stages and applies a transform to each row
+    in background threads
+    """
+    def __init__(self, stages, transform=None, queueSize=8, batchSize=1000):
+        self.stages = stages
+        self.transform = transform
+        self.batchSize = batchSize
+        self.fetchQueue = Queue(queueSize)
+        self.rowQueue = Queue(queueSize)
+        self.closed = threading.Event()
+        self.threads = [threading.Thread(target=self._fetch, name='wwarn-fetch'),
+                        threading.Thread(target=self._transform, name='wwarn-transform')]
+
+        for thread in self.threads:
+            thread.daemon = True
+
+    def start(self):
+        """
+        Starts our background threads, returning the list of (NAME, ROWS
+        FUNCTION) stages that read their rows from the pipeline. These
+        stages must be read in order.
+        """
+        for thread in self.threads:
+            thread.start()
+
+        return [(name, partial(self._readStage, name)) for (name, rowsFunc) in self.stages]
+
+    def close(self):
+        """
+        Stops our background threads, i.e. if the rows of our stages are no
+        longer needed
+        """
+        self.closed.set()
+
+    def join(self):
+        """
+        Waits for our background threads to exit, i.e. once the pipeline has
+        been closed
+        """
+        for thread in self.threads:
+            if thread.is_alive():
+                thread.join()
+
+    def _put(self, queue, item):
+        """
+        Puts an item on one of our queues, giving up if the pipeline is closed
+        while waiting on a full queue. Returns False if the item was not put.
+        """
+        while not self.closed.is_set():
+            try:
+                queue.put(item, True, QUEUE_TIMEOUT)
+                return True
+            except Full:
+                continue
+
+        return False
+
+    def _get(self, queue):
+        """
+        Gets an item off one of our queues, returning None if the pipeline is
+        closed while waiting on an empty queue
+        """
+        while not self.closed.is_set():
+            try:
+                return queue.get(True, QUEUE_TIMEOUT)
+            except Empty:
+                continue
+
+        return None
+
+    def _fetch(self):
+        try:
+            for (name, rowsFunc) in self.stages:
+                batch = []
+                for row in rowsFunc():
+                    batch.append(row)
+
+                    if len(batch) >= self.batchSize:
+                        if not self._put(self.fetchQueue, (name, batch)):
+                            return
+                        batch = []
+
+                if batch and not self._put(self.fetchQueue, (name, batch)):
+                    return
+                if not self._put(self.fetchQueue, (name, STAGE_END)):
+                    return
+
+            self._put(self.fetchQueue, (PIPELINE_END, None))
+        except Exception:
+            self._put(self.fetchQueue, (PIPELINE_ERROR, sys.exc_info()))
+
+    def _transform(self):
+        while True:
+            item = self._get(self.fetchQueue)
+            if item is None:
+                return
+
+            (name, batch) = item
+            if name == PIPELINE_END:
+                return
+
+            if name != PIPELINE_ERROR and batch != STAGE_END and self.transform:
+                try:
+                    batch = [self.transform(row) for row in batch]
+                except Exception:
+                    item = (PIPELINE_ERROR, sys.exc_info())
+                else:
+                    item = (name, batch)
+
+            if not self._put(self.rowQueue, item) or item[0] == PIPELINE_ERROR:
+                return
+
+    def _readStage(self, stageName):
+        while True:
+            (name, batch) = self.rowQueue.get()
+
+            if name == PIPELINE_ERROR:
+                self.close()
+                raise batch[0], batch[1], batch[2]
+
+            if name != stageName:
+                self.close()
+                raise RuntimeError("Pipeline returned rows of stage %s while reading stage %s" % (name, stageName))
+
+            if batch == STAGE_END:
+                return
+
+            for row in batch:
+                yield row
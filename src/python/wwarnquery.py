@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+##
+# This module builds the parameterized filters of the queries sent to the
+# WWARN database and executes those queries as server-side prepared
+# statements.
+#
+# Study ID and site filters are written as IN (...) lists. Each list is padded
+# up to the next power of two by repeating its last value, and lists longer
+# than MAX_IN_LIST_SIZE are split into chunks OR'd together:
+#
+#     (l.site IN (%s, %s, ..., %s) OR l.site IN (%s, %s, %s, %s))
+#
+# so the text of a query only depends on the rough size of each filter and
+# not on the values filtered on. Every distinct query text is prepared once
+# per connection with PREPARE and run with EXECUTE ... USING on every call
+# after that, letting the server reuse the statement it has already parsed.
+#
+# EXECUTE only takes its parameters from user variables. The value last
+# assigned to each variable is remembered so that a call only sends a SET for
+# the parameters that changed since the previous one; repeated queries over
+# the same filters go out as a single EXECUTE.
+#
+
+# Largest number of values in a single IN (...) list
+MAX_IN_LIST_SIZE = 1000
+
+# Prefixes of the names of our prepared statements and of the user variables
+# their parameters are passed in
+STATEMENT_PREFIX = 'wwarn_stmt_'
+PARAMETER_PREFIX = '@wwarn_p'
+
+def getPaddedSize(size):
+    """
+    Returns the smallest power of two no less than the passed in size
+    """
+    padded = 1
+    while padded < size:
+        padded *= 2
+
+    return padded
+
+def buildInClause(column, values, chunkSize=MAX_IN_LIST_SIZE):
+    """
+    Builds a clause matching a column against a list of values, split into
+    IN lists of at most chunkSize values. Returns a tuple of the clause and
+    its parameters.
+    """
+    clauses = []
+    params = []
+
+    for start in xrange(0, len(values), chunkSize):
+        chunk = list(values[start:start + chunkSize])
+        size = min(chunkSize, getPaddedSize(len(chunk)))
+        chunk.extend([chunk[-1]] * (size - len(chunk)))
+
+        clauses.append("%s IN (%s)" % (column, ", ".join(["%s"] * size)))
+        params.extend(chunk)
+
+    if len(clauses) > 1:
+        return ("(%s)" % " OR ".join(clauses), params)
+
+    return (clauses[0], params)
+
+def buildFilterClause(filters, keyword='WHERE'):
+    """
+    Builds a clause restricting a query to the given list of (COLUMN, VALUES)
+    filters, skipping any filter without values. The clause starts with the
+    passed in keyword so that it can also be appended to an existing WHERE
+    clause with 'AND'. Returns a tuple of the clause and its parameters, or an
+    empty clause if there is nothing to filter on.
+    """
+    clauses = []
+    params = []
+
+    for (column, values) in filters:
+        if not values:
+            continue
+
+        (clause, clauseParams) = buildInClause(column, values)
+        clauses.append(clause)
+        params.extend(clauseParams)
+
+    if not clauses:
+        return ("", [])
+
+    return ("%s %s" % (keyword, " AND ".join(clauses)), params)
+
+def compilePlaceholders(query):
+    """
+    Rewrites the %s placeholders of a query into the ? placeholders taken by
+    PREPARE. Text inside quoted strings and identifiers is left as written.
+    Returns a tuple of the rewritten query and its number of placeholders.
+    """
+    output = []
+    count = 0
+    quote = None
+    i = 0
+
+    while i < len(query):
+        char = query[i]
+
+        if quote is not None:
+            output.append(char)
+            if char == '\\' and quote != '`' and i + 1 < len(query):
+                output.append(query[i + 1])
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in ("'", '"', '`'):
+            output.append(char)
+            quote = char
+        elif query.startswith('%s', i):
+            output.append('?')
+            count += 1
+            i += 1
+        else:
+            output.append(char)
+
+        i += 1
+
+    return ("".join(output), count)
+
+class PreparedStatementCache(object):
+    """
+    Prepares every distinct query executed over a database connection once,
+    reusing the prepared statement each time the query is executed again
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+        # Query -> (statement name, number of placeholders)
+        self.statements = {}
+
+        # Parameter variable -> value last assigned to it on the server
+        self.variables = {}
+
+    def prepare(self, cursor, query):
+        """
+        Prepares the passed in query if it has not been already, returning
+        the name of its statement and its number of placeholders
+        """
+        statement = self.statements.get(query)
+        if statement is None:
+            (compiled, count) = compilePlaceholders(query)
+            name = "%s%s" % (STATEMENT_PREFIX, len(self.statements) + 1)
+            cursor.execute("PREPARE %s FROM %%s" % name, (compiled,))
+            statement = self.statements[query] = (name, count)
+
+        return statement
+
+    def execute(self, query, params=(), cursorClass=None):
+        """
+        Executes a query written with %s placeholders, returning the cursor
+        holding its results. A cursor class (i.e. MySQLdb.cursors.SSCursor)
+        can be passed in to control how results are read off the server.
+        """
+        cursor = self.conn.cursor()
+        (name, count) = self.prepare(cursor, query)
+
+        if len(params) != count:
+            raise ValueError("Query takes %s parameters but was passed %s" % (count, len(params)))
+
+        variables = ["%s%s" % (PARAMETER_PREFIX, i + 1) for i in xrange(count)]
+
+        # Values are compared along with their type as 1, 1.0 and True are
+        # equal in Python but not once bound to the statement
+        changed = [(v, p) for (v, p) in zip(variables, params) if self.variables.get(v) != (type(p), p)]
+        if changed:
+            cursor.execute("SET %s" % ", ".join(["%s = %%s" % v for (v, p) in changed]), tuple([p for (v, p) in changed]))
+            self.variables.update([(v, (type(p), p)) for (v, p) in changed])
+
+        executeStmt = "EXECUTE %s" % name
+        if variables:
+            executeStmt += " USING %s" % ", ".join(variables)
+
+        if cursorClass is not None:
+            cursor.close()
+            cursor = self.conn.cursor(cursorClass)
+
+        cursor.execute(executeStmt)
+        return cursor
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+##
+# This module rolls the genotype counts of our calculations up into counts and
+# prevalence of each mutant status (Wild, Mutant, Mixed) of every SNP locus,
+# using the mutant status table compiled into the configuration bundle (see
+# wwarnconfig.py).
+#
+# The roll-up is worked out from the state variable our counts are tabulated
+# into (see tabulateMarkerCounts in wwarncalculations.py) rather than from the
+# input rows, so it costs one lookup per distinct genotype of each marker,
+# site and group instead of a second pass over the data. Genotypes missing
+# from the mutant status table are counted as 'No data'; combination and copy
+# number markers carry no mutant status and are left out.
+#
+# The roll-up is written out in the same layout as the .calcs files written by
+# WWARN_db_calculations.py with the mutant status in place of the genotype:
+#
+#     STUDY_ID\tSTUDY_LABEL\tCOUNTRY\tSITE\tYEAR GROUP\tINVESTIGATOR\tGROUP\tMARKER\tMUTANT STATUS\t...
+#
+
+from collections import OrderedDict
+from wwarncalculations import calculatePrevalence
+from wwarncompress import openOutput, getOutputCompression, COMPRESSION_EXTENSIONS
+from wwarncube import buildResultCube
+from wwarnutils import validateGenotypes
+
+# Mutant statuses in the order they are written out. Any other status found
+# in the mutant status table follows these.
+MUTANT_STATUSES = ['Wild', 'Mutant', 'Mixed', 'No data']
+
+# Status of a genotype that is not in the mutant status table
+NO_DATA_STATUS = 'No data'
+
+def getDefaultStatusPath(outputFile):
+    """
+    Returns the path the mutant status roll-up of a template output file is
+    written to. The roll-up of a compressed output file is compressed in the
+    same format.
+    """
+    compression = getOutputCompression(outputFile)
+    if compression is None:
+        return outputFile + '.status'
+
+    extension = COMPRESSION_EXTENSIONS[compression]
+    return outputFile[:-len(extension)] + '.status' + extension
+
+def calculateMutantStatusStatistics(state, mutantStatus, groups):
+    """
+    Rolls the genotype counts of a state variable up into the counts of each
+    mutant status of every SNP locus for each of the passed in groups
+    (including 'All'). Returns a dictionary in the same format as
+    generateGroupedStatistics in WWARN_db_calculations.py:
+
+        { <METADATA KEY>: {
+            '<LOCUS NAME> <LOCUS POSITION>': {
+                'sample_size': { <GROUP>: <SAMPLE SIZE> },
+                <MUTANT STATUS>: {
+                    <GROUP>: { 'genotyped': <COUNT>, 'prevalence': <PREVALENCE> } } } } }
+    """
+    statusStats = OrderedDict()
+
+    for (metadataKey, markerIter) in state.iteritems():
+        for (markerKey, genotypeIter) in markerIter.iteritems():
+            # Only single SNP loci have a mutant status
+            if len(markerKey) != 1 or not markerKey[0][1]:
+                continue
+
+            (locusName, locusPosition) = markerKey[0]
+            sampleSizeDict = genotypeIter.get('sample_size', {})
+            statuses = OrderedDict([(s, createStatusCounts(groups)) for s in MUTANT_STATUSES])
+
+            for (genotype, groupIter) in genotypeIter.iteritems():
+                if genotype == 'sample_size' or not validateGenotypes(genotype):
+                    continue
+
+                status = mutantStatus.get((locusName, locusPosition, genotype[0]), NO_DATA_STATUS)
+                counts = statuses.get(status)
+                if counts is None:
+                    counts = statuses.setdefault(status, createStatusCounts(groups))
+
+                for group in groups:
+                    counts[group]['genotyped'] += groupIter.get(group, {}).get('genotyped', 0)
+
+            for counts in statuses.itervalues():
+                for group in groups:
+                    sampleSize = sampleSizeDict.get(group) or 0
+                    if sampleSize:
+                        counts[group]['prevalence'] = calculatePrevalence(counts[group]['genotyped'], sampleSize)
+
+            categoryStats = OrderedDict([('sample_size', OrderedDict([(g, sampleSizeDict.get(g) or 0) for g in groups]))])
+            categoryStats.update(statuses)
+            statusStats.setdefault(metadataKey, OrderedDict())["%s %s" % (locusName, locusPosition)] = categoryStats
+
+    return statusStats
+
+def createStatusCounts(groups):
+    return OrderedDict([(g, { 'genotyped': 0, 'prevalence': 0 }) for g in groups])
+
+def writeMutantStatusHeader(statusFH):
+    header = ['STUDY_ID', 'STUDY_LABEL', 'COUNTRY', 'SITE', 'YEAR GROUP', 'INVESTIGATOR', 'GROUP', 'MARKER',
+              'MUTANT STATUS', 'SAMPLE SIZE', 'PREVALENCE', 'PREVALENCE RAW', 'GENOTYPED']
+
+    statusFH.write("\t".join(header))
+    statusFH.write("\n")
+
+def writeMutantStatusRows(statusFH, statusStats, groups, year_step=None):
+    """
+    Writes out the rows of a mutant status roll-up (see
+    calculateMutantStatusStatistics) for each of the passed in groups
+    """
+    cube = buildResultCube(statusStats, groups, year_step)
+
+    for (coordinates, genotyped, sampleSize, prevalence) in cube.iterateCells():
+        ((studyId, studyLabel, investigator), (country, site), yearGroup, marker, status, group) = coordinates
+
+        statusFH.write("\t".join([studyId, studyLabel, country, site, yearGroup or "", investigator, group, marker,
+                                  status, str(sampleSize), "{0:.0%}".format(prevalence), str(prevalence),
+                                  str(genotyped)]))
+        statusFH.write("\n")
+
+def writeMutantStatusFile(state, mutantStatus, groups, statusFile, year_step=None):
+    """
+    Rolls a state variable up by mutant status and writes the roll-up out to
+    the given file, compressing it if its extension names a compressed format
+    (see wwarncompress.py)
+    """
+    statusFH = openOutput(statusFile)
+    writeMutantStatusHeader(statusFH)
+    writeMutantStatusRows(statusFH, calculateMutantStatusStatistics(state, mutantStatus, groups), groups, year_step)
+    statusFH.close()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+##
+# This module reads and writes the sidecar index written alongside the
+# contributor tables produced by WWARN_template_calculations.py.
+#
+# The index is a tab-delimited text file holding the byte offset and length
+# of every marker table and of the rows of every site within each table, so
+# a single table (or a single site of a table) can be pulled out of the
+# output file by seeking straight to it rather than scanning the whole file:
+#
+#     # MARKER\tSITE\tOFFSET\tLENGTH\tHEADER LENGTH
+#     pfcrt 76\t\t0\t1024\t95
+#     pfcrt 76\tBamako\t95\t310\t0
+#
+# Rows with an empty SITE describe a whole marker table, where HEADER LENGTH
+# is the length of the marker name and column header lines at the start of
+# the table.
+#
+# Compressed output files are not indexed: they cannot be seeked into, so a
+# lookup would have to decompress everything ahead of the table anyway.
+#
+
+import argparse
+
+from collections import OrderedDict
+from wwarncompress import detectCompression
+from wwarnexceptions import TableIndexException
+
+def getDefaultIndexPath(outputFile):
+    """
+    Returns the path of the sidecar index of the given output file
+    """
+    return outputFile + '.idx'
+
+class TableIndexWriter(object):
+    """
+    Records the byte offsets of the tables and site rows written to an output
+    file handle
+    """
+    def __init__(self, outputFH):
+        self.outputFH = outputFH
+        self.entries = []
+        self._table = None
+        self._site = None
+
+    def startTable(self, marker):
+        self._table = [marker.strip(), '', self.outputFH.tell(), 0, 0]
+        self.entries.append(self._table)
+
+    def endTableHeader(self):
+        self._table[4] = self.outputFH.tell() - self._table[2]
+
+    def startSite(self, site):
+        self._site = [self._table[0], site, self.outputFH.tell(), 0, 0]
+
+    def endSite(self):
+        self._site[3] = self.outputFH.tell() - self._site[2]
+        self.entries.append(self._site)
+        self._site = None
+
+    def endTable(self):
+        self._table[3] = self.outputFH.tell() - self._table[2]
+        self._table = None
+
+    def write(self, indexFile):
+        indexFH = open(indexFile, 'w')
+        indexFH.write("# MARKER\tSITE\tOFFSET\tLENGTH\tHEADER LENGTH\n")
+
+        for entry in self.entries:
+            indexFH.write("\t".join([str(e) for e in entry]))
+            indexFH.write("\n")
+
+        indexFH.close()
+
+def readTableIndex(indexFile):
+    """
+    Reads a sidecar index returning a dictionary in the following format:
+
+        { (<MARKER>, <SITE>): (<OFFSET>, <LENGTH>, <HEADER LENGTH>) }
+
+    where SITE is '' for the entry of a whole marker table.
+
+    A TableIndexException is raised if the same marker and site are listed
+    more than once (i.e. two studies sharing a site name), as either entry 
+    could be the one asked for.
+    """
+    index = OrderedDict()
+
+    indexFH = open(indexFile)
+    for (lineNum, line) in enumerate(indexFH, 1):
+        if line.startswith('#'):
+            continue
+
+        (marker, site, offset, length, headerLength) = line.rstrip('\r\n').split('\t')
+        if (marker, site) in index:
+            indexFH.close()
+            raise TableIndexException('Index %s lists marker %s%s more than once (line %s)' 
+                                      % (indexFile, marker, " at site %s" % site if site else "", lineNum))
+
+        index[(marker, site)] = (int(offset), int(length), int(headerLength))
+    indexFH.close()
+
+    return index
+
+def readTable(outputFile, index, marker, site=None):
+    """
+    Returns the text of a single marker table from an output file. If a site
+    is given only the marker name, column header and the rows of that site
+    are returned. Returns None if the table (or site) is not in our index.
+
+    A TableIndexException is raised if the output file is compressed.
+    """
+    if detectCompression(outputFile) is not None:
+        raise TableIndexException('Output file %s is compressed, tables can only be looked up in uncompressed '
+                                  'output files' % outputFile)
+
+    table = index.get((marker, ''))
+    if table is None:
+        return None
+
+    (offset, length, headerLength) = table
+    siteEntry = None
+    if site is not None:
+        siteEntry = index.get((marker, site))
+        if siteEntry is None:
+            return None
+
+    outputFH = open(outputFile)
+    outputFH.seek(offset)
+
+    if siteEntry is None:
+        text = outputFH.read(length)
+    else:
+        text = outputFH.read(headerLength)
+        outputFH.seek(siteEntry[0])
+        text += outputFH.read(siteEntry[1])
+
+    outputFH.close()
+    return text
+
+def buildArgParser():
+    """
+    Creates an argparser object using the command-line arguments passed into this script
+    """
+    parser = argparse.ArgumentParser(description='Prints a single table from a WWARN contributor tables file '
+                                        + 'using its sidecar index')
+    parser.add_argument('-i', '--input_file', required=True, help='Output file written by '
+                            + 'WWARN_template_calculations.py')
+    parser.add_argument('-m', '--marker', required=True, help='Marker of the table to print (i.e. "pfcrt 76")')
+    parser.add_argument('-s', '--site', required=False, help='Only print the rows of this site')
+    parser.add_argument('-x', '--index_file', required=False, help='Sidecar index of the input file. Defaults to '
+                            + 'the input file path with a .idx extension')
+    args = parser.parse_args()
+
+    return args
+
+def main(parser):
+    index = readTableIndex(parser.index_file or getDefaultIndexPath(parser.input_file))
+    table = readTable(parser.input_file, index, parser.marker, parser.site)
+
+    if table is None:
+        print "WARN: No table found for marker %s%s" % (parser.marker, " at site %s" % parser.site if parser.site else "")
+    else:
+        print table.rstrip('\n')
+
+if __name__ == "__main__":
+    main(buildArgParser())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+##
+# This module contains the functions used to read the tab-delimited text file
+# produced from the TEMPLATE worksheet of the WWARN template. It is shared by
+# the template calculations and the database ingest scripts so that both read
+# a template in exactly the same way.
+#
+
+from collections import OrderedDict
+from wwarncompress import openInput
+from wwarnexceptions import TemplateFormatException
+from wwarnworkbook import TemplateWorkbook, isTemplateWorkbook
+
+# Index of the first marker column in a WWARN template, every column before
+# it holds study, site or patient metadata
+MARKER_START_COL = 9
+
+# Abbreviated marker and molecule types used in marker column headers and
+# the values they are stored as in the WWARN database
+MARKER_TYPES = {'cn': 'Copy Number', 'frag': 'Fragment'}
+MOLECULE_TYPES = {'aa': 'Amino Acid', 'nt': 'Nucleotide'}
+
+def openTemplate(inputFile):
+    """
+    Opens a WWARN template for reading. Templates are either the tab-delimited
+    text file exported from the TEMPLATE worksheet or the template workbook
+    itself, in which case the worksheet is read straight out of the workbook
+    as the lines of its text export (see wwarnworkbook.py). Text files may be
+    compressed (see wwarncompress.py).
+    """
+    if isTemplateWorkbook(inputFile):
+        return TemplateWorkbook(inputFile)
+
+    return openInput(inputFile)
+
+def readTemplateHeader(templateFH):
+    """
+    Reads the header of a WWARN template returning a tuple of the list of
+    column names and a dictionary of any metadata found in an optional
+    #METADATA line preceding the column header.
+    """
+    metadata = OrderedDict()
+
+    headerLine = templateFH.readline()
+    if headerLine.startswith('#METADATA'):
+        metadata = parse_metadata_header(headerLine)
+        headerLine = templateFH.readline()
+
+    header = [k for k in headerLine.replace('#', '').rstrip('\r\n').split('\t') if len(k) != 0]
+    return (header, metadata)
+
+def iterateTemplateRows(templateFH):
+    """
+    Iterates over the data rows of a WWARN template yielding each row as a
+    list of fields. Comment lines and rows consisting only of tabs (Excel
+    likes to leave a few of these at the end of an export) are skipped.
+    """
+    for row in templateFH:
+        row = row.rstrip('\r\n')
+        if all(s == '\t' for s in row) or row.startswith('#'):
+            continue
+
+        yield row.split('\t')
+
+def iterateNumberedTemplateRows(templateFH, firstLine):
+    """
+    Iterates over the data rows of a WWARN template in the same way as 
+    iterateTemplateRows, yielding tuples of the line number each row was found 
+    at and its list of fields. firstLine is the line number of the next line 
+    to be read from the file handle.
+    """
+    for (lineNumber, row) in enumerate(templateFH, firstLine):
+        row = row.rstrip('\r\n')
+        if all(s == '\t' for s in row) or row.startswith('#'):
+            continue
+
+        yield (lineNumber, row.split('\t'))
+
+def parse_metadata_header(metadata_header):
+    """
+    Parses any metadata in the header of a WWARN template file. This metadata
+    is defined by a #METADATA line:
+
+        #METADATA:year_step=1
+
+    A dictionary will be created out of the k=v pairs found in the header line
+    """
+    metadata_dict = OrderedDict()
+    metadata_elts = (metadata_header.rstrip('\r\n').split(':'))[1].split(',')
+
+    for (k, v) in [x.split('=') for x in metadata_elts]:
+        metadata_dict[k] = int(v)
+
+    return metadata_dict
+
+def parseMarkerColumn(columnName):
+    """
+    Parses a marker column header from a WWARN template into its components.
+    Marker column headers are of the following format:
+
+        <LOCUS_NAME>_<LOCUS_POSITION *OPTIONAL*>_<LOCUS_TYPE>_<MOLECULE_TYPE *OPTIONAL*>
+
+    i.e. pfcrt_76_SNP_AA or pfmdr1_CN. Returns a dictionary containing the
+    locus name, position, marker type and molecule type; position and
+    molecule type are None for copy number and fragment markers.
+    """
+    elements = columnName.strip().split('_')
+
+    if len(elements) == 2:
+        markerType = MARKER_TYPES.get(elements[-1].lower())
+        if markerType is None:
+            raise TemplateFormatException('Marker column %s contains a malformed marker type' % columnName)
+
+        return {'name': elements[0], 'position': None, 'type': markerType, 'molecule_type': None}
+    elif len(elements) == 4:
+        moleculeType = MOLECULE_TYPES.get(elements[-1].lower())
+        if moleculeType is None:
+            raise TemplateFormatException('Marker column %s contains a malformed molecule type' % columnName)
+
+        return {'name': elements[0], 'position': elements[1], 'type': 'SNP', 'molecule_type': moleculeType}
+    else:
+        raise TemplateFormatException('Marker column %s is malformed' % columnName)
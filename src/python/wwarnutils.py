@@ -4,13 +4,20 @@
 # This module contains utility functions that are used across the WWARN 
 # calculation scripts
 #
-import MySQLdb
 import datetime
+import importlib
 
 from collections import OrderedDict
 from pprint import pprint as pp_pprint
 from wwarnexceptions import AgeGroupException, CopyNumberGroupException
 
+# Optional modules (i.e. numpy) already looked for by importOptionalModule
+_optionalModules = {}
+
+# The canonical spelling of genotype values that denote a failed or missing
+# genotype call, keyed on their lowercase form
+INVALID_GENOTYPES = {'not genotyped': 'Not Genotyped', 'genotyping failure': 'Genotyping Failure'}
+
 def commaDelimToTuple(str):
     """
     Splits a comma-delimited list and converts it to a tuple
@@ -132,6 +139,19 @@ def preBinCopyNumberData(copyNum, bins):
 
     return binName
 
+def importOptionalModule(name):
+    """
+    Imports an optional module the first time it is needed rather than when
+    our modules are loaded, returning None if it is not installed. The outcome
+    is remembered so a missing module is only looked for once.
+    """
+    if name not in _optionalModules:
+        try:
+            _optionalModules[name] = importlib.import_module(name)
+        except ImportError:
+            _optionalModules[name] = None
+
+    return _optionalModules[name]
 
 def pprint(obj, *args, **kwrds):
     """
@@ -150,6 +170,30 @@ def pprint(obj, *args, **kwrds):
             print "    %r:%r" % (key, obj[key])
         print "}"
 
+def canonicalGenotype(genotype):
+    """
+    Normalizes a single genotype call so that equivalent calls are always
+    represented by the same string:
+
+        ' K/T '               --> 'K/T'
+        'T/K'                 --> 'K/T'
+        'not genotyped'       --> 'Not Genotyped'
+        'GENOTYPING FAILURE'  --> 'Genotyping Failure'
+
+    The alleles of a mixed genotype are sorted so that A/B and B/A are counted
+    together.
+    """
+    genotype = genotype.strip()
+
+    invalid = INVALID_GENOTYPES.get(genotype.lower())
+    if invalid is not None:
+        return invalid
+
+    if genotype.find('/') != -1:
+        genotype = '/'.join(sorted([a.strip() for a in genotype.split('/')]))
+
+    return genotype
+
 def validateGenotypes(genotypes, invalidGenotypes=['not genotyped', 'genotyping failure']):
     """
     Validates our genotypes to ensure that they do not fall in one of 
@@ -167,12 +211,58 @@ def validateGenotypes(genotypes, invalidGenotypes=['not genotyped', 'genotyping
 
     return validBool
 
-def open_db_connection(hostname, db_name, username, password):
+def parseMutantStatusTable(statusFile, codons=None, statuses=None):
+    """
+    Parses the mutant status table into a lookup keyed on (LOCUS NAME, 
+    LOCUS POSITION, GENOTYPE). The table is a tab-delimited file with four
+    columns:
+
+        <LOCUS NAME>\t<LOCUS POSITION>\t<CODON>\t<MUTANT STATUS>
+        pfcrt\t76\tK/T\tMixed
+
+    Genotypes are stored in their canonical form so a mixed genotype is found
+    regardless of the order its alleles are listed in. If a collection of valid
+    codons or mutant statuses is passed in (i.e. the [CODON] and [MUTANT_STATUS]
+    sections of the WWARN configuration file) any line containing a value not 
+    found in them is skipped with a warning.
+    """
+    statusLookup = {}
+
+    statusFH = open(statusFile)
+    for line in statusFH:
+        if line.startswith('#') or not line.strip():
+            continue
+
+        (name, position, codon, status) = line.rstrip('\r\n').split('\t')
+
+        if not position.isdigit():
+            print "WARN: %s contains a malformed position - %s" % (line.rstrip(), position)
+            continue
+
+        if codons is not None and not all(c in codons for c in codon.split('/')):
+            print "WARN: %s contains a malformed codon value - %s" % (line.rstrip(), codon)
+            continue
+
+        if statuses is not None and status not in statuses:
+            print "WARN: %s contains a malformed mutant status - %s" % (line.rstrip(), status)
+            continue
+
+        statusLookup[(name, position, canonicalGenotype(codon))] = status
+
+    statusFH.close()
+    return statusLookup
+
+def open_db_connection(hostname, db_name, username, password, **kwargs):
     """
     Opens a connection to the database specified by the passed in arguments
-    to this function
+    to this function. Any additional keyword arguments are handed on to 
+    MySQLdb.connect
     """
-    db_conn = MySQLdb.connect(host=hostname, user=username, passwd=password, db=db_name)
+    # MySQLdb is only imported when a database connection is actually requested
+    # so that the template-only calculations do not pay for loading it
+    import MySQLdb
+
+    db_conn = MySQLdb.connect(host=hostname, user=username, passwd=password, db=db_name, **kwargs)
     return db_conn
 
 def create_year_bins(step, bounds):
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+##
+# This module validates a WWARN template while it is being read, replacing the
+# separate validation run of the Perl loader.
+#
+# A TemplateValidator is compiled into the configuration bundle (see
+# wwarnconfig.py) from the [CODON] section of the INI file and the mutant
+# status table, so every check made against a row is a single set lookup.
+# The following problems are reported:
+#
+#     marker_column - a marker column header that is malformed or names a SNP
+#                     locus missing from the mutant status table
+#     codon         - an allele of a SNP genotype that is not a valid codon
+#     date          - a date of inclusion or sample collection date that is
+#                     not of the form YYYY-MM-DD
+#     age           - an age that is not a number or falls outside of
+#                     MIN_AGE - MAX_AGE years
+#
+# Problems are collected in a ValidationReport along with the line and column
+# of the template they were found at:
+#
+#     # LINE\tCOLUMN\tCOLUMN NAME\tCATEGORY\tVALUE\tMESSAGE
+#     14\t10\tpfcrt_76_SNP_AA\tcodon\tK/X\tX is not a valid codon
+#
+# The template calculations validate a template as it is tabulated, writing
+# the report next to their output (see getDefaultReportPath).
+#
+
+from collections import OrderedDict
+from datetime import datetime
+from wwarncompress import getOutputCompression, COMPRESSION_EXTENSIONS
+from wwarnexceptions import TemplateFormatException
+from wwarntemplate import parseMarkerColumn, MARKER_START_COL
+from wwarnutils import validateGenotypes
+
+# Columns of a WWARN template checked by our validator
+AGE_COL = 6
+DATE_COLS = [7, 8]
+
+# Ages (in years) outside of this range are reported as out of range
+MIN_AGE = 0
+MAX_AGE = 120
+
+# Ages that mark a patient's age as unknown
+NO_AGE_VALUES = ['', 'NODATA']
+
+# Codon used in the mutant status table for a position without data, which
+# is never a valid allele in a template
+NULL_CODON = 'null'
+
+VALIDATION_CATEGORIES = ['marker_column', 'codon', 'date', 'age']
+
+def getDefaultReportPath(outputFile):
+    """
+    Returns the path the validation report of a template output file is
+    written to. The report is never compressed so any compression extension
+    of the output file is dropped.
+    """
+    compression = getOutputCompression(outputFile)
+    if compression is not None:
+        outputFile = outputFile[:-len(COMPRESSION_EXTENSIONS[compression])]
+
+    return outputFile + '.validation.txt'
+
+class ValidationReport(object):
+    """
+    Collects the problems found while validating a template
+    """
+    def __init__(self):
+        self.issues = []
+
+    def addIssue(self, line, column, columnName, category, value, message):
+        """
+        Records a problem found at the given line and (0-based) column of a
+        template
+        """
+        self.issues.append((line, column + 1, columnName, category, value, message))
+
+    def addReport(self, report, lineOffset=0):
+        """
+        Adds the problems collected in another report, shifting their line
+        numbers by the passed in offset (i.e. for a report of part of a
+        template whose lines were numbered from the start of that part)
+        """
+        for issue in report.issues:
+            self.issues.append((issue[0] + lineOffset,) + issue[1:])
+
+    def hasIssues(self):
+        return len(self.issues) > 0
+
+    def getCounts(self):
+        """
+        Returns the number of problems found in each category
+        """
+        counts = OrderedDict([(c, 0) for c in VALIDATION_CATEGORIES])
+        for issue in self.issues:
+            counts[issue[3]] += 1
+
+        return counts
+
+    def write(self, reportFile):
+        reportFH = open(reportFile, 'w')
+        reportFH.write("# LINE\tCOLUMN\tCOLUMN NAME\tCATEGORY\tVALUE\tMESSAGE\n")
+
+        for issue in self.issues:
+            reportFH.write("\t".join([str(v) for v in issue]))
+            reportFH.write("\n")
+
+        reportFH.close()
+
+class TemplateValidator(object):
+    """
+    Checks the header and rows of a WWARN template against the valid codons
+    and the SNP loci found in the mutant status table
+    """
+    def __init__(self, codons=None, mutantStatus=None, minAge=MIN_AGE, maxAge=MAX_AGE):
+        self.codons = None
+        if codons is not None:
+            self.codons = frozenset([c for c in codons if c != NULL_CODON])
+
+        self.knownLoci = None
+        if mutantStatus is not None:
+            self.knownLoci = frozenset([(name, position) for (name, position, genotype) in mutantStatus])
+
+        self.minAge = minAge
+        self.maxAge = maxAge
+
+    def validateHeader(self, line, header, report):
+        """
+        Parses the marker columns of a template header reporting any column
+        that is malformed or names an unknown SNP locus. Returns the list of
+        parsed marker columns (see parseMarkerColumn) with None in place of
+        each malformed column.
+        """
+        markerColumns = []
+
+        for (i, columnName) in enumerate(header[MARKER_START_COL:], MARKER_START_COL):
+            try:
+                marker = parseMarkerColumn(columnName)
+            except TemplateFormatException as e:
+                report.addIssue(line, i, columnName, 'marker_column', columnName, e.error_msg)
+                markerColumns.append(None)
+                continue
+
+            if (self.knownLoci is not None and marker.get('type') == 'SNP' and
+                    (marker.get('name'), marker.get('position')) not in self.knownLoci):
+                report.addIssue(line, i, columnName, 'marker_column', columnName,
+                                'Locus %s %s is not in the mutant status table' % (marker.get('name'), marker.get('position')))
+
+            markerColumns.append(marker)
+
+        return markerColumns
+
+    def validateRow(self, line, fields, header, markerColumns, report):
+        """
+        Checks the age, dates and SNP genotypes of a single row of template
+        data, reporting any problem found
+        """
+        age = fields[AGE_COL]
+        if age not in NO_AGE_VALUES:
+            try:
+                if not self.minAge <= float(age) <= self.maxAge:
+                    report.addIssue(line, AGE_COL, header[AGE_COL], 'age', age,
+                                    'Age is outside of %s - %s years' % (self.minAge, self.maxAge))
+            except ValueError:
+                report.addIssue(line, AGE_COL, header[AGE_COL], 'age', age, 'Age is not a number')
+
+        for i in DATE_COLS:
+            if fields[i]:
+                try:
+                    datetime.strptime(fields[i], '%Y-%m-%d')
+                except ValueError:
+                    report.addIssue(line, i, header[i], 'date', fields[i], 'Date is not of the form YYYY-MM-DD')
+
+        if self.codons is None:
+            return
+
+        for (i, (marker, value)) in enumerate(zip(markerColumns, fields[MARKER_START_COL:]), MARKER_START_COL):
+            if not value or marker is None or marker.get('type') != 'SNP' or not validateGenotypes([value]):
+                continue
+
+            badCodons = [a for a in [a.strip() for a in value.split('/')] if a not in self.codons]
+            if badCodons:
+                report.addIssue(line, i, header[i], 'codon', value,
+                                '%s is not a valid codon' % ", ".join(badCodons))
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+
+##
+# This script watches a directory for WWARN templates and keeps a running
+# aggregate of the statistics calculated from all of them.
+#
+# Only templates that are new or whose contents have changed (detected by
+# their SHA1 digest) are tabulated. The counts tabulated from each template
+# are persisted alongside the aggregate so that when a template changes or
+# is removed only the study/site cells it contributed to are recalculated
+# and only the output tables of those cells are rewritten. Each cell is
+# written to its own output file in the output directory.
+#
+
+import argparse
+import cPickle
+import fnmatch
+import os
+import re
+import time
+
+from collections import OrderedDict
+from os.path import join
+from WWARN_template_calculations import createFileIterator, createOutputWWARNTables
+from wwarncalculations import tabulateMarkerCounts, mergeCountStates, calculatePrevalenceStatistic
+from wwarnconfig import loadConfigBundle, hashFile
+
+# Bumped whenever the layout of our persisted watch state changes
+WATCH_STATE_VERSION = 1
+
+# Templates modified less than this many seconds ago are assumed to still be
+# in the middle of being copied into the watch directory and are left for the
+# next poll
+SETTLE_SECONDS = 5
+
+def buildArgParser():
+    """
+    Creates an argparser object using the command-line arguments passed into this script
+    """
+    parser = argparse.ArgumentParser(description='Watches a directory for WWARN templates maintaining a running '
+                                        + 'aggregate of the sample size and prevalence calculations of all of them')
+    parser.add_argument('-w', '--watch_directory', required=True, help='Directory WWARN templates (tab-delimited '
+                            + 'text files produced from the TEMPLATE worksheet) are dropped into')
+    parser.add_argument('-c', '--config_file', required=True, help='A configuration file containing parameters '
+                            + 'required for execution of the calculations script.')
+    parser.add_argument('-m', '--marker_list', required=True, help='A list of all possible markers that should be '
+                            + 'looked at in tabulating these statistics.')
+    parser.add_argument('-o', '--output_directory', required=True, help='Directory the output tables of each '
+                            + 'study/site are written to')
+    parser.add_argument("-b", "--bin-by-year", required=False, help="Bin all studies by a year range. "
+                            + "This year range should be defined in a digit representing the number of years "
+                            + "to create bins with (i.e. 1 = 1 year = 365 days)", type=int, dest="year_step")
+    parser.add_argument('-p', '--pattern', required=False, default='*.txt', help='Only files matching this '
+                            + 'pattern are treated as templates. Defaults to *.txt')
+    parser.add_argument('--poll_interval', required=False, type=int, default=30, help='Number of seconds to wait '
+                            + 'between checks of the watch directory')
+    parser.add_argument('--state_file', required=False, help='File the running aggregate is persisted to. '
+                            + 'Defaults to wwarn_watch.state in the output directory')
+    parser.add_argument('--once', required=False, action='store_true', default=False, help='Check the watch '
+                            + 'directory a single time and exit')
+    parser.add_argument('--config_bundle', required=False, help='The compiled configuration bundle to use. Defaults '
+                            + 'to the configuration file path with a .bundle extension')
+    args = parser.parse_args()
+
+    return args
+
+def createWatchState(signature):
+    """
+    Returns an empty watch state in the following format:
+
+        { 'version': <WATCH_STATE_VERSION>,
+          'signature': <SIGNATURE>,
+          'files': { <TEMPLATE PATH>: { 'mtime': <MTIME>, 'size': <SIZE>, 'digest': <SHA1>,
+                                        'counts': <STATE VARIABLE> } },
+          'aggregate': <STATE VARIABLE> }
+
+    The counts of each template are the counts tabulated from that template
+    alone while the aggregate holds the merged counts and prevalence of every
+    template.
+    """
+    return { 'version': WATCH_STATE_VERSION,
+             'signature': signature,
+             'files': {},
+             'aggregate': OrderedDict() }
+
+def readWatchState(stateFile, signature):
+    """
+    Reads our persisted watch state returning a fresh state if none exists or
+    the persisted state was built with different calculation parameters
+    """
+    if not os.path.exists(stateFile):
+        return createWatchState(signature)
+
+    stateFH = open(stateFile, 'rb')
+    try:
+        watchState = cPickle.load(stateFH)
+    except Exception:
+        watchState = None
+    finally:
+        stateFH.close()
+
+    if (not isinstance(watchState, dict) or watchState.get('version') != WATCH_STATE_VERSION
+            or watchState.get('signature') != signature):
+        print "WARN: Discarding watch state %s, all templates will be tabulated again" % stateFile
+        return createWatchState(signature)
+
+    return watchState
+
+def writeWatchState(watchState, stateFile):
+    """
+    Persists our watch state, writing to a temporary file first so a crash
+    never leaves a partially written state behind
+    """
+    tmpFile = "%s.%s.tmp" % (stateFile, os.getpid())
+    stateFH = open(tmpFile, 'wb')
+    cPickle.dump(watchState, stateFH, cPickle.HIGHEST_PROTOCOL)
+    stateFH.close()
+    os.rename(tmpFile, stateFile)
+
+def findTemplates(watchDir, pattern):
+    """
+    Returns the sorted list of all templates in the watch directory
+    """
+    return sorted([join(watchDir, f) for f in os.listdir(watchDir)
+                   if fnmatch.fnmatch(f, pattern) and os.path.isfile(join(watchDir, f))])
+
+def findChangedTemplates(templates, watchState):
+    """
+    Compares the templates currently in the watch directory against our watch
+    state. Returns a tuple of the list of (TEMPLATE, DIGEST) tuples for new or
+    changed templates and the list of templates that have been removed.
+
+    A template whose modification time and size are unchanged is not read at
+    all; otherwise its digest is compared against the digest it was last
+    tabulated with so that a template that is simply touched is not tabulated
+    again.
+    """
+    changed = []
+    now = time.time()
+
+    for template in templates:
+        stat = os.stat(template)
+        known = watchState['files'].get(template)
+
+        if known and known['mtime'] == stat.st_mtime and known['size'] == stat.st_size:
+            continue
+
+        if now - stat.st_mtime < SETTLE_SECONDS:
+            continue
+
+        digest = hashFile(template)
+        if known and known['digest'] == digest:
+            known['mtime'] = stat.st_mtime
+            known['size'] = stat.st_size
+            continue
+
+        changed.append((template, digest))
+
+    removed = [t for t in watchState['files'] if t not in templates]
+    return (changed, removed)
+
+def tabulateTemplate(template, bundle, year_step):
+    """
+    Tabulates the counts of a single template into its own state variable
+    """
+    counts = OrderedDict()
+    stratification = bundle['stratification']
+    dataIter = createFileIterator(template, bundle['copy_number_groups'], bundle['marker_catalog'], year_step,
+                                  stratification.getExtraColumns())
+    tabulateMarkerCounts(counts, dataIter, stratification)
+
+    return counts
+
+def updateWatchState(watchState, changed, removed, bundle, year_step):
+    """
+    Tabulates every new or changed template and drops removed templates from
+    our watch state, then rebuilds the aggregate of every study/site cell these
+    templates contributed to. Returns the list of affected metadata keys.
+
+    A template that fails to tabulate is left as it was in our watch state.
+    """
+    files = watchState['files']
+    affected = set()
+
+    for template in removed:
+        affected.update(files.pop(template)['counts'].keys())
+
+    for (template, digest) in changed:
+        # A template that cannot be tabulated (i.e. one still being copied in)
+        # keeps the counts it was last tabulated with. Its modification time
+        # and size are left as they were so it is tried again on the next poll.
+        try:
+            counts = tabulateTemplate(template, bundle, year_step)
+        except Exception, e:
+            print "WARN: Could not tabulate %s, will retry: %s" % (template, e)
+            continue
+
+        if template in files:
+            affected.update(files[template]['counts'].keys())
+
+        stat = os.stat(template)
+        files[template] = { 'mtime': stat.st_mtime, 'size': stat.st_size, 'digest': digest, 'counts': counts }
+        affected.update(counts.keys())
+
+    # Each affected cell is rebuilt from the counts of every template that
+    # contributes to it, in template order, so its statistics are the same as
+    # if all templates had been tabulated in one run
+    aggregate = watchState['aggregate']
+    for metaKey in affected:
+        cell = OrderedDict()
+        for template in sorted(files):
+            templateCounts = files[template]['counts']
+            if metaKey in templateCounts:
+                mergeCountStates(cell, OrderedDict([(metaKey, templateCounts[metaKey])]))
+
+        if cell:
+            calculatePrevalenceStatistic(cell)
+            aggregate[metaKey] = cell[metaKey]
+        elif metaKey in aggregate:
+            del aggregate[metaKey]
+
+    return sorted(affected)
+
+def getCellOutputFile(outputDir, metaKey):
+    """
+    Returns the output file the tables of a study/site cell are written to
+    """
+    (studyId, label, country, site, investigator) = metaKey
+    cellName = re.sub(r'[^\w.-]+', '_', "%s_%s_%s" % (studyId, label, site))
+
+    return join(outputDir, cellName + '.calcs')
+
+def writeCellTables(watchState, metaKeys, markerCatalog, outputDir):
+    """
+    Rewrites the output tables of each of the passed in study/site cells,
+    removing the output of cells that no longer hold any data
+    """
+    aggregate = watchState['aggregate']
+
+    for metaKey in metaKeys:
+        outputFile = getCellOutputFile(outputDir, metaKey)
+
+        if metaKey in aggregate:
+            createOutputWWARNTables(OrderedDict([(metaKey, aggregate[metaKey])]), markerCatalog, outputFile)
+        elif os.path.exists(outputFile):
+            os.remove(outputFile)
+
+def main(parser):
+    bundle = loadConfigBundle(parser.config_file, parser.marker_list, parser.config_bundle)
+    stateFile = parser.state_file or join(parser.output_directory, 'wwarn_watch.state')
+
+    # Our persisted counts can only be reused if they were tabulated with the
+    # same groups, combination markers and year bins
+    signature = (bundle['stratification'], bundle['copy_number_groups'],
+                 bundle['marker_catalog'].getCombinations(), parser.year_step)
+    watchState = readWatchState(stateFile, signature)
+
+    while True:
+        templates = findTemplates(parser.watch_directory, parser.pattern)
+        (changed, removed) = findChangedTemplates(templates, watchState)
+
+        if changed or removed:
+            affected = updateWatchState(watchState, changed, removed, bundle, parser.year_step)
+            writeCellTables(watchState, affected, bundle['marker_catalog'], parser.output_directory)
+            writeWatchState(watchState, stateFile)
+
+            print "DEBUG: Tabulated %s template(s), removed %s, rewrote %s study/site table(s)" % (len(changed),
+                                                                                                 len(removed),
+                                                                                                 len(affected))
+
+        if parser.once:
+            break
+
+        time.sleep(parser.poll_interval)
+
+if __name__ == "__main__":
+    main(buildArgParser())
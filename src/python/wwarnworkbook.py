@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+
+##
+# This module reads the TEMPLATE worksheet straight out of a WWARN template
+# workbook (.xlsx, .xlsm, .xltx or .xltm) so that a filled in template can be
+# used as input without first exporting it to a tab-delimited text file from
+# Excel.
+#
+# A workbook is a zip archive of XML parts. The worksheet part is streamed out
+# of the archive and parsed incrementally, one row at a time, with every row
+# discarded once it has been read, so memory use does not grow with the size
+# of the sheet. The shared strings table, which most text cells refer to by
+# index, is read once when the workbook is opened.
+#
+# TemplateWorkbook presents the worksheet as a read-only file of the lines the
+# tab-delimited export of the sheet would hold, so it can be handed to
+# anything that reads a template file (see wwarntemplate.py):
+#
+#     #STUDY_ID\tINVESTIGATOR\t...\tpfcrt_76_SNP_AA
+#     S1\tInv A\t...\tK/T
+#
+# Rows preceding the column header and rows without any values are skipped,
+# dates are written as YYYY-MM-DD and numbers with at most the 15 significant
+# digits Excel displays.
+#
+
+import datetime
+import posixpath
+import re
+import zipfile
+
+from xml.etree.cElementTree import iterparse, XMLParser
+from wwarnexceptions import TemplateFormatException
+
+# Name of the worksheet holding template data and the name of the first
+# column of its header row
+TEMPLATE_SHEET = 'TEMPLATE'
+HEADER_START_COL = 'STUDY_ID'
+
+# File extensions of the workbook formats we can read
+WORKBOOK_EXTENSIONS = ('.xlsx', '.xlsm', '.xltx', '.xltm')
+
+SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+RELATIONSHIP_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_RELATIONSHIP_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+OFFICE_DOCUMENT_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+
+# Worksheet elements read while streaming a sheet. Cell values are held in v
+# elements, or t elements of an inline string, and phonetic hints (rPh) are
+# left out of the text of an inline string.
+ROW_TAG = SHEET_NS + 'row'
+CELL_TAG = SHEET_NS + 'c'
+PHONETIC_TAG = SHEET_NS + 'rPh'
+TEXT_TAGS = (SHEET_NS + 'v', SHEET_NS + 't')
+
+# Number of bytes of worksheet XML parsed at a time
+READ_BLOCK_SIZE = 64 * 1024
+
+# Built-in number formats that display a date
+BUILTIN_DATE_FORMATS = set(range(14, 23) + range(27, 37) + range(45, 48) + range(50, 59))
+
+# Quoted text, escaped characters and [colour]/[condition] sections of a
+# number format code, none of which make a format a date format
+FORMAT_LITERALS = re.compile(r'"[^"]*"|\\.|\[[^\]]*\]')
+
+EPOCH_1900 = datetime.datetime(1899, 12, 30)
+EPOCH_1904 = datetime.datetime(1904, 1, 1)
+
+def isTemplateWorkbook(inputFile):
+    """
+    Returns True if the passed in template file is a workbook rather than a
+    tab-delimited text file
+    """
+    return inputFile.lower().endswith(WORKBOOK_EXTENSIONS)
+
+class TemplateWorkbook(object):
+    """
+    A read-only file of the tab-delimited lines of the TEMPLATE worksheet of
+    a workbook. tell() and seek() work in lines rather than bytes; seeking
+    restarts the stream from the top of the sheet.
+    """
+    def __init__(self, workbookFile, sheetName=TEMPLATE_SHEET):
+        self.workbookFile = workbookFile
+        self.sheetName = sheetName
+        self.zipFile = zipfile.ZipFile(workbookFile)
+
+        (self.sheetPath, epoch) = findWorksheet(self.zipFile, sheetName)
+        self.sharedStrings = readSharedStrings(self.zipFile)
+        self.dateStyles = readDateStyles(self.zipFile)
+        self.epoch = epoch
+
+        self.position = 0
+        self._lines = None
+        self.seek(0)
+
+    def readline(self):
+        try:
+            line = self._lines.next()
+        except StopIteration:
+            return ''
+
+        self.position += 1
+        return line + '\n'
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if whence != 0:
+            raise IOError("Workbook templates can only be seeked from the start of the sheet")
+
+        self._lines = self._iterateLines()
+        self.position = 0
+
+        while self.position < offset and self.readline():
+            pass
+
+    def close(self):
+        self._lines = None
+        self.zipFile.close()
+
+    def _iterateLines(self):
+        """
+        Yields the tab-delimited line of each row of our sheet, starting with
+        the column header
+        """
+        width = None
+
+        for cells in iterateSheetRows(self.zipFile, self.sheetPath, self.sharedStrings, self.dateStyles, self.epoch):
+            if not any(cells):
+                continue
+
+            if cells[0].startswith('#METADATA'):
+                yield cells[0]
+                continue
+
+            # Anything above the column header (i.e. instructions) is skipped
+            # and every row below it is written out as wide as the header
+            if width is None:
+                if cells[0].lstrip('#') != HEADER_START_COL:
+                    continue
+
+                while not cells[-1]:
+                    cells.pop()
+
+                width = len(cells)
+                cells[0] = '#' + cells[0].lstrip('#')
+            elif len(cells) < width:
+                cells.extend([''] * (width - len(cells)))
+            else:
+                del cells[width:]
+
+            yield "\t".join(cells)
+
+        if width is None:
+            raise TemplateFormatException('%s sheet of workbook %s has no %s column header' %
+                                          (self.sheetName, self.workbookFile, HEADER_START_COL))
+
+def findWorksheet(zipFile, sheetName):
+    """
+    Finds the part holding the named worksheet of a workbook, returning a
+    tuple of the path of the part within the archive and the epoch the
+    workbook's date serial numbers count from
+    """
+    workbookPath = 'xl/workbook.xml'
+    for (relType, target) in readRelationships(zipFile, '').itervalues():
+        if relType == OFFICE_DOCUMENT_TYPE:
+            workbookPath = target
+
+    sheetId = None
+    epoch = EPOCH_1900
+
+    workbookFH = zipFile.open(workbookPath)
+    for (event, elem) in iterparse(workbookFH):
+        if elem.tag == SHEET_NS + 'workbookPr' and elem.get('date1904') in ('1', 'true'):
+            epoch = EPOCH_1904
+        elif elem.tag == SHEET_NS + 'sheet' and elem.get('name') == sheetName:
+            sheetId = elem.get(RELATIONSHIP_NS + 'id')
+    workbookFH.close()
+
+    target = readRelationships(zipFile, workbookPath).get(sheetId)
+    if target is None:
+        raise TemplateFormatException('Workbook %s does not contain a %s sheet' % (zipFile.filename, sheetName))
+
+    return (target[1], epoch)
+
+def readRelationships(zipFile, partPath):
+    """
+    Reads the relationships of a part of a workbook (the package itself when
+    partPath is ''), returning a dictionary in the following format:
+
+        { <RELATIONSHIP ID>: (<TYPE>, <TARGET PART PATH>) }
+    """
+    (partDir, partName) = posixpath.split(partPath)
+    relsPath = posixpath.join(partDir, '_rels', partName + '.rels')
+
+    relationships = {}
+    if relsPath not in zipFile.namelist():
+        return relationships
+
+    relsFH = zipFile.open(relsPath)
+    for (event, elem) in iterparse(relsFH):
+        if elem.tag == PACKAGE_RELATIONSHIP_NS + 'Relationship':
+            target = elem.get('Target')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join(partDir, target))
+
+            relationships[elem.get('Id')] = (elem.get('Type'), target)
+    relsFH.close()
+
+    return relationships
+
+def readSharedStrings(zipFile):
+    """
+    Reads the shared strings table of a workbook into a list indexed by the
+    values of shared string cells
+    """
+    strings = []
+    if 'xl/sharedStrings.xml' not in zipFile.namelist():
+        return strings
+
+    stringsFH = zipFile.open('xl/sharedStrings.xml')
+    for (event, elem) in iterparse(stringsFH):
+        if elem.tag == SHEET_NS + 'si':
+            strings.append(readCellText(elem))
+            elem.clear()
+    stringsFH.close()
+
+    return strings
+
+def readCellText(elem):
+    """
+    Returns the text of a shared or inline string. Rich text strings are split
+    into several runs whose text is joined back together; phonetic hints are
+    left out.
+    """
+    text = elem.findtext(SHEET_NS + 't')
+    if text is None:
+        text = "".join([r.findtext(SHEET_NS + 't') or '' for r in elem.findall(SHEET_NS + 'r')])
+
+    return text.encode('utf-8')
+
+def readDateStyles(zipFile):
+    """
+    Returns the set of cell style indexes of a workbook that display numbers
+    as dates
+    """
+    dateStyles = set()
+    if 'xl/styles.xml' not in zipFile.namelist():
+        return dateStyles
+
+    dateFormats = set(BUILTIN_DATE_FORMATS)
+    styleIndex = None
+
+    stylesFH = zipFile.open('xl/styles.xml')
+    for (event, elem) in iterparse(stylesFH, events=('start', 'end')):
+        if event == 'start' and elem.tag == SHEET_NS + 'cellXfs':
+            styleIndex = 0
+        elif event == 'end' and elem.tag == SHEET_NS + 'numFmt':
+            formatCode = FORMAT_LITERALS.sub('', elem.get('formatCode', '')).lower()
+            if 'd' in formatCode or 'y' in formatCode:
+                dateFormats.add(int(elem.get('numFmtId')))
+        elif event == 'end' and elem.tag == SHEET_NS + 'xf' and styleIndex is not None:
+            # Cell styles (cellXfs) follow the named styles (cellStyleXfs)
+            # whose xf elements we are not interested in
+            if int(elem.get('numFmtId', 0)) in dateFormats:
+                dateStyles.add(styleIndex)
+            styleIndex += 1
+        elif event == 'end' and elem.tag == SHEET_NS + 'cellXfs':
+            styleIndex = None
+    stylesFH.close()
+
+    return dateStyles
+
+def iterateSheetRows(zipFile, sheetPath, sharedStrings, dateStyles, epoch):
+    """
+    Streams the rows of a worksheet out of a workbook, yielding each row as a
+    list of cell values converted to text. Cells missing from a row (the sheet
+    only holds cells that have a value or a style) are filled in with ''.
+    """
+    sheetFH = zipFile.open(sheetPath)
+    reader = SheetRowReader(sharedStrings, dateStyles, epoch)
+    parser = XMLParser(target=reader)
+
+    # Rows are handed on as soon as each block of the sheet has been parsed,
+    # so no more than a block's worth of rows is ever held in memory
+    while True:
+        block = sheetFH.read(READ_BLOCK_SIZE)
+        if not block:
+            break
+
+        parser.feed(block)
+        for cells in reader.rows:
+            yield cells
+        reader.rows = []
+
+    parser.close()
+    sheetFH.close()
+
+    for cells in reader.rows:
+        yield cells
+
+class SheetRowReader(object):
+    """
+    Parser target that converts the cells of a worksheet to text as they are
+    parsed, collecting each completed row in rows
+    """
+    def __init__(self, sharedStrings, dateStyles, epoch):
+        self.sharedStrings = sharedStrings
+        self.dateStyles = dateStyles
+        self.epoch = epoch
+        self.rows = []
+        self._cells = None
+        self._cell = None
+        self._text = None
+        self._inText = False
+        self._inPhonetic = False
+        self._columns = {}
+
+    def start(self, tag, attrib):
+        if tag == CELL_TAG:
+            self._cell = attrib
+            self._text = []
+        elif tag == ROW_TAG:
+            self._cells = []
+        elif tag == PHONETIC_TAG:
+            self._inPhonetic = True
+        elif tag in TEXT_TAGS and self._cell is not None and not self._inPhonetic:
+            self._inText = True
+
+    def data(self, data):
+        if self._inText:
+            self._text.append(data)
+
+    def end(self, tag):
+        if tag in TEXT_TAGS:
+            self._inText = False
+        elif tag == PHONETIC_TAG:
+            self._inPhonetic = False
+        elif tag == CELL_TAG:
+            cells = self._cells
+            ref = self._cell.get('r')
+            column = self._getColumnIndex(ref) if ref else len(cells)
+            if column > len(cells):
+                cells.extend([''] * (column - len(cells)))
+
+            cells.append(self._readCellValue(self._cell, "".join(self._text)))
+            self._cell = None
+        elif tag == ROW_TAG:
+            self.rows.append(self._cells)
+            self._cells = None
+
+    def close(self):
+        pass
+
+    def _getColumnIndex(self, ref):
+        """
+        Converts the column letters of a cell reference into a 0-based column
+        index, i.e. A3 -> 0 and AB12 -> 27
+        """
+        letters = ref.rstrip('0123456789')
+        index = self._columns.get(letters)
+
+        if index is None:
+            index = 0
+            for char in letters.upper():
+                index = index * 26 + ord(char) - ord('A') + 1
+
+            index -= 1
+            self._columns[letters] = index
+
+        return index
+
+    def _readCellValue(self, cell, text):
+        """
+        Converts the value of a single cell to the text it is exported as
+        """
+        cellType = cell.get('t', 'n')
+
+        if not text and cellType != 'inlineStr':
+            return ''
+
+        if cellType == 's':
+            value = self.sharedStrings[int(text)]
+        elif cellType == 'b':
+            value = 'TRUE' if text == '1' else 'FALSE'
+        elif cellType == 'n':
+            number = float(text)
+            if int(cell.get('s', 0)) in self.dateStyles:
+                value = (self.epoch + datetime.timedelta(days=number)).strftime('%Y-%m-%d')
+            else:
+                value = '%.15g' % number
+        else:
+            value = text.encode('utf-8')
+
+        # A tab or line break inside a cell would split it across columns or rows
+        if '\t' in value or '\n' in value or '\r' in value:
+            value = value.replace('\t', ' ').replace('\r', ' ').replace('\n', ' ')
+
+        return value